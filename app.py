@@ -1,11 +1,22 @@
 import streamlit as st
+import os
 import time
-from PIL import Image, ImageEnhance, ImageFilter
-from datetime import datetime
-import plotly.graph_objects as go
-import torch
-from transformers import CLIPProcessor, CLIPModel
+import uuid
 import random
+import functools
+
+# torch / transformers / plotly 都在用到的地方才导入，首页不等模型
+from cascade import CASCADE
+from categories import CATEGORIES
+from history_store import HistoryStore
+from inference_server import ADMISSION_TIMEOUT, GATE, Busy, MicroBatcher, configure_threads
+from metrics import METRICS, start_exporters
+from preload import BackgroundLoader
+from profiling import PROFILER
+from preprocess import decode_image
+from correction_index import CorrectionIndex
+from result_cache import ResultCache
+from stream_classify import STREAM_FPS, STREAM_SOURCE
 
 # ==================================================
 # 1. 页面配置 (必须在最前面)
@@ -86,11 +97,9 @@ st.markdown("""
 # ==================================================
 def init_session_state():
     defaults = {
-        "history": [],
-        "total_points": 0,
-        "username": "EcoCitizen",
         "lang": "kr",  # 默认韩语
         "current_tab": None,
+        "awarded_keys": set(),  # 已计分物品的内容哈希，重复扫描不再加分
     }
     for key, value in defaults.items():
         if key not in st.session_state:
@@ -98,6 +107,27 @@ def init_session_state():
 
 init_session_state()
 
+@st.cache_resource
+def get_history_store():
+    # 进程内唯一：扫描记录和积分写 SQLite (ECOSCAN_DB_PATH)，重启不丢
+    return HistoryStore()
+
+def init_user():
+    # 没有登录系统：用 URL 上的 ?uid= 标识用户，收藏这个链接即可在重启后找回积分和记录
+    if "user_id" not in st.session_state:
+        uid = st.query_params.get("uid") or uuid.uuid4().hex
+        st.query_params["uid"] = uid
+        st.session_state.user_id = uid
+        st.session_state.username = get_history_store().username(uid) or "EcoCitizen"
+
+init_user()
+
+def user_totals():
+    """
+    (扫描次数, 总积分)，来自 users 表的增量汇总
+    """
+    return get_history_store().totals(st.session_state.user_id)
+
 # ==================================================
 # 4. 严格的多语言字典
 # ==================================================
@@ -122,10 +152,19 @@ TRANSLATIONS = {
 
         "upload_btn": "📂 사진 업로드", "camera_btn": "📷 카메라",
         "scan_action": "🔍 분석 시작",
+        "batch_scan_action": "🔍 {n}장 한꺼번에 분석",
         "analyzing": "AI가 분석 중입니다...",
+        "model_loading": "⏳ AI 모델을 준비하는 중입니다. 스캔하면 준비되는 대로 분석합니다.",
+        "model_failed": "⚠️ AI 모델을 불러오지 못했습니다:",
+        "queue_wait": "⏳ 대기 중: 앞에 {n}건의 분석이 있습니다.",
+        "server_busy": "서버가 혼잡합니다. 잠시 후 다시 시도해 주세요.",
+        "confirm_label": "결과가 맞나요? 올바른 분류를 눌러 주세요 (비슷한 물품 인식에 반영됩니다)", "label_saved": "반영되었습니다!",
+        "kiosk_waiting": "📷 물품을 카메라 앞에 놓아 주세요", "kiosk_off": "실시간 스캔이 설정되지 않았습니다 (ECOSCAN_STREAM_SOURCE).",
         
         "result_title": "분석 결과", "confidence": "정확도",
+        "batch_result_title": "일괄 분석 결과", "batch_total": "합계",
         "points_earned": "획득 포인트",
+        "already_counted": "이미 적립된 물품입니다 (중복 스캔은 포인트가 추가되지 않아요)",
         "disposal_guide": "🗑️ 배출 방법 가이드",
         "low_conf_msg": "⚠️ 확실하지 않습니다. 이물질이 많다면 일반쓰레기로 버려주세요.",
         "btn_scan_again": "다시 스캔하기", "btn_check_stats": "통계 확인",
@@ -161,10 +200,19 @@ TRANSLATIONS = {
 
         "upload_btn": "📂 上传照片", "camera_btn": "📷 拍照",
         "scan_action": "🔍 开始识别",
+        "batch_scan_action": "🔍 批量识别 {n} 张",
         "analyzing": "AI 正在分析...",
+        "model_loading": "⏳ AI 模型正在后台加载，现在扫描会在加载完成后自动分析。",
+        "model_failed": "⚠️ AI 模型加载失败:",
+        "queue_wait": "⏳ 排队中：前面还有 {n} 个识别请求。",
+        "server_busy": "服务器繁忙，请稍后再试。",
+        "confirm_label": "结果对吗？点选正确的类别（之后识别相似物品时会参考）", "label_saved": "已记录！",
+        "kiosk_waiting": "📷 请把物品放到摄像头前", "kiosk_off": "未配置实时扫描视频源 (ECOSCAN_STREAM_SOURCE)。",
         
         "result_title": "识别结果", "confidence": "置信度",
+        "batch_result_title": "批量识别结果", "batch_total": "合计",
         "points_earned": "获得积分",
+        "already_counted": "该物品已计过积分（重复扫描不再加分）",
         "disposal_guide": "🗑️ 韩国处理指南",
         "low_conf_msg": "⚠️ 看起来有点模糊或混合，建议作为一般垃圾处理。",
         "btn_scan_again": "继续扫描", "btn_check_stats": "查看统计",
@@ -200,10 +248,19 @@ TRANSLATIONS = {
 
         "upload_btn": "📂 Upload", "camera_btn": "📷 Camera",
         "scan_action": "🔍 Identify",
+        "batch_scan_action": "🔍 Identify all {n}",
         "analyzing": "Analyzing...",
+        "model_loading": "⏳ The AI model is still loading in the background; scans will run as soon as it is ready.",
+        "model_failed": "⚠️ AI model failed to load:",
+        "queue_wait": "⏳ Waiting: {n} analysis request(s) ahead of you.",
+        "server_busy": "The server is busy right now. Please try again in a moment.",
+        "confirm_label": "Is this right? Tap the correct category (similar items will learn from it)", "label_saved": "Thanks, noted!",
+        "kiosk_waiting": "📷 Place an item in front of the camera", "kiosk_off": "Live scanning is not configured (ECOSCAN_STREAM_SOURCE).",
         
         "result_title": "Result", "confidence": "Confidence",
+        "batch_result_title": "Batch Results", "batch_total": "Total",
         "points_earned": "Points",
+        "already_counted": "Already counted (repeat scans don't earn points)",
         "disposal_guide": "🗑️ Disposal Guide",
         "low_conf_msg": "⚠️ Unclear. If dirty/mixed, use General Trash.",
         "btn_scan_again": "Scan Again", "btn_check_stats": "Check Stats",
@@ -222,172 +279,9 @@ TRANSLATIONS = {
 }
 
 # ==================================================
-# 5. 分类逻辑 (韩国标准) & 徽章配置  ——【已增强：按韩国四大类思路 + 特殊垃圾 + 多prompt】
+# 5. 分类逻辑 (韩国标准) & 徽章配置
+#    CATEGORIES 定义见 categories.py (与命令行批处理共用)
 # ==================================================
-CATEGORIES = {
-    # ♻️ 可回收 - 塑料容器/瓶
-    "plastic": {
-        "name": {"zh": "塑料(容器/瓶)", "en": "Plastic", "kr": "플라스틱 (용기/페트)"},
-        "icon": "🥤", "color": "#10b981", "points": 10,
-        "prompts": [
-            "clean plastic bottle with label removed",
-            "washed PET bottle empty",
-            "clean hard plastic container rinsed",
-            "shampoo bottle empty and clean",
-            "transparent plastic bottle clean"
-        ],
-        "tips": {
-            "zh": "先清洗→去标签/贴纸→去除异材质盖（脏污/油污洗不掉→一般垃圾）。",
-            "en": "Rinse, remove labels/caps (if dirty/greasy -> General Trash).",
-            "kr": "헹군 뒤 라벨·스티커 제거, 다른 재질 뚜껑 분리 (오염되면 일반쓰레기)."
-        }
-    },
-
-    # ♻️ 可回收 - 비닐(薄膜/包装) 仅限干净
-    "vinyl": {
-        "name": {"zh": "塑料薄膜/包装", "en": "Vinyl/Film", "kr": "비닐류 (봉투/포장재)"},
-        "icon": "🍬", "color": "#a855f7", "points": 5,
-        "prompts": [
-            "clean plastic film bag dry no oil",
-            "clean snack bag wrapper washed and dried",
-            "clean ramen packaging film",
-            "clean plastic shopping bag",
-            "plastic film packaging clean"
-        ],
-        "tips": {
-            "zh": "必须干净无油无残渣；有油渍/食物残留→一般垃圾。",
-            "en": "Only if clean/dry; greasy/food residue -> General Trash.",
-            "kr": "이물질·기름기 있으면 일반쓰레기입니다."
-        }
-    },
-
-    # ♻️ 可回收 - 스티로폼(白色干净)
-    "styrofoam": {
-        "name": {"zh": "泡沫塑料(白色干净)", "en": "Styrofoam", "kr": "스티로폼"},
-        "icon": "❄️", "color": "#94a3b8", "points": 7,
-        "prompts": [
-            "clean white styrofoam box without tape",
-            "white foam packaging clean",
-            "clean styrofoam tray rinsed",
-            "clean white foam container"
-        ],
-        "tips": {
-            "zh": "仅限白色且干净的；去胶带/贴纸；脏污→一般垃圾。",
-            "en": "White & clean only; remove tape/labels; dirty -> General Trash.",
-            "kr": "흰색·깨끗한 것만 가능, 테이프 제거 (오염되면 일반쓰레기)."
-        }
-    },
-
-    # ♻️ 可回收 - 종이류
-    "paper": {
-        "name": {"zh": "纸张/纸箱", "en": "Paper/Box", "kr": "종이류/박스"},
-        "icon": "📦", "color": "#d97706", "points": 8,
-        "prompts": [
-            "flattened cardboard box clean",
-            "stack of newspapers clean",
-            "paper package without plastic coating",
-            "paper carton box flattened",
-            "clean paper document stack"
-        ],
-        "tips": {
-            "zh": "压平投放；去胶带/订书钉；油污纸/涂层纸→一般垃圾。",
-            "en": "Flatten, remove tape/staples; greasy/coated paper -> General Trash.",
-            "kr": "펼쳐서 배출, 테이프·철심 제거 (코팅/오염 종이는 일반쓰레기)."
-        }
-    },
-
-    # ♻️ 可回收 - 금属(罐/铁铝/电线/厨具)
-    "can": {
-        "name": {"zh": "金属(罐/铁铝)", "en": "Metal", "kr": "캔류/고철"},
-        "icon": "🥫", "color": "#3b82f6", "points": 15,
-        "prompts": [
-            "empty aluminum soda can rinsed",
-            "clean metal food can",
-            "tuna can washed",
-            "metal kitchen utensil",
-            "metal wire scrap"
-        ],
-        "tips": {
-            "zh": "清洗后再投放；铝罐/金属/电线/厨具→金属回收。",
-            "en": "Rinse first; cans/wires/metal utensils -> Metal recycling.",
-            "kr": "세척 후 배출 (캔·전선·주방기구 등 금속류로 배출)."
-        }
-    },
-
-    # ♻️ 可回收 - 유리병（注意排除：镜子/碎玻璃/陶瓷/玻璃器皿）
-    "glass": {
-        "name": {"zh": "玻璃瓶", "en": "Glass Bottle", "kr": "유리병"},
-        "icon": "🍾", "color": "#0ea5e9", "points": 12,
-        "prompts": [
-            "clean glass bottle empty",
-            "washed soju bottle",
-            "beer bottle clean empty",
-            "glass bottle with no cigarette butts inside"
-        ],
-        "tips": {
-            "zh": "清洗干净且瓶内无异物；镜子/碎玻璃/陶瓷/耐热玻璃器皿→一般垃圾或指定收集点。",
-            "en": "Rinse and remove foreign objects; mirrors/broken glass/ceramics -> General/Special collection.",
-            "kr": "세척 후 이물질 제거. 거울·깨진 유리·도자기·유리식기는 일반/지정 수거."
-        }
-    },
-
-    # 🍎 食物垃圾
-    "food": {
-        "name": {"zh": "食物垃圾", "en": "Food Waste", "kr": "음식물 쓰레기"},
-        "icon": "🍎", "color": "#facc15", "points": 2,
-        "prompts": [
-            "food leftovers in bowl",
-            "fruit peels",
-            "vegetable scraps",
-            "kitchen food waste"
-        ],
-        "tips": {
-            "zh": "沥干水分；骨头/贝壳/大块硬物→一般垃圾。",
-            "en": "Drain water; bones/shells/hard items -> General Trash.",
-            "kr": "물기 제거. 뼈·조개껍데기 등은 일반쓰레기."
-        }
-    },
-
-    # 🔋 特殊垃圾（电池/灯管/药品/电子产品等）
-    "special": {
-        "name": {"zh": "特殊垃圾(电池/灯管/药品/电子)", "en": "Special Waste", "kr": "특수쓰레기"},
-        "icon": "🔋", "color": "#ef4444", "points": 0,
-        "prompts": [
-            "used battery",
-            "fluorescent lamp tube",
-            "medicine pills blister pack",
-            "old smartphone electronics",
-            "small electronic device"
-        ],
-        "tips": {
-            "zh": "电子产品/废电池/荧光灯/药品→提交到特殊垃圾收集点。",
-            "en": "Electronics/batteries/lamps/medicines -> special collection points.",
-            "kr": "전자제품·폐배터리·형광등·의약품은 지정 수거함/수거점."
-        }
-    },
-
-    # 🗑️ 一般垃圾（脏污/混合/一次性用品/破碎物/镜子/陶瓷/碎玻璃）
-    "trash": {
-        "name": {"zh": "一般垃圾", "en": "General Trash", "kr": "일반쓰레기 (종량제)"},
-        "icon": "🗑️", "color": "#475569", "points": 1,
-        "prompts": [
-            "dirty tissue",
-            "diaper disposable waste",
-            "greasy food wrapper",
-            "dirty plastic packaging with food residue",
-            "mixed garbage waste",
-            "broken ceramic plate",
-            "mirror glass",
-            "broken glass pieces"
-        ],
-        "tips": {
-            "zh": "使用计量垃圾袋；脏污/混合/一次性用品/陶瓷/镜子/碎玻璃→一般垃圾或指定收集区。",
-            "en": "Use official trash bags; dirty/mixed/disposables/ceramics/mirrors -> General/Special.",
-            "kr": "종량제 봉투 사용. 오염·혼합·일회용·도자기·거울·깨진 유리 등은 일반/지정수거."
-        }
-    },
-}
-
 BADGES = [
     {"key": "badge_starter", "threshold": 0, "icon": "🌱", "color": "#10b981"},
     {"key": "badge_bronze", "threshold": 50, "icon": "🥉", "color": "#cd7f32"},
@@ -398,74 +292,300 @@ BADGES = [
 # ==================================================
 # 6. AI 模型
 # ==================================================
+def _load_clip():
+    from clip_engine import CLIP_MODEL_ID, load_clip
+    from quantization import QUANTIZE
+    # 线程池要在第一次 torch 计算前设置
+    configure_threads()
+    # prompt 文本特征在这里一次性算好并缓存到磁盘 (设置了 ECOSCAN_PROBE_DIR 时改为加载线性头)；
+    # 运行时后端由 ECOSCAN_BACKEND 选择
+    # 失败时异常留在 loader 里，扫描页直接显示原因
+    return load_clip(CATEGORIES, CLIP_MODEL_ID, quantize=QUANTIZE)
+
 @st.cache_resource
+def get_model_loader():
+    # 进程内唯一：第一次渲染 (哪怕是首页) 就在后台线程开始加载，扫描时再等它就绪
+    # serve.py 多进程部署时模型已在父进程加载好，直接复用共享的那一份
+    return BackgroundLoader(_load_clip, name="clip-preload", shared_key="clip")
+
+def _load_mobilenet():
+    from mobilenet_engine import load_mobilenet
+    from quantization import QUANTIZE
+    configure_threads()
+    return load_mobilenet(quantize=QUANTIZE)
+
+@st.cache_resource
+def get_cascade():
+    """
+    ECOSCAN_CASCADE=1 时进程内唯一的 MobileNet → CLIP 级联 (见 cascade.py)，否则为 None。
+    MobileNet 和 CLIP 一样在后台预加载；serve.py 部署时两个模型都由父进程共享
+    """
+    if not CASCADE:
+        return None
+    from cascade import Cascade
+    mobilenet = BackgroundLoader(_load_mobilenet, name="mobilenet-preload", shared_key="mobilenet")
+    return Cascade(mobilenet.result, get_model_loader().result)
+
 def load_clip_model():
     try:
-        model_id = "openai/clip-vit-base-patch32"
-        _processor = CLIPProcessor.from_pretrained(model_id)
-        _model = CLIPModel.from_pretrained(model_id)
-        _model.eval()
-        return _processor, _model
+        return get_model_loader().result()
     except Exception:
-        return None, None
+        return None, None, None
 
-# 防止 Streamlit 重跑路径下变量未定义导致 NameError
-processor, model = None, None
-processor, model = load_clip_model()
+# 手机原图动辄上千万像素：JPEG 直接按预览尺寸降采样解码，模型输入只需要 224
+PREVIEW_SIZE = 1024
+# 扫描结果出现前的演示用停顿 (秒)；默认 0，页面上的耗时就是真实耗时
+SCAN_DELAY = float(os.environ.get("ECOSCAN_SCAN_DELAY", "0"))
 
-def classify_image(image):
-    global processor, model
-
-    if processor is None or model is None:
-        return "trash", 0.0
+# 不阻塞：只是把后台加载启动起来
+get_model_loader()
+get_cascade()
 
-    # 图像预处理
-    image = image.resize((384, 384), Image.Resampling.LANCZOS)
-    image = ImageEnhance.Contrast(image).enhance(1.2)
+@st.cache_resource
+def start_metrics_exporters():
+    # 进程内只启动一次：ECOSCAN_METRICS_FILE / ECOSCAN_METRICS_PORT
+    return start_exporters()
+
+start_metrics_exporters()
+
+def decode_upload(buffer):
+    """
+    同一个上传文件 (file_id 相同) 在本 session 内只解码一次：重跑时直接复用已解码的预览图
+    """
+    decoded = st.session_state.setdefault("decoded_uploads", {})
+    image = decoded.get(buffer.file_id)
+    if image is None:
+        with METRICS.timer("clip", "decode"):
+            image = decoded[buffer.file_id] = decode_image(buffer, PREVIEW_SIZE)
+    return image
+
+def forget_uploads(buffers):
+    # 只保留当前还在上传框里的文件，换图后旧的解码结果随之释放；还没开始跑的提前推理直接撤销
+    keep = {b.file_id for b in buffers}
+    decoded = st.session_state.get("decoded_uploads", {})
+    for file_id in [k for k in decoded if k not in keep]:
+        del decoded[file_id]
+    speculative = st.session_state.get("speculative", {})
+    for file_id in [k for k in speculative if k not in keep]:
+        _, fut = speculative.pop(file_id)
+        if fut is not None:
+            fut.cancel()
+
+def speculate(buffers, images):
+    """
+    上传 / 拍照后立即把图片交给推理服务，不等按钮：按下时结果通常已经在结果缓存里。
+    每个文件只提交一次，返回 [((key, phash), future 或 None), ...]；已在结果缓存里的不再提交。
+    失败 / 被撤销的提前推理 (例如提交时服务忙) 不保留：下次重跑重新提交
+    """
+    cache = get_result_cache()
+    speculative = st.session_state.setdefault("speculative", {})
+    for buffer, image in zip(buffers, images):
+        entry = speculative.get(buffer.file_id)
+        if entry is not None and not _speculation_failed(entry[1]):
+            continue
+        key, phash = cache.keys_for(image)
+        fut = None
+        if not cache.contains(key, phash):
+            fut = get_inference_server().submit((image, key))
+            fut.add_done_callback(functools.partial(_cache_speculative, cache, key, phash))
+        speculative[buffer.file_id] = ((key, phash), fut)
+    return [speculative[b.file_id] for b in buffers]
+
+def _speculation_failed(fut):
+    return fut is not None and fut.done() and (fut.cancelled() or fut.exception() is not None)
+
+def _cache_speculative(cache, key, phash, fut):
+    # 推理线程里回调：成功的结果直接进结果缓存，被撤销 / 失败的不缓存
+    if not fut.cancelled() and fut.exception() is None:
+        cache.put(key, fut.result(), phash)
 
-    # Prompt Ensembling：每个类别多条prompt，取该类别最高logit，再做softmax
-    all_prompts = []
-    prompt_to_cat = []
-    for cat_key, info in CATEGORIES.items():
-        for p in info["prompts"]:
-            all_prompts.append(f"a photo of {p}")
-            prompt_to_cat.append(cat_key)
+@st.cache_resource
+def get_inference_server():
+    # 全局唯一：所有 session 的请求进同一个队列，合并成 micro-batch 推理
+    # 请求是 (图片, 内容哈希)：哈希只用来记下这张图的特征
+    loader = get_model_loader()
+    cascade = get_cascade()
+    corrections = get_correction_index()
+    recent = get_recent_embeddings()
+
+    def run(items):
+        from clip_engine import classify_images as _classify_batch
+        images = [im for im, _ in items]
+        embeddings = []
+        signatures = [] if cascade is not None else None
+        # 全局准入：和其他模型调用路径共用同一个信号量，CPU 不会被超卖
+        # 模型还在后台加载时在信号量外面等：加载期间不占名额，其他扫描不会因此被判 Busy
+        # PROFILER 未 arm 时不做任何事；arm 后接下来的调用各录一份 torch.profiler trace
+        if cascade is not None:
+            # MobileNet 把握够的直接出结果，其余才跑 CLIP (每一级模型就绪后才占名额)
+            with PROFILER.capture("clip"):
+                results = cascade.classify_images(images, corrections=corrections, embeddings=embeddings, gate=GATE,
+                                                  signatures=signatures)
+        else:
+            loaded = loader.result()
+            with GATE, PROFILER.capture("clip"):
+                results = _classify_batch(*loaded, images, corrections=corrections, embeddings=embeddings)
+        # 用户确认 / 纠正标签时直接用这里的特征写入纠错索引，不用再跑一次视觉塔
+        # 级联里 MobileNet 接住的图片没有 CLIP 特征：记下 MobileNet 签名，纠正后相似图片改走 CLIP
+        for (_, key), emb, sig, (cat, _) in zip(items, embeddings, signatures or [None] * len(items), results):
+            if emb is not None or sig is not None:
+                recent.put(key, (emb, sig, cat))
+        return results
+
+    return MicroBatcher(run)
 
-    inputs = processor(text=all_prompts, images=image, return_tensors="pt", padding=True)
-    with torch.no_grad():
-        outputs = model(**inputs)
+@st.cache_resource
+def get_correction_index():
+    # 进程内唯一：用户确认过的标签 + 图像特征 (ECOSCAN_CORRECTIONS_DIR)，分类时近邻投票
+    return CorrectionIndex()
 
-    logits = outputs.logits_per_image[0]  # [num_prompts]
+@st.cache_resource
+def get_recent_embeddings():
+    # 最近推理过的 (CLIP 图像特征, 级联的 MobileNet 签名, 给出的类别)，key = 内容哈希 (LRU，只在内存里)
+    return ResultCache(max_entries=1024)
+
+def confirm_label(key, label, msg):
+    """
+    用户确认 / 纠正了一张图的类别：特征写入纠错索引，结果缓存改成确认后的类别；
+    级联开着时 MobileNet 与之相像的图片之后都交给 CLIP (否则纠错索引管不到 MobileNet 接住的图片)
+    """
+    if key is None:
+        return
+    hit = get_recent_embeddings().get(key)
+    if hit is not None:
+        emb, sig, cat = hit[0]
+        if emb is not None:
+            get_correction_index().add(emb, label)
+        if get_cascade() is not None:
+            get_cascade().confirm(sig, label, cat)
+    get_result_cache().put(key, (label, 1.0))
+    st.toast(msg, icon="✅")
 
-    # 每个类别取 max logit（比随机/单prompt稳很多）
-    cat_best = {k: -1e9 for k in CATEGORIES.keys()}
-    for logit_val, cat_key in zip(logits.tolist(), prompt_to_cat):
-        if logit_val > cat_best[cat_key]:
-            cat_best[cat_key] = logit_val
+@st.cache_resource
+def get_stream():
+    """
+    进程内唯一：kiosk 的实时视频流 (摄像头只能被打开一次)，未设置 ECOSCAN_STREAM_SOURCE 时为 None
+    """
+    if not STREAM_SOURCE:
+        return None
+    from stream_classify import StreamClassifier, open_source
+    loader = get_model_loader()
+    cascade = get_cascade()
+    corrections = get_correction_index()
+
+    def prepare():
+        # 模型还在后台加载时第一帧在这里等 (拿准入名额之前，不挡网页扫描)
+        if cascade is not None:
+            cascade.mobilenet()
+            cascade.clip()
+        else:
+            loader.result()
 
-    cat_keys = list(cat_best.keys())
-    cat_scores = torch.tensor([cat_best[k] for k in cat_keys])
-    cat_probs = torch.softmax(cat_scores, dim=0)
+    def classify(images):
+        from clip_engine import classify_images as _classify_batch
+        # 和网页扫描共用准入信号量，拿不到名额的帧直接跳过
+        if cascade is not None:
+            return cascade.classify_images(images, corrections=corrections)
+        return _classify_batch(*loader.result(), images, corrections=corrections)
 
-    conf_val, idx = torch.max(cat_probs, dim=0)
-    conf_val = float(conf_val.item())
-    category = cat_keys[int(idx.item())]
+    return StreamClassifier(open_source(STREAM_SOURCE), classify, fps=STREAM_FPS, gate=GATE, prepare=prepare).start()
 
-    # 🇰🇷 韩国兜底：不确定 = 一般垃圾(종량제)
-    if conf_val < 0.30:
-        return "trash", conf_val
+@st.cache_resource
+def get_result_cache():
+    # 全局唯一：同一张图 (或开启感知哈希时的近似画面) 重复扫描直接返回缓存结果
+    return ResultCache()
+
+def scan_images(images, speculative=None):
+    """
+    返回 [(category, confidence, key), ...]；key 是物品的内容哈希 (近似命中时为原条目的 key)
+    speculative: speculate() 的返回值，与 images 一一对应；提前推理还没跑完的直接等它，不重复提交
+    """
+    with METRICS.timer("clip", "total"):
+        return _scan_images(images, speculative)
+
+def _scan_images(images, speculative=None):
+    cache = get_result_cache()
+    keys = [s[0] for s in speculative] if speculative else [cache.keys_for(im) for im in images]
+    results = [None] * len(images)
+    misses = []
+    for i, (key, phash) in enumerate(keys):
+        hit = cache.get(key, phash)
+        if hit is not None:
+            (cat, conf), matched = hit
+            results[i] = (cat, conf, matched)
+        else:
+            misses.append(i)
 
-    # 若第一名与第二名差距过小（易混淆），除 food/special 外也倾向一般垃圾
-    top2 = torch.topk(cat_probs, k=2)
-    margin = float((top2.values[0] - top2.values[1]).item())
-    if category not in ("food", "special") and margin < 0.07:
-        return "trash", conf_val
+    if misses:
+        # 模型还在后台加载时在这里等它就绪 (缓存命中则完全不需要模型)
+        preprocess, backend, _ = load_clip_model()
+        if preprocess is None or backend is None:
+            fresh = [("trash", 0.0) for _ in misses]
+        else:
+            # Prompt Ensembling：每个类别多条prompt，取该类别最高logit，再做softmax
+            # 文本特征已预先缓存，整批图片只跑一次视觉塔；类别聚合由 scorer 向量化完成
+            # 还在跑 / 已成功的提前推理直接等它；失败或被撤销的重新提交，不把旧异常再抛一遍
+            ahead = {i: speculative[i][1] for i in misses
+                     if speculative and speculative[i][1] is not None and not _speculation_failed(speculative[i][1])}
+            rest = [i for i in misses if i not in ahead]
+            deadline = time.monotonic() + ADMISSION_TIMEOUT
+            try:
+                done = dict(zip(rest, get_inference_server().map([(images[i], keys[i][0]) for i in rest], timeout=ADMISSION_TIMEOUT)))
+                for i, fut in ahead.items():
+                    done[i] = fut.result(timeout=max(0.0, deadline - time.monotonic()))
+            except TimeoutError:
+                raise Busy(f"no inference slot within {ADMISSION_TIMEOUT:g}s") from None
+            fresh = [done[i] for i in misses]
+        for i, (cat, conf) in zip(misses, fresh):
+            key, phash = keys[i]
+            if backend is not None:
+                cache.put(key, (cat, conf), phash)
+            results[i] = (cat, conf, key)
+    return results
+
+def queue_ahead():
+    """
+    当前排在前面的模型调用数 (正在跑的也算)，给 UI 显示"排队中"
+    """
+    return get_inference_server().queue_depth() + GATE.waiting() + GATE.active()
+
+def classify_images(images):
+    return [(cat, conf) for cat, conf, _ in scan_images(images)]
 
-    return category, conf_val
+def classify_image(image):
+    return classify_images([image])[0]
+
+def record_scan(cat, conf, key=None):
+    """
+    记一次扫描：加积分 + 写历史，返回本次获得的积分。
+    同一物品 (key 相同) 在本 session 内只计一次分。
+    """
+    if key is not None:
+        if key in st.session_state.awarded_keys:
+            return 0
+        st.session_state.awarded_keys.add(key)
+    pts = CATEGORIES[cat]['points']
+    # 只入队，后台线程批量写库
+    get_history_store().record(st.session_state.user_id, cat, conf, pts, key)
+    return pts
 
 # ==================================================
 # 7. UI 组件
 # ==================================================
+@st.cache_resource(max_entries=512)
+def category_pie(counts, lang):
+    """
+    counts: ((cat, n), ...)。计数不变就复用同一个 Figure，只在有新扫描时重建
+    """
+    import plotly.graph_objects as go
+
+    labels = [CATEGORIES[k]['name'][lang] for k, _ in counts]
+    values = [n for _, n in counts]
+    colors = [CATEGORIES[k]['color'] for k, _ in counts]
+    fig = go.Figure(data=[go.Pie(labels=labels, values=values, hole=0.6, marker=dict(colors=colors))])
+    fig.update_layout(height=300, margin=dict(t=0, b=0, l=0, r=0))
+    return fig
+
 def render_navbar(t):
     c1, c2 = st.columns([2, 1])
     with c1:
@@ -475,22 +595,77 @@ def render_navbar(t):
         )
     with c2:
         lang_map = {"kr": "🇰🇷 한국어", "en": "🇺🇸 English", "zh": "🇨🇳 中文"}
-        new_lang = st.selectbox(
+        # 直接绑定 session_state.lang：切换语言只触发这一次重跑，回调里把当前标签页换成新语言的名字
+        st.selectbox(
             "Language",
             list(lang_map.keys()),
             format_func=lambda x: lang_map[x],
-            index=list(lang_map.keys()).index(st.session_state.lang),
+            key="lang",
+            on_change=translate_current_tab,
             label_visibility="collapsed"
         )
-        if new_lang != st.session_state.lang:
-            st.session_state.lang = new_lang
-            st.rerun()
     st.markdown("---")
 
+def tab_labels(t):
+    return [t['nav_home'], t['nav_scan'], t['nav_insights'], t['nav_profile']]
+
+def translate_current_tab():
+    tabs = tab_labels(TRANSLATIONS[st.session_state.lang])
+    for other in TRANSLATIONS.values():
+        if st.session_state.current_tab in tab_labels(other):
+            st.session_state.current_tab = tabs[tab_labels(other).index(st.session_state.current_tab)]
+            return
+
+def stay_on(tab):
+    """
+    片段内按钮的 on_click 回调会改 current_tab，但片段重跑不会重画导航栏：发现标签页变了就改为整页重跑
+    """
+    if st.session_state.current_tab != tab:
+        st.rerun(scope="app")
+
+@functools.lru_cache(maxsize=None)
+def home_html(lang):
+    """
+    首页的静态 HTML (hero / 三个步骤 / 分类速查)，每种语言只拼一次
+    """
+    t = TRANSLATIONS[lang]
+    hero = f"""
+        <div style='background:linear-gradient(135deg, #dcfce7, #bbf7d0); padding:40px 20px; border-radius:20px; text-align:center; margin-bottom:30px;'>
+            <h1 style='color:#166534; font-size:2.2rem;'>{t['hero_title']}</h1>
+            <p style='color:#15803d; font-size:1.1rem;'>{t['hero_subtitle']}</p>
+        </div>
+        """
+    steps = [
+        ("📸", t['step1_title'], t['step1_desc']),
+        ("🧠", t['step2_title'], t['step2_desc']),
+        ("🎁", t['step3_title'], t['step3_desc'])
+    ]
+    step_cards = tuple(f"""
+            <div style='text-align:center; padding:20px; background:#fff; border-radius:12px; border:1px solid #e2e8f0; height:100%;'>
+                <div style='font-size:2rem; margin-bottom:10px;'>{icon}</div>
+                <div style='font-weight:bold;'>{title}</div>
+                <div style='font-size:0.8rem; color:#64748b;'>{desc}</div>
+            </div>
+            """ for icon, title, desc in steps)
+    guides = [
+        ("🥤", t['guide_plastic'], t['guide_plastic_desc']),
+        ("🍬", t['guide_vinyl'], t['guide_vinyl_desc']),
+        ("📦", t['guide_paper'], t['guide_paper_desc']),
+        ("🗑️", t['guide_trash'], t['guide_trash_desc'])
+    ]
+    guide_cards = tuple(f"""
+            <div style='text-align:center; padding:15px; background:#f8fafc; border-radius:10px;'>
+                <div style='font-size:1.5rem;'>{icon}</div>
+                <div style='font-weight:bold; font-size:0.9rem;'>{title}</div>
+                <div style='font-size:0.75rem; color:#64748b;'>{desc}</div>
+            </div>
+            """ for icon, title, desc in guides)
+    return hero, step_cards, guide_cards
+
 def render_badges_section(t):
     st.markdown(f"### {t['badges_title']}")
     cols = st.columns(4)
-    current_points = st.session_state.total_points
+    _, current_points = user_totals()
 
     for idx, badge in enumerate(BADGES):
         is_unlocked = current_points >= badge['threshold']
@@ -513,186 +688,304 @@ def render_badges_section(t):
 # ==================================================
 # 8. 主程序
 # ==================================================
-def main():
-    t = TRANSLATIONS[st.session_state.lang]
-    render_navbar(t)
-
-    tabs = [t['nav_home'], t['nav_scan'], t['nav_insights'], t['nav_profile']]
-    if st.session_state.current_tab not in tabs:
-        st.session_state.current_tab = tabs[0]
-
-    selected_tab = st.radio("", tabs, horizontal=True, label_visibility="collapsed", key="current_tab")
-
-    # --- 1. 首页 (HOME) ---
-    if selected_tab == t['nav_home']:
-        st.markdown(f"""
-        <div style='background:linear-gradient(135deg, #dcfce7, #bbf7d0); padding:40px 20px; border-radius:20px; text-align:center; margin-bottom:30px;'>
-            <h1 style='color:#166534; font-size:2.2rem;'>{t['hero_title']}</h1>
-            <p style='color:#15803d; font-size:1.1rem;'>{t['hero_subtitle']}</p>
-        </div>
-        """, unsafe_allow_html=True)
+def arm_profiler_from_query():
+    # ?profile=N：接下来 N 次推理录 trace (参数用完即删，刷新页面不会重复 arm)
+    if "profile" in st.query_params:
+        try:
+            PROFILER.arm(int(st.query_params["profile"] or 1))
+        except ValueError:
+            pass
+        del st.query_params["profile"]
+
+# 扫描 / 统计 / 个人三页各是一个 fragment：页内的控件交互只重跑该片段，不重建导航栏和其他部分
+def render_home(t):
+    hero, step_cards, guide_cards = home_html(st.session_state.lang)
+    st.markdown(hero, unsafe_allow_html=True)
+
+    total_scans, total_points = user_totals()
+    c1, c2, c3 = st.columns(3)
+    c1.metric(t['total_scans'], total_scans)
+    c2.metric(t['eco_points'], total_points)
+    c3.metric(t['level'], total_points // 100 + 1)
+
+    st.markdown("<br>", unsafe_allow_html=True)
+    for col, card in zip(st.columns(3), step_cards):
+        col.markdown(card, unsafe_allow_html=True)
+
+    st.markdown(f"### {t['quick_guide_title']}")
+    for col, card in zip(st.columns(4), guide_cards):
+        col.markdown(card, unsafe_allow_html=True)
+
+    st.markdown("<br>", unsafe_allow_html=True)
+
+    def go_to_scan():
+        st.session_state.current_tab = t['nav_scan']
+
+    st.button(t['scan_action'], type="primary", use_container_width=True, on_click=go_to_scan)
+
+@st.fragment
+def render_scan(t):
+    stay_on(t['nav_scan'])
+    loader = get_model_loader()
+    if not loader.ready():
+        st.caption(t['model_loading'])
+    elif loader.status() == "failed":
+        st.error(f"{t['model_failed']} {loader.stats()['error']}")
+
+    c1, c2 = st.columns(2)
+    img_buffer = None
+    batch_buffers = []
+    with c1:
+        ups = st.file_uploader(t['upload_btn'], type=["jpg", "png", "jpeg"],
+                               accept_multiple_files=True, label_visibility="collapsed")
+        # 多张上传 → 批量模式；单张沿用原来的流程
+        if len(ups) == 1:
+            img_buffer = ups[0]
+        elif len(ups) > 1:
+            batch_buffers = ups
+    with c2:
+        cam = st.camera_input(t['camera_btn'], label_visibility="collapsed")
+        if cam:
+            img_buffer = cam
+            batch_buffers = []
+    forget_uploads(batch_buffers or ([img_buffer] if img_buffer else []))
 
-        c1, c2, c3 = st.columns(3)
-        c1.metric(t['total_scans'], len(st.session_state.history))
-        c2.metric(t['eco_points'], st.session_state.total_points)
-        c3.metric(t['level'], st.session_state.total_points // 100 + 1)
+    if batch_buffers:
+        images = [decode_upload(b) for b in batch_buffers]
+        speculative = speculate(batch_buffers, images)
 
         st.markdown("<br>", unsafe_allow_html=True)
-        sc1, sc2, sc3 = st.columns(3)
-        steps = [
-            ("📸", t['step1_title'], t['step1_desc']),
-            ("🧠", t['step2_title'], t['step2_desc']),
-            ("🎁", t['step3_title'], t['step3_desc'])
-        ]
-        for col, (icon, title, desc) in zip([sc1, sc2, sc3], steps):
-            col.markdown(f"""
-            <div style='text-align:center; padding:20px; background:#fff; border-radius:12px; border:1px solid #e2e8f0; height:100%;'>
-                <div style='font-size:2rem; margin-bottom:10px;'>{icon}</div>
-                <div style='font-weight:bold;'>{title}</div>
-                <div style='font-size:0.8rem; color:#64748b;'>{desc}</div>
-            </div>
-            """, unsafe_allow_html=True)
-
-        st.markdown(f"### {t['quick_guide_title']}")
-        gc1, gc2, gc3, gc4 = st.columns(4)
-        guides = [
-            ("🥤", t['guide_plastic'], t['guide_plastic_desc']),
-            ("🍬", t['guide_vinyl'], t['guide_vinyl_desc']),
-            ("📦", t['guide_paper'], t['guide_paper_desc']),
-            ("🗑️", t['guide_trash'], t['guide_trash_desc'])
-        ]
-        for col, (icon, title, desc) in zip([gc1, gc2, gc3, gc4], guides):
-            col.markdown(f"""
-            <div style='text-align:center; padding:15px; background:#f8fafc; border-radius:10px;'>
-                <div style='font-size:1.5rem;'>{icon}</div>
-                <div style='font-weight:bold; font-size:0.9rem;'>{title}</div>
-                <div style='font-size:0.75rem; color:#64748b;'>{desc}</div>
-            </div>
-            """, unsafe_allow_html=True)
+        thumb_cols = st.columns(6)
+        for i, image in enumerate(images):
+            thumb_cols[i % 6].image(image, use_container_width=True)
 
         st.markdown("<br>", unsafe_allow_html=True)
 
-        def go_to_scan():
-            st.session_state.current_tab = t['nav_scan']
-
-        st.button(t['scan_action'], type="primary", use_container_width=True, on_click=go_to_scan)
-
-    # --- 2. 扫描 (SCAN) ---
-    elif selected_tab == t['nav_scan']:
-        c1, c2 = st.columns(2)
-        img_buffer = None
-        with c1:
-            up = st.file_uploader(t['upload_btn'], type=["jpg", "png", "jpeg"], label_visibility="collapsed")
-            if up:
-                img_buffer = up
-        with c2:
-            cam = st.camera_input(t['camera_btn'], label_visibility="collapsed")
-            if cam:
-                img_buffer = cam
-
-        if img_buffer:
-            image = Image.open(img_buffer).convert("RGB")
-
-            st.markdown("<br>", unsafe_allow_html=True)
-            ic1, ic2, ic3 = st.columns([1, 2, 1])
-            with ic2:
-                st.image(image, use_container_width=True, caption="Preview")
-
-            st.markdown("<br>", unsafe_allow_html=True)
-
-            if st.button(t['scan_action'], type="primary", use_container_width=True):
-                with st.spinner(t['analyzing']):
-                    time.sleep(0.8)
-                    cat, conf = classify_image(image)
-                    info = CATEGORIES[cat]
-
-                    pts = info['points']
-                    st.session_state.total_points += pts
-                    st.session_state.history.insert(0, {
-                        "cat": cat, "conf": conf, "date": datetime.now().strftime("%m-%d %H:%M"), "pts": pts
-                    })
-
-                    st.balloons()
-                    st.markdown(f"""
-                    <div style='background-color:#fff; border:2px solid {info['color']}; border-radius:20px; padding:30px; text-align:center; box-shadow:0 10px 30px rgba(0,0,0,0.05); margin-top:20px;'>
-                        <div style='font-size:5rem; margin-bottom:10px;'>{info['icon']}</div>
-                        <h2 style='color:{info['color']}; margin:0;'>{info['name'][st.session_state.lang]}</h2>
-                        <div style='font-size:1.5rem; font-weight:bold; color:{info['color']}; margin-top:10px;'>
-                            +{pts} {t['eco_points']}
+        if st.button(t['batch_scan_action'].format(n=len(images)), type="primary", use_container_width=True):
+            if queue_ahead():
+                st.caption(t['queue_wait'].format(n=queue_ahead()))
+            with st.spinner(t['analyzing']):
+                try:
+                    results = scan_images(images, speculative)
+                except Busy:
+                    st.warning(t['server_busy'])
+                    st.stop()
+                awarded = [record_scan(cat, conf, key) for cat, conf, key in results]
+                total_pts = sum(awarded)
+
+            render_t0 = time.perf_counter()
+            st.balloons()
+            st.markdown(f"### {t['batch_result_title']}")
+            for b, (cat, conf, _), pts in zip(batch_buffers, results, awarded):
+                info = CATEGORIES[cat]
+                st.markdown(f"""
+                <div style='display:flex; justify-content:space-between; align-items:center; padding:12px; background:#fff; border-bottom:1px solid #f1f5f9;'>
+                    <div style='display:flex; gap:10px; align-items:center;'>
+                        <span style='font-size:1.5rem;'>{info['icon']}</span>
+                        <div>
+                            <div style='font-weight:bold;'>{info['name'][st.session_state.lang]}</div>
+                            <div style='font-size:0.8rem; color:#94a3b8;'>{b.name} · {t['confidence']} {conf * 100:.0f}%</div>
                         </div>
                     </div>
-                    """, unsafe_allow_html=True)
-
-                    st.markdown(f"### {t['disposal_guide']}")
-                    st.info(info['tips'][st.session_state.lang], icon="💡")
-
-                    if conf < 0.4:
-                        st.warning(t['low_conf_msg'])
+                    <div style='color:{info['color']}; font-weight:bold;'>+{pts}</div>
+                </div>
+                """, unsafe_allow_html=True)
 
-                    ac1, ac2 = st.columns(2)
-                    if ac1.button(t['btn_scan_again'], use_container_width=True):
-                        st.rerun()
+            st.markdown(f"""
+            <div style='text-align:right; font-size:1.3rem; font-weight:bold; color:#10b981; margin-top:15px;'>
+                {t['batch_total']}: +{total_pts} {t['eco_points']}
+            </div>
+            """, unsafe_allow_html=True)
 
-                    def go_to_insights():
-                        st.session_state.current_tab = t['nav_insights']
+            def go_to_insights_batch():
+                st.session_state.current_tab = t['nav_insights']
 
-                    ac2.button(t['btn_check_stats'], use_container_width=True, on_click=go_to_insights)
+            st.button(t['btn_check_stats'], use_container_width=True, on_click=go_to_insights_batch)
+            METRICS.observe("clip", "render", time.perf_counter() - render_t0)
 
-    # --- 3. 统计 (INSIGHTS) ---
-    elif selected_tab == t['nav_insights']:
-        if not st.session_state.history:
-            st.info(t['no_data'])
-        else:
-            counts = {}
-            for h in st.session_state.history:
-                counts[h['cat']] = counts.get(h['cat'], 0) + 1
+    elif img_buffer:
+        image = decode_upload(img_buffer)
+        speculative = speculate([img_buffer], [image])
 
-            labels = [CATEGORIES[k]['name'][st.session_state.lang] for k in counts.keys()]
-            values = list(counts.values())
-            colors = [CATEGORIES[k]['color'] for k in counts.keys()]
+        st.markdown("<br>", unsafe_allow_html=True)
+        ic1, ic2, ic3 = st.columns([1, 2, 1])
+        with ic2:
+            st.image(image, use_container_width=True, caption="Preview")
 
-            fig = go.Figure(data=[go.Pie(labels=labels, values=values, hole=0.6, marker=dict(colors=colors))])
-            fig.update_layout(height=300, margin=dict(t=0, b=0, l=0, r=0))
-            st.plotly_chart(fig, use_container_width=True)
+        st.markdown("<br>", unsafe_allow_html=True)
 
-            st.markdown(f"### {t['history_title']}")
-            for h in st.session_state.history[:10]:
-                info = CATEGORIES[h['cat']]
+        if st.button(t['scan_action'], type="primary", use_container_width=True):
+            if queue_ahead():
+                st.caption(t['queue_wait'].format(n=queue_ahead()))
+            with st.spinner(t['analyzing']):
+                if SCAN_DELAY:
+                    time.sleep(SCAN_DELAY)
+                try:
+                    cat, conf, key = scan_images([image], speculative)[0]
+                except Busy:
+                    st.warning(t['server_busy'])
+                    st.stop()
+                info = CATEGORIES[cat]
+                pts = record_scan(cat, conf, key)
+
+                render_t0 = time.perf_counter()
+                st.balloons()
                 st.markdown(f"""
-                <div style='display:flex; justify-content:space-between; align-items:center; padding:12px; background:#fff; border-bottom:1px solid #f1f5f9;'>
-                    <div style='display:flex; gap:10px; align-items:center;'>
-                        <span style='font-size:1.5rem;'>{info['icon']}</span>
-                        <div>
-                            <div style='font-weight:bold;'>{info['name'][st.session_state.lang]}</div>
-                            <div style='font-size:0.8rem; color:#94a3b8;'>{h['date']}</div>
-                        </div>
+                <div style='background-color:#fff; border:2px solid {info['color']}; border-radius:20px; padding:30px; text-align:center; box-shadow:0 10px 30px rgba(0,0,0,0.05); margin-top:20px;'>
+                    <div style='font-size:5rem; margin-bottom:10px;'>{info['icon']}</div>
+                    <h2 style='color:{info['color']}; margin:0;'>{info['name'][st.session_state.lang]}</h2>
+                    <div style='font-size:1.5rem; font-weight:bold; color:{info['color']}; margin-top:10px;'>
+                        +{pts} {t['eco_points']}
                     </div>
-                    <div style='color:{info['color']}; font-weight:bold;'>+{h['pts']}</div>
                 </div>
                 """, unsafe_allow_html=True)
 
-    # --- 4. 个人 (PROFILE) ---
-    elif selected_tab == t['nav_profile']:
-        st.markdown(f"""
-        <div style='text-align:center; padding:40px; background:linear-gradient(to right, #6366f1, #8b5cf6); border-radius:20px; color:white; margin-bottom:30px;'>
-            <div style='font-size:4rem; margin-bottom:10px;'>😎</div>
-            <h2>{st.session_state.username}</h2>
-            <p>Level {st.session_state.total_points // 100 + 1}</p>
-            <div style='font-size:1.5rem; font-weight:bold; margin-top:10px;'>⭐ {st.session_state.total_points}</div>
-        </div>
-        """, unsafe_allow_html=True)
+                if pts == 0 and info['points'] > 0:
+                    st.caption(t['already_counted'])
+
+                st.markdown(f"### {t['disposal_guide']}")
+                st.info(info['tips'][st.session_state.lang], icon="💡")
+
+                if conf < 0.4:
+                    st.warning(t['low_conf_msg'])
+
+                # 纠错：点选正确的类别 (当前结果高亮)，之后相似的物品会参考这次确认
+                st.caption(t['confirm_label'])
+                for col, (cat_key, cat_info) in zip(st.columns(len(CATEGORIES)), CATEGORIES.items()):
+                    col.button(cat_info['icon'], key=f"confirm_{cat_key}", help=cat_info['name'][st.session_state.lang],
+                               type="primary" if cat_key == cat else "secondary", use_container_width=True,
+                               on_click=confirm_label, args=(key, cat_key, t['label_saved']))
+
+                ac1, ac2 = st.columns(2)
+                # 点击即触发片段重跑，结果区随之收起
+                ac1.button(t['btn_scan_again'], use_container_width=True)
+
+                def go_to_insights():
+                    st.session_state.current_tab = t['nav_insights']
+
+                ac2.button(t['btn_check_stats'], use_container_width=True, on_click=go_to_insights)
+                METRICS.observe("clip", "render", time.perf_counter() - render_t0)
+
+    with st.expander("🔧 Debug", expanded=False):
+        st.json({"model": get_model_loader().stats(),
+                 "admission": GATE.stats(),
+                 "result_cache": get_result_cache().stats(),
+                 "history_store": get_history_store().stats(),
+                 "inference_server": get_inference_server().stats(),
+                 "corrections": get_correction_index().stats(),
+                 "cascade": get_cascade().stats() if get_cascade() is not None else None})
+        # 各阶段耗时 (进程内累计)；Prometheus 格式见 ECOSCAN_METRICS_FILE / ECOSCAN_METRICS_PORT
+        st.dataframe(METRICS.snapshot(), use_container_width=True, hide_index=True)
+
+        pc1, pc2 = st.columns([1, 2])
+        n_profile = pc1.number_input("Profile next N scans", min_value=1, max_value=20, value=1)
+        if pc2.button("🔬 torch.profiler", use_container_width=True):
+            PROFILER.arm(n_profile)
+        st.json(PROFILER.stats())
+
+@st.fragment
+def render_insights(t):
+    stay_on(t['nav_insights'])
+    # 类别计数来自增量维护的计数表，与历史长度无关
+    counts = get_history_store().category_counts(st.session_state.user_id)
+    if not counts:
+        st.info(t['no_data'])
+    else:
+        st.plotly_chart(category_pie(tuple(counts.items()), st.session_state.lang), use_container_width=True)
+
+        st.markdown(f"### {t['history_title']}")
+        for h in get_history_store().recent(st.session_state.user_id, 10):
+            info = CATEGORIES[h['cat']]
+            st.markdown(f"""
+            <div style='display:flex; justify-content:space-between; align-items:center; padding:12px; background:#fff; border-bottom:1px solid #f1f5f9;'>
+                <div style='display:flex; gap:10px; align-items:center;'>
+                    <span style='font-size:1.5rem;'>{info['icon']}</span>
+                    <div>
+                        <div style='font-weight:bold;'>{info['name'][st.session_state.lang]}</div>
+                        <div style='font-size:0.8rem; color:#94a3b8;'>{h['date']}</div>
+                    </div>
+                </div>
+                <div style='color:{info['color']}; font-weight:bold;'>+{h['pts']}</div>
+            </div>
+            """, unsafe_allow_html=True)
+
+@st.fragment
+def render_profile(t):
+    stay_on(t['nav_profile'])
+    _, total_points = user_totals()
+    st.markdown(f"""
+    <div style='text-align:center; padding:40px; background:linear-gradient(to right, #6366f1, #8b5cf6); border-radius:20px; color:white; margin-bottom:30px;'>
+        <div style='font-size:4rem; margin-bottom:10px;'>😎</div>
+        <h2>{st.session_state.username}</h2>
+        <p>Level {total_points // 100 + 1}</p>
+        <div style='font-size:1.5rem; font-weight:bold; margin-top:10px;'>⭐ {total_points}</div>
+    </div>
+    """, unsafe_allow_html=True)
+
+    render_badges_section(t)
+
+    st.markdown("---")
 
-        render_badges_section(t)
+    def save_username():
+        # 回调在片段重跑之前执行：上面的名片直接画出新名字，不需要再 rerun
+        st.session_state.username = st.session_state.new_username
+        get_history_store().set_username(st.session_state.user_id, st.session_state.new_username)
+        st.toast(t['saved_msg'], icon="✅")
+
+    new_name = st.text_input(t['username'], st.session_state.username, key="new_username")
+    if new_name != st.session_state.username:
+        st.button(t['save'], type="primary", on_click=save_username)
+
+# ?kiosk=1：分拣站的全屏实时识别页，只轮询后台视频流的最新结果，不需要任何点击
+@st.fragment(run_every=max(0.25, 1.0 / STREAM_FPS) if STREAM_FPS > 0 else 1.0)
+def render_kiosk(t):
+    stream = get_stream()
+    if stream is None:
+        st.info(t['kiosk_off'])
+        return
+    state = stream.state()
+    kc1, kc2 = st.columns([3, 2])
+    if state['frame'] is not None:
+        kc1.image(state['frame'], use_container_width=True)
+    with kc2:
+        if state['label'] is None:
+            st.markdown(f"## {t['kiosk_waiting']}")
+        else:
+            info = CATEGORIES[state['label']]
+            st.markdown(f"""
+            <div style='background-color:#fff; border:4px solid {info['color']}; border-radius:20px; padding:30px; text-align:center;'>
+                <div style='font-size:6rem;'>{info['icon']}</div>
+                <h1 style='color:{info['color']}; margin:0;'>{info['name'][st.session_state.lang]}</h1>
+            </div>
+            """, unsafe_allow_html=True)
+            st.info(info['tips'][st.session_state.lang], icon="💡")
+    if not stream.running():
+        st.caption(state.get('error') or "stream ended")
+    with st.expander("🔧 Debug", expanded=False):
+        st.json(stream.stats())
 
-        st.markdown("---")
+def main():
+    t = TRANSLATIONS[st.session_state.lang]
+    arm_profiler_from_query()
+    if st.query_params.get("kiosk"):
+        render_kiosk(t)
+        return
+    render_navbar(t)
 
-        new_name = st.text_input(t['username'], st.session_state.username)
-        if new_name != st.session_state.username:
-            if st.button(t['save'], type="primary"):
-                st.session_state.username = new_name
-                st.success(t['saved_msg'])
-                time.sleep(1)
-                st.rerun()
+    tabs = tab_labels(t)
+    if st.session_state.current_tab not in tabs:
+        st.session_state.current_tab = tabs[0]
+
+    selected_tab = st.radio("", tabs, horizontal=True, label_visibility="collapsed", key="current_tab")
+
+    if selected_tab == t['nav_home']:
+        render_home(t)
+    elif selected_tab == t['nav_scan']:
+        render_scan(t)
+    elif selected_tab == t['nav_insights']:
+        render_insights(t)
+    elif selected_tab == t['nav_profile']:
+        render_profile(t)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,254 @@
+"""
+离线模型产物：safetensors 权重 + 配置打包到本地目录，运行时只读本地文件、内存映射加载
+
+    python export_models.py --format safetensors          # 打包 (需要联网或本地已有权重)
+    ECOSCAN_ARTIFACT_DIR=/opt/ecoscan/artifacts streamlit run app.py
+    python artifacts.py /opt/ecoscan/artifacts             # 单独校验
+
+权重用 MAP_PRIVATE 映射后直接作为参数存储 (不拷贝)：同一台机器上的多个 worker 共享页缓存，
+只有被写到的页才会各自复制一份 (推理时不会写权重)。
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+
+import torch
+
+from clip_engine import CACHE_DIR
+
+# 不设置 = 不使用产物目录，沿用 from_pretrained / torchvision 下载
+ARTIFACT_DIR = os.environ.get("ECOSCAN_ARTIFACT_DIR", "")
+DEFAULT_BUNDLE_DIR = ARTIFACT_DIR or os.path.join(CACHE_DIR, "artifacts")
+# 加载时的完整性检查：sha256 (逐字节校验) / size (只比文件大小) / off
+VERIFY = os.environ.get("ECOSCAN_ARTIFACT_VERIFY", "sha256").lower()
+
+MANIFEST = "artifacts.json"
+WEIGHTS = "model.safetensors"
+
+_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8,
+    "U8": torch.uint8, "BOOL": torch.bool,
+}
+
+
+class ArtifactError(RuntimeError):
+    pass
+
+
+# ==================================================
+# 1. 清单与完整性校验
+# ==================================================
+def sha256_file(path, chunk=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def read_manifest(artifact_dir):
+    path = os.path.join(artifact_dir, MANIFEST)
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise ArtifactError(
+            f"no artifact manifest at {path} (build one with: python export_models.py --format safetensors)"
+        ) from None
+    except ValueError as e:
+        raise ArtifactError(f"artifact manifest {path} is not valid JSON: {e}") from None
+
+
+def write_manifest(artifact_dir, name, entry):
+    """
+    写入 / 覆盖清单里的一个组件条目 (先写临时文件再替换)，其他组件的条目保持不变
+    """
+    path = os.path.join(artifact_dir, MANIFEST)
+    try:
+        manifest = read_manifest(artifact_dir)
+    except ArtifactError:
+        manifest = {}
+    manifest[name] = entry
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+
+def file_table(component_dir):
+    """
+    组件目录下每个文件的 {文件名: {bytes, sha256}}，作为清单条目的 "files"
+    """
+    return {
+        name: {"bytes": os.path.getsize(os.path.join(component_dir, name)),
+               "sha256": sha256_file(os.path.join(component_dir, name))}
+        for name in sorted(os.listdir(component_dir))
+    }
+
+
+def verify_component(artifact_dir, name, mode=VERIFY):
+    """
+    按清单检查 <artifact_dir>/<name>/ 下的文件，返回清单条目；缺失 / 大小不符 / 哈希不符直接抛 ArtifactError
+    """
+    entry = read_manifest(artifact_dir).get(name)
+    if entry is None:
+        raise ArtifactError(f"artifact bundle {artifact_dir} has no '{name}' entry "
+                            f"(run: python export_models.py --model {name} --format safetensors)")
+    component_dir = os.path.join(artifact_dir, name)
+    for fname, meta in entry["files"].items():
+        path = os.path.join(component_dir, fname)
+        if not os.path.isfile(path):
+            raise ArtifactError(f"artifact file missing: {path}")
+        if mode == "off":
+            continue
+        size = os.path.getsize(path)
+        if size != meta["bytes"]:
+            raise ArtifactError(f"artifact file truncated or replaced: {path} ({size} bytes, expected {meta['bytes']})")
+        if mode == "sha256" and sha256_file(path) != meta["sha256"]:
+            raise ArtifactError(f"artifact checksum mismatch: {path} (bundle is corrupt, rebuild it)")
+    return entry
+
+
+# ==================================================
+# 2. safetensors 读写 (读：内存映射，零拷贝)
+# ==================================================
+def save_tensors(module, path):
+    from safetensors.torch import save_file
+
+    # 非持久 buffer (如 position_ids) 也一起存：加载时模型在 meta 设备上构建，不跑随机初始化
+    tensors = {n: t.detach().contiguous() for n, t in module.named_parameters()}
+    tensors.update({n: t.detach().contiguous() for n, t in module.named_buffers()})
+    save_file(tensors, path)
+
+
+def mmap_tensors(path):
+    """
+    解析 safetensors 头，返回 {name: Tensor}，张量直接指向文件映射 (写时复制)
+    """
+    with open(path, "rb") as f:
+        try:
+            (header_len,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_len))
+        except (struct.error, ValueError) as e:
+            raise ArtifactError(f"{path} is not a valid safetensors file: {e}") from None
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    base = 8 + header_len
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = _DTYPES.get(info["dtype"])
+        if dtype is None:
+            raise ArtifactError(f"{path}: unsupported dtype {info['dtype']} for {name}")
+        start, end = info["data_offsets"]
+        shape = info["shape"]
+        if end == start:
+            tensors[name] = torch.empty(shape, dtype=dtype)
+            continue
+        count = (end - start) // torch.empty((), dtype=dtype).element_size()
+        tensors[name] = torch.frombuffer(buf, dtype=dtype, count=count, offset=base + start).view(shape)
+    return tensors
+
+
+def assign_tensors(model, tensors, path):
+    """
+    把映射出来的张量直接挂到 (meta 设备上构建的) 模型上，不经过 load_state_dict 的拷贝
+    """
+    for name, tensor in tensors.items():
+        owner_name, _, attr = name.rpartition(".")
+        try:
+            owner = model.get_submodule(owner_name)
+        except AttributeError:
+            raise ArtifactError(f"{path}: tensor {name} does not match the model architecture") from None
+        if attr in owner._parameters:
+            owner._parameters[attr] = torch.nn.Parameter(tensor, requires_grad=False)
+        elif attr in owner._buffers:
+            owner._buffers[attr] = tensor
+        else:
+            raise ArtifactError(f"{path}: tensor {name} does not match the model architecture")
+
+    missing = [n for n, t in list(model.named_parameters()) + list(model.named_buffers()) if t.is_meta]
+    if missing:
+        raise ArtifactError(f"{path}: missing tensors {missing[:5]}{' ...' if len(missing) > 5 else ''}")
+    model.eval()
+    return model
+
+
+# ==================================================
+# 3. 打包
+# ==================================================
+def bundle_clip(model_id, artifact_dir=DEFAULT_BUNDLE_DIR):
+    from transformers import CLIPModel, CLIPProcessor
+
+    component_dir = os.path.join(artifact_dir, "clip")
+    os.makedirs(component_dir, exist_ok=True)
+    model = CLIPModel.from_pretrained(model_id)
+    model.config.save_pretrained(component_dir)
+    CLIPProcessor.from_pretrained(model_id).save_pretrained(component_dir)
+    save_tensors(model, os.path.join(component_dir, WEIGHTS))
+    write_manifest(artifact_dir, "clip", {"model_id": model_id, "files": file_table(component_dir)})
+    return component_dir
+
+
+def bundle_mobilenet(artifact_dir=DEFAULT_BUNDLE_DIR):
+    from torchvision.models import MobileNet_V3_Small_Weights, mobilenet_v3_small
+
+    component_dir = os.path.join(artifact_dir, "mobilenet")
+    os.makedirs(component_dir, exist_ok=True)
+    weights = MobileNet_V3_Small_Weights.DEFAULT
+    save_tensors(mobilenet_v3_small(weights=weights), os.path.join(component_dir, WEIGHTS))
+    # 类别名和预处理参数来自 torchvision 自带的元数据，不需要额外文件
+    write_manifest(artifact_dir, "mobilenet", {"weights": str(weights), "files": file_table(component_dir)})
+    return component_dir
+
+
+# ==================================================
+# 4. 加载 (严格离线)
+# ==================================================
+def load_clip_artifact(model_id, artifact_dir=ARTIFACT_DIR):
+    """
+    返回 (processor, model)。model_id 必须与打包时一致，避免静默用错模型。
+    """
+    from transformers import CLIPConfig, CLIPModel, CLIPProcessor
+
+    entry = verify_component(artifact_dir, "clip")
+    if entry.get("model_id") != model_id:
+        raise ArtifactError(f"artifact bundle {artifact_dir} holds CLIP {entry.get('model_id')!r}, "
+                            f"but {model_id!r} was requested (ECOSCAN_CLIP_MODEL)")
+    component_dir = os.path.join(artifact_dir, "clip")
+    path = os.path.join(component_dir, WEIGHTS)
+    processor = CLIPProcessor.from_pretrained(component_dir, local_files_only=True)
+    config = CLIPConfig.from_pretrained(component_dir, local_files_only=True)
+    with torch.device("meta"):
+        model = CLIPModel(config)
+    return processor, assign_tensors(model, mmap_tensors(path), path)
+
+
+def load_mobilenet_artifact(artifact_dir=ARTIFACT_DIR):
+    from torchvision.models import mobilenet_v3_small
+
+    verify_component(artifact_dir, "mobilenet")
+    path = os.path.join(artifact_dir, "mobilenet", WEIGHTS)
+    with torch.device("meta"):
+        model = mobilenet_v3_small()
+    return assign_tensors(model, mmap_tensors(path), path)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    artifact_dir = argv[0] if argv else DEFAULT_BUNDLE_DIR
+    try:
+        for name in read_manifest(artifact_dir):
+            verify_component(artifact_dir, name, mode="sha256")
+            print(f"{name:<10} ok")
+    except ArtifactError as e:
+        sys.exit(f"error: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import json
+import os
+import warnings
+
+import torch
+
+from clip_engine import CACHE_DIR, encode_images
+
+# ==================================================
+# 推理后端：eager PyTorch / TorchScript / ONNX Runtime
+# 约定：CLIP 后端输入像素，输出 (图像特征, prompt logits)；MobileNet 后端输出 ImageNet logits
+# ==================================================
+BACKENDS = ("eager", "torchscript", "onnx")
+BACKEND = os.environ.get("ECOSCAN_BACKEND", "eager").lower()
+EXPORT_DIR = os.environ.get("ECOSCAN_EXPORT_DIR", os.path.join(CACHE_DIR, "export"))
+
+GRAPH_FILES = {"torchscript": "{name}.ts", "onnx": "{name}.onnx"}
+MANIFEST = "manifest.json"
+
+if BACKEND not in BACKENDS:
+    raise ValueError(f"ECOSCAN_BACKEND must be one of {BACKENDS}, got {BACKEND!r}")
+
+
+class ClipEagerBackend:
+    def __init__(self, model, scorer):
+        self.model = model
+        self.scorer = scorer
+
+    def __call__(self, pixel_values):
+        image_features = encode_images(self.model, pixel_values)
+        with torch.no_grad():
+            return image_features, self.scorer.prompt_logits(image_features)
+
+
+class TorchScriptBackend:
+    def __init__(self, path):
+        self.module = torch.jit.load(path, map_location="cpu")
+        self.module.eval()
+
+    def __call__(self, pixel_values):
+        with torch.no_grad():
+            return self.module(pixel_values)
+
+
+class OnnxBackend:
+    def __init__(self, path):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("ONNX backend requires onnxruntime (pip install onnxruntime)") from e
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, pixel_values):
+        outs = self.session.run(None, {self.input_name: pixel_values.detach().cpu().numpy()})
+        outs = tuple(torch.from_numpy(o) for o in outs)
+        return outs if len(outs) > 1 else outs[0]
+
+
+def open_graph(kind, path):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"exported graph not found: {path} (run export_models.py first)")
+    return TorchScriptBackend(path) if kind == "torchscript" else OnnxBackend(path)
+
+
+# ==================================================
+# 导出
+# ==================================================
+class ClipVisionHead(torch.nn.Module):
+    """
+    视觉塔 + 投影 + 归一化 + 缓存好的 prompt 矩阵，融成一张图导出
+    """
+
+    def __init__(self, model, text_features, logit_scale):
+        super().__init__()
+        self.vision_model = model.vision_model
+        self.visual_projection = model.visual_projection
+        self.register_buffer("text_features_t", text_features.T.contiguous())
+        self.logit_scale = float(logit_scale)
+
+    def forward(self, pixel_values):
+        pooled = self.vision_model(pixel_values=pixel_values).pooler_output
+        feats = self.visual_projection(pooled)
+        feats = feats / feats.norm(dim=-1, keepdim=True)
+        return feats, self.logit_scale * feats @ self.text_features_t
+
+
+def read_manifest(export_dir=EXPORT_DIR):
+    try:
+        with open(os.path.join(export_dir, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(export_dir, key, entry):
+    manifest = read_manifest(export_dir)
+    manifest[key] = entry
+    with open(os.path.join(export_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def export_graph(module, dummy, export_dir, name, formats, output_names):
+    os.makedirs(export_dir, exist_ok=True)
+    module.eval()
+    written = []
+    if "torchscript" in formats:
+        path = os.path.join(export_dir, GRAPH_FILES["torchscript"].format(name=name))
+        with torch.no_grad(), warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            traced = torch.jit.freeze(torch.jit.trace(module, dummy, strict=False))
+        traced.save(path)
+        written.append(path)
+    if "onnx" in formats:
+        path = os.path.join(export_dir, GRAPH_FILES["onnx"].format(name=name))
+        dynamic_axes = {"pixel_values": {0: "batch"}}
+        dynamic_axes.update({n: {0: "batch"} for n in output_names})
+        with torch.no_grad(), warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            torch.onnx.export(module, (dummy,), path, input_names=["pixel_values"],
+                              output_names=output_names, dynamic_axes=dynamic_axes,
+                              opset_version=17, dynamo=False)
+        written.append(path)
+    return written
+
+
+def export_clip(categories, model_id, export_dir=EXPORT_DIR, formats=("torchscript", "onnx")):
+    from clip_engine import build_prompts, load_clip, prompt_set_hash
+
+    # 导出图融合的是 prompt 矩阵，不受 ECOSCAN_PROBE_DIR 影响
+    preprocess, eager, scorer = load_clip(categories, model_id, backend="eager", probe="")
+    head = ClipVisionHead(eager.model, scorer.text_features, scorer.logit_scale)
+    dummy = torch.zeros(2, 3, preprocess.size, preprocess.size)
+
+    written = export_graph(head, dummy, export_dir, "clip_vision", formats,
+                           ["image_features", "prompt_logits"])
+    # 预处理配置一起导出，运行时不再需要访问 model hub
+    preprocess.image_processor.save_pretrained(os.path.join(export_dir, "clip_processor"))
+    prompts, _ = build_prompts(categories)
+    _write_manifest(export_dir, "clip", {
+        "model_id": model_id,
+        "prompt_hash": prompt_set_hash(model_id, prompts),
+        "formats": sorted(formats),
+    })
+    return written
+
+
+def export_mobilenet(export_dir=EXPORT_DIR, formats=("torchscript", "onnx")):
+    from mobilenet_engine import load_mobilenet
+
+    model, _, _ = load_mobilenet(backend="eager")
+    written = export_graph(model, torch.zeros(2, 3, 224, 224), export_dir, "mobilenet", formats, ["logits"])
+    _write_manifest(export_dir, "mobilenet", {"formats": sorted(formats)})
+    return written
+
+
+# ==================================================
+# 加载导出产物
+# ==================================================
+def load_exported_clip(kind, model_id, prompt_hash, export_dir=EXPORT_DIR):
+    """
+    返回 (image_processor, backend)。prompt 集合变了必须重新导出，否则直接报错而不是给出错误结果。
+    prompt_hash=None：调用方只用图像特征 (线性头)，不检查 prompt 集合。
+    """
+    from transformers import CLIPImageProcessor
+
+    entry = read_manifest(export_dir).get("clip")
+    if entry is None or entry.get("model_id") != model_id:
+        raise FileNotFoundError(
+            f"no exported CLIP graph for {model_id} in {export_dir} (run: python export_models.py --model clip)"
+        )
+    if prompt_hash is not None and entry.get("prompt_hash") != prompt_hash:
+        raise RuntimeError(
+            "exported CLIP graph was built for a different prompt set; re-run export_models.py --model clip"
+        )
+    image_processor = CLIPImageProcessor.from_pretrained(os.path.join(export_dir, "clip_processor"))
+    path = os.path.join(export_dir, GRAPH_FILES[kind].format(name="clip_vision"))
+    return image_processor, open_graph(kind, path)
+
+
+def load_exported_mobilenet(kind, export_dir=EXPORT_DIR):
+    path = os.path.join(export_dir, GRAPH_FILES[kind].format(name="mobilenet"))
+    return open_graph(kind, path)
@@ -0,0 +1,292 @@
+"""
+命令行批量分类：不依赖 Streamlit，用于给历史图片批量回填标签
+
+    python batch_classify.py photos/ -o labels.jsonl
+    python batch_classify.py manifest.txt -o labels.csv --model mobilenet --batch-size 64 --workers 8
+
+- 输入：图片目录 (递归) 或清单文件 (每行一个路径；.csv 取第一列)
+- 解码/预处理在多进程里并行，推理按固定 batch 进行，结果边算边追加写入
+- 同时在途的图片数有上限，内存占用与输入规模无关
+- 中途崩溃后用同样的命令重跑即可：输出文件里已有的路径会被跳过
+"""
+import argparse
+import copy
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from preprocess import decode_image
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+FIELDS = ["path", "model", "category", "confidence", "points", "raw", "error"]
+
+
+# ==================================================
+# 1. 输入：目录 / 清单，惰性遍历
+# ==================================================
+def iter_directory(root):
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            entries = sorted(os.scandir(d), key=lambda e: e.name)
+        except OSError:
+            continue
+        for e in entries:
+            if e.is_dir(follow_symlinks=False):
+                stack.append(e.path)
+            elif e.name.lower().endswith(IMAGE_EXTS):
+                yield e.path
+
+
+def iter_manifest(path):
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = csv.reader(f) if path.lower().endswith(".csv") else ([line] for line in f)
+        for row in rows:
+            if not row:
+                continue
+            p = row[0].strip()
+            if not p or p.startswith("#") or p == "path":
+                continue
+            yield p if os.path.isabs(p) else os.path.join(base, p)
+
+
+def iter_inputs(source):
+    if os.path.isdir(source):
+        return iter_directory(source)
+    return iter_manifest(source)
+
+
+# ==================================================
+# 2. 输出：JSONL / CSV 追加写 + 断点续跑
+# ==================================================
+def load_done(path, fmt):
+    """
+    读取已有输出，返回已处理过的路径集合。最后一行写了一半也没关系。
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "jsonl":
+            for line in f:
+                try:
+                    done.add(json.loads(line)["path"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+        else:
+            for row in csv.DictReader(f):
+                # 半截行缺字段，视为未完成
+                if row.get("error") is not None and row.get("path"):
+                    done.add(row["path"])
+    return done
+
+
+class ResultWriter:
+    def __init__(self, path, fmt):
+        self.fmt = fmt
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            # 崩溃时可能留下不完整的最后一行，补个换行再继续追加
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        self.f = open(path, "a", newline="", encoding="utf-8")
+        if exists and needs_newline:
+            self.f.write("\n")
+        if fmt == "csv":
+            self.csv = csv.DictWriter(self.f, fieldnames=FIELDS)
+            if not exists:
+                self.csv.writeheader()
+
+    def write(self, rows):
+        for row in rows:
+            if self.fmt == "jsonl":
+                self.f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            else:
+                self.csv.writerow(row)
+        # 每个 batch 落盘一次，崩溃最多丢一个 batch
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        self.f.close()
+
+
+# ==================================================
+# 3. 预处理 worker (子进程)
+# ==================================================
+_worker_transform = None
+
+
+def _init_worker(model_kind, fused):
+    """
+    fused: CLIP 时为父进程加载模型时得到的 FusedPreprocessor (已去掉 image_processor)；
+    子进程不再自己 from_pretrained，产物目录 / 导出目录 / 离线部署下与父进程的预处理完全一致
+    """
+    global _worker_transform
+    # 子进程只做 CPU 预处理，不抢推理线程
+    import torch
+    torch.set_num_threads(1)
+
+    if model_kind == "clip":
+        _worker_transform = (fused.size, fused.array)
+    else:
+        from torchvision.models import MobileNet_V3_Small_Weights
+
+        preprocess = MobileNet_V3_Small_Weights.DEFAULT.transforms()
+        # resize_size=256 后再 center crop 224，按 256 做 JPEG draft 解码
+        _worker_transform = (preprocess.resize_size[0], lambda image: preprocess(image).numpy())
+
+
+def _decode(path):
+    try:
+        draft_size, transform = _worker_transform
+        image = decode_image(path, draft_size)
+        return path, transform(image).astype(np.float32), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def iter_decoded(executor, paths, max_inflight):
+    """
+    有界预取：最多 max_inflight 张图在途，按输入顺序产出
+    """
+    pending = deque()
+    for p in paths:
+        pending.append(executor.submit(_decode, p))
+        if len(pending) >= max_inflight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+# ==================================================
+# 4. 推理
+# ==================================================
+def build_classifier(model_kind, model_id, quantize=False):
+    """
+    返回 (fn(pixel_batch[N,3,H,W]) -> list[dict], 传给预处理 worker 的 FusedPreprocessor 或 None)
+    """
+    fused = None
+    if model_kind == "clip":
+        from categories import CATEGORIES
+        from clip_engine import load_clip, classify_pixels
+
+        preprocess, model, scorer = load_clip(CATEGORIES, model_id, quantize=quantize)
+        # 只把缩放 / 归一化参数传给子进程，原始 image_processor 留在父进程
+        fused = copy.copy(preprocess)
+        fused.image_processor = None
+
+        def run(batch):
+            return [
+                {"category": cat, "confidence": round(conf, 6),
+                 "points": CATEGORIES[cat]["points"], "raw": ""}
+                for cat, conf in classify_pixels(model, scorer, batch)
+            ]
+    else:
+        from mobilenet_engine import load_mobilenet, classify_batch
+
+        model, _, mapper = load_mobilenet(quantize=quantize)
+        # category 写类别 key (与 CLIP 输出同一套 schema，两种模型的结果可以合并)，不写显示用的 label
+        key_of = {label: key for key, label, *_ in mapper.outcomes}
+
+        def run(batch):
+            return [
+                {"category": key_of[label], "confidence": round(score, 6), "points": points, "raw": raw_name}
+                for label, _, points, raw_name, score, _ in classify_batch(model, mapper, batch)
+            ]
+    return run, fused
+
+
+def run_batches(classify, decoded, writer, model_kind, batch_size):
+    import torch
+
+    total = 0
+    t0 = time.time()
+    paths, arrays, rows = [], [], []
+
+    def flush():
+        nonlocal total
+        if arrays:
+            batch = torch.from_numpy(np.stack(arrays))
+            for p, res in zip(paths, classify(batch)):
+                rows.append({"path": p, "model": model_kind, **res, "error": ""})
+        writer.write(rows)
+        total += len(rows)
+        paths.clear()
+        arrays.clear()
+        rows.clear()
+        rate = total / max(time.time() - t0, 1e-9)
+        print(f"\r{total} images  {rate:.1f} img/s", end="", file=sys.stderr, flush=True)
+
+    for path, arr, err in decoded:
+        if err is not None:
+            rows.append({"path": path, "model": model_kind, "category": "", "confidence": "",
+                         "points": "", "raw": "", "error": err})
+        else:
+            paths.append(path)
+            arrays.append(arr)
+        if len(arrays) >= batch_size or len(rows) >= batch_size:
+            flush()
+    if arrays or rows:
+        flush()
+    print(file=sys.stderr)
+    return total
+
+
+# ==================================================
+# 5. 入口
+# ==================================================
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Headless batch waste classifier")
+    ap.add_argument("source", help="image directory or manifest file (.txt / .csv)")
+    ap.add_argument("-o", "--output", required=True, help="results file (.jsonl or .csv)")
+    ap.add_argument("--model", choices=["clip", "mobilenet"], default="clip")
+    ap.add_argument("--model-id", default=None, help="CLIP model id or local path")
+    ap.add_argument("--batch-size", type=int, default=32)
+    ap.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    ap.add_argument("--prefetch", type=int, default=None,
+                    help="max images in flight (default: 2 x batch size)")
+    ap.add_argument("--format", choices=["jsonl", "csv"], default=None)
+    ap.add_argument("--quantize", action="store_true", help="int8 dynamic quantization (CPU)")
+    return ap.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    fmt = args.format or ("csv" if args.output.lower().endswith(".csv") else "jsonl")
+
+    from clip_engine import CLIP_MODEL_ID
+    from quantization import QUANTIZE
+    model_id = args.model_id or CLIP_MODEL_ID
+
+    done = load_done(args.output, fmt)
+    if done:
+        print(f"resume: skipping {len(done)} already processed", file=sys.stderr)
+    paths = (p for p in iter_inputs(args.source) if p not in done)
+
+    classify, fused = build_classifier(args.model, model_id, quantize=args.quantize or QUANTIZE)
+    writer = ResultWriter(args.output, fmt)
+    max_inflight = args.prefetch or args.batch_size * 2
+    try:
+        # spawn：避免在已初始化 torch 线程池的父进程里 fork
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                 initargs=(args.model, fused),
+                                 mp_context=multiprocessing.get_context("spawn")) as ex:
+            decoded = iter_decoded(ex, paths, max_inflight)
+            run_batches(classify, decoded, writer, args.model, args.batch_size)
+    finally:
+        writer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+分类热路径的离线微基准 (不需要网络)
+
+    python bench.py                               # tiny 随机初始化模型，batch 1/8/32
+    python bench.py --config full                 # ViT-B/32 / MobileNetV3 完整结构，随机权重
+    python bench.py --config real                 # 本地已缓存的真实权重
+    python bench.py --compare bench_results/base.json
+
+每个 (阶段, batch size) 报告吞吐、p50/p95/p99 延迟和峰值 RSS，结果存成 JSON，
+--compare 对比历史结果，吞吐下降超过 --tolerance 时以非零状态码退出 (适合 CI)。
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+STAGES = (
+    "clip.preprocess", "clip.preprocess_legacy", "clip.vision", "clip.score", "clip.classify",
+    "mobilenet.preprocess", "mobilenet.forward", "mobilenet.map", "mobilenet.classify",
+)
+
+TINY_CLIP = dict(
+    text_config=dict(hidden_size=64, intermediate_size=128, num_hidden_layers=2, num_attention_heads=4,
+                     vocab_size=1000, bos_token_id=0, eos_token_id=1, pad_token_id=1),
+    vision_config=dict(hidden_size=64, intermediate_size=128, num_hidden_layers=2, num_attention_heads=4,
+                       image_size=224, patch_size=32),
+    projection_dim=64,
+)
+
+
+# ==================================================
+# 1. 内存：按阶段统计峰值 RSS
+# ==================================================
+def reset_peak_rss():
+    # Linux：写 5 到 clear_refs 会重置 VmHWM；其他平台只能拿到进程级峰值
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if sys.platform == "darwin" else rss / 1024
+
+
+# ==================================================
+# 2. 模型：tiny / full 随机初始化，或本地缓存的真实权重
+# ==================================================
+def build_clip(config):
+    from categories import CATEGORIES
+    from clip_engine import PromptScorer, build_prompts, load_clip
+    from backends import ClipEagerBackend
+    from preprocess import FusedPreprocessor
+    from transformers import CLIPConfig, CLIPImageProcessor, CLIPModel
+
+    if config == "real":
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        preprocess, backend, scorer = load_clip(CATEGORIES)
+        return preprocess, backend, scorer, preprocess.image_processor
+
+    torch.manual_seed(0)
+    model = CLIPModel(CLIPConfig(**TINY_CLIP) if config == "tiny" else CLIPConfig())
+    model.eval()
+    # 随机模型没有 tokenizer：文本特征直接用随机单位向量代替，形状和真实一致
+    prompts, prompt_to_cat = build_prompts(CATEGORIES)
+    text = torch.nn.functional.normalize(torch.randn(len(prompts), model.config.projection_dim), dim=-1)
+    scorer = PromptScorer(text, prompt_to_cat, model.logit_scale.exp().item())
+    image_processor = CLIPImageProcessor()
+    return FusedPreprocessor.from_image_processor(image_processor), ClipEagerBackend(model, scorer), scorer, image_processor
+
+
+def build_mobilenet(config):
+    from mobilenet_engine import WasteMapper, load_mobilenet
+    from torchvision.models import MobileNet_V3_Small_Weights, mobilenet_v3_small
+
+    if config == "real":
+        return load_mobilenet()
+    torch.manual_seed(0)
+    weights = MobileNet_V3_Small_Weights.DEFAULT
+    model = mobilenet_v3_small(weights=None)
+    model.eval()
+    return model, weights.transforms(), WasteMapper(weights.meta["categories"])
+
+
+def synthetic_images(n, size=(640, 480), seed=0):
+    rng = np.random.default_rng(seed)
+    # 低频噪声放大，比纯白噪声更接近照片的压缩/缩放特性
+    return [Image.fromarray(rng.integers(0, 256, (30, 40, 3), dtype=np.uint8)).resize(size, Image.Resampling.BICUBIC)
+            for _ in range(n)]
+
+
+def load_images(source, n):
+    from batch_classify import iter_inputs
+    from preprocess import decode_image
+    paths = [p for _, p in zip(range(n), iter_inputs(source))]
+    images = [decode_image(p) for p in paths]
+    while len(images) < n:
+        images += images[: n - len(images)]
+    return images
+
+
+# ==================================================
+# 3. 计时
+# ==================================================
+def measure(fn, items, warmup, min_iters, min_time):
+    for _ in range(warmup):
+        fn()
+    reset_peak_rss()
+    lat = []
+    t_start = time.perf_counter()
+    while len(lat) < min_iters or time.perf_counter() - t_start < min_time:
+        t = time.perf_counter()
+        fn()
+        lat.append(time.perf_counter() - t)
+    total = sum(lat)
+    lat_ms = sorted(x * 1000 for x in lat)
+
+    def pct(q):
+        return lat_ms[min(len(lat_ms) - 1, int(round(q * (len(lat_ms) - 1))))]
+
+    return {
+        "iters": len(lat),
+        "items_per_s": round(items * len(lat) / total, 2),
+        "mean_ms": round(statistics.fmean(lat_ms), 3),
+        "p50_ms": round(pct(0.50), 3),
+        "p95_ms": round(pct(0.95), 3),
+        "p99_ms": round(pct(0.99), 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def stage_fns(clip, mobilenet, images):
+    """
+    每个阶段返回 fn(batch_size) -> 无参可调用对象 (输入在这里提前准备好，不计入计时)
+    """
+    from clip_engine import classify_images
+    from mobilenet_engine import classify_batch
+    from preprocess import legacy_pixels
+
+    fns = {}
+    if clip is not None:
+        preprocess, backend, scorer, image_processor = clip
+
+        def clip_vision(b):
+            px = preprocess(images[:b])
+            return lambda: backend(px)
+
+        def clip_score(b):
+            _, logits = backend(preprocess(images[:b]))
+            return lambda: scorer.decide(scorer.probs(logits))
+
+        fns.update({
+            "clip.preprocess": lambda b: (lambda: preprocess(images[:b])),
+            "clip.preprocess_legacy": lambda b: (lambda: legacy_pixels(image_processor, images[:b])),
+            "clip.vision": clip_vision,
+            "clip.score": clip_score,
+            "clip.classify": lambda b: (lambda: classify_images(preprocess, backend, scorer, images[:b])),
+        })
+    if mobilenet is not None:
+        model, mpre, mapper = mobilenet
+
+        def mpixels(b):
+            return torch.stack([mpre(im) for im in images[:b]])
+
+        def m_forward(b):
+            px = mpixels(b)
+
+            def run():
+                with torch.no_grad():
+                    return model(px)
+            return run
+
+        def m_map(b):
+            with torch.no_grad():
+                probs = model(mpixels(b)).softmax(-1)
+            return lambda: mapper.decide(probs)
+
+        fns.update({
+            "mobilenet.preprocess": lambda b: (lambda: mpixels(b)),
+            "mobilenet.forward": m_forward,
+            "mobilenet.map": m_map,
+            # 端到端：预处理 + 推理 + 映射
+            "mobilenet.classify": lambda b: (lambda: classify_batch(model, mapper, mpixels(b))),
+        })
+    return fns
+
+
+# ==================================================
+# 4. 对比历史结果
+# ==================================================
+def compare(current, baseline_path, tolerance):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    base = {(r["stage"], r["batch_size"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"\n{'stage':<26}{'batch':>6}{'base/s':>12}{'now/s':>12}{'delta':>9}")
+    for r in current["results"]:
+        b = base.get((r["stage"], r["batch_size"]))
+        if b is None or "items_per_s" not in r or "items_per_s" not in b:
+            continue
+        delta = r["items_per_s"] / b["items_per_s"] - 1
+        flag = "  <-- regression" if delta < -tolerance else ""
+        print(f"{r['stage']:<26}{r['batch_size']:>6}{b['items_per_s']:>12}{r['items_per_s']:>12}{delta * 100:>8.1f}%{flag}")
+        if flag:
+            regressions.append(r)
+    return regressions
+
+
+def git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Offline micro-benchmarks for the classification hot paths")
+    ap.add_argument("--config", choices=["tiny", "full", "real"], default="tiny")
+    ap.add_argument("--batch-sizes", default="1,8,32")
+    ap.add_argument("--stages", default=",".join(STAGES), help="comma separated, prefix match (e.g. clip)")
+    ap.add_argument("--images", default=None, help="image dir/manifest (default: synthetic images)")
+    ap.add_argument("--threads", type=int, default=None)
+    ap.add_argument("--warmup", type=int, default=2)
+    ap.add_argument("--min-iters", type=int, default=10)
+    ap.add_argument("--min-time", type=float, default=1.0, help="seconds per stage")
+    ap.add_argument("--out", default=None, help="JSON output (default: bench_results/<timestamp>.json)")
+    ap.add_argument("--compare", default=None, help="baseline JSON to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.10, help="allowed throughput drop (0.10 = 10%%)")
+    args = ap.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    batch_sizes = [int(x) for x in args.batch_sizes.split(",") if x]
+    wanted = [s for s in STAGES if any(s.startswith(p.strip()) for p in args.stages.split(","))]
+
+    results = []
+    clip = mobilenet = None
+    if any(s.startswith("clip") for s in wanted):
+        reset_peak_rss()
+        t = time.perf_counter()
+        clip = build_clip(args.config)
+        results.append({"stage": "clip.load", "batch_size": 0,
+                        "seconds": round(time.perf_counter() - t, 3), "peak_rss_mb": round(peak_rss_mb(), 1)})
+    if any(s.startswith("mobilenet") for s in wanted):
+        reset_peak_rss()
+        t = time.perf_counter()
+        mobilenet = build_mobilenet(args.config)
+        results.append({"stage": "mobilenet.load", "batch_size": 0,
+                        "seconds": round(time.perf_counter() - t, 3), "peak_rss_mb": round(peak_rss_mb(), 1)})
+
+    n = max(batch_sizes)
+    images = load_images(args.images, n) if args.images else synthetic_images(n)
+    fns = stage_fns(clip, mobilenet, images)
+
+    for r in results:
+        print(f"{r['stage']:<26}{'':>6}{r['seconds']:>10.3f} s{r['peak_rss_mb']:>10.1f} MB")
+    print(f"{'stage':<26}{'batch':>6}{'items/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'RSS MB':>10}")
+    for stage in wanted:
+        for b in batch_sizes:
+            r = {"stage": stage, "batch_size": b,
+                 **measure(fns[stage](b), b, args.warmup, args.min_iters, args.min_time)}
+            results.append(r)
+            print(f"{stage:<26}{b:>6}{r['items_per_s']:>12}{r['p50_ms']:>10}{r['p95_ms']:>10}"
+                  f"{r['p99_ms']:>10}{r['peak_rss_mb']:>10}")
+
+    report = {
+        "meta": {
+            "config": args.config,
+            "git": git_rev(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "threads": torch.get_num_threads(),
+            "cpu_count": os.cpu_count(),
+            "machine": platform.machine(),
+            "images": args.images or "synthetic",
+        },
+        "results": results,
+    }
+    out = args.out or os.path.join("bench_results", time.strftime("%Y%m%d-%H%M%S") + f"-{args.config}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nsaved {out}")
+
+    if args.compare and compare(report, args.compare, args.tolerance):
+        sys.exit(1)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""
+两级级联：MobileNetV3 先看，把握够的直接给结果，拿不准的才交给 CLIP
+
+    python cascade.py samples/                        # 校准阈值 (按标注) 并报告升级率 / 各级耗时
+    python cascade.py samples/ --reference clip       # 以 CLIP 的答案为准校准 (级联 ≈ CLIP，但更快)
+    ECOSCAN_CASCADE=1 streamlit run app.py
+
+样本集格式与 compare_quantized.py 相同 (按类别 key 分子文件夹，或 path,label 的 CSV)。
+阈值按 MobileNet 的每个垃圾类别分别校准：该类别里分数 ≥ 阈值的图片，与参考答案一致的比例不低于 --target。
+没有校准文件时级联不接受任何 MobileNet 结果 (全部交给 CLIP)，先跑一次校准再打开 ECOSCAN_CASCADE。
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+from metrics import METRICS
+
+# 与 clip_engine.CACHE_DIR 相同 (这里不导入 clip_engine，避免带上 torch)
+_CACHE_DIR = os.environ.get("ECOSCAN_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+CASCADE = os.environ.get("ECOSCAN_CASCADE", "").lower() in ("1", "true", "yes")
+CALIBRATION_PATH = os.environ.get("ECOSCAN_CASCADE_CALIBRATION", os.path.join(_CACHE_DIR, "cascade_calibration.json"))
+# 与用户纠正过的图片 (MobileNet logits 的余弦相似度) 至少这么像时不直接采纳，交给 CLIP + 纠错索引
+CONFIRMED_MIN_SIM = float(os.environ.get("ECOSCAN_CASCADE_CONFIRMED_SIM", "0.9"))
+CONFIRMED_MAX = 4096
+
+# MobileNet 的"其他垃圾"混着 food / special / vinyl 等它分不出的类别：永远交给 CLIP
+ALWAYS_ESCALATE = ("trash",)
+# 只有 top-1 是这些 ImageNet 类时 MobileNet 的结果才可能被直接采纳，其余一律升级。
+# 关键词规则是子串匹配，和 CLIP 的类别体系对不上的很多：computer keyboard / mouse / modem / remote control
+# → plastic、table lamp / lens cap → glass (CLIP: special)，coffee mug / vase (陶瓷) → glass (CLIP: trash)，
+# beer bottle → plastic、notebook (笔记本电脑) → paper、stingray → can ...
+DIRECT_CLASSES = {
+    "plastic": ("water bottle", "pop bottle", "water jug", "lotion", "soap dispenser", "sunscreen"),
+    "paper": ("carton", "envelope", "packet", "comic book", "book jacket", "menu"),
+    "can": ("milk can", "can opener", "corkscrew", "chain", "thimble", "letter opener"),
+    "glass": ("goblet", "beaker", "red wine"),
+}
+TARGET_PRECISION = 0.95
+# 阈值是在 WasteMapper.decide 的类别 / 分数上校准的：映射规则 / 打分方式变了要加一，旧的校准文件随之作废
+CALIBRATION_VERSION = 3
+MIN_SUPPORT = 10
+
+
+# ==================================================
+# 1. 第一级：MobileNet → (类别 key, 映射后的分数)
+# ==================================================
+def mobilenet_scores(loaded, images):
+    """
+    list[PIL.Image] → ([key, ...], [score, ...], [direct, ...], signatures)，loaded 为 load_mobilenet() 的返回值。
+    direct: top-1 ImageNet 类在 DIRECT_CLASSES 里 (允许不升级)；
+    signatures: [N, 1000] 去均值、L2 归一化的 logits (numpy)，用来找用户纠正过的相似图片
+    """
+    import torch
+
+    model, preprocess, mapper = loaded
+    with METRICS.timer("mobilenet", "preprocess"):
+        batch = torch.stack([preprocess(im.convert("RGB") if im.mode != "RGB" else im) for im in images])
+    with torch.no_grad():
+        with METRICS.timer("mobilenet", "vision"):
+            logits = model(batch)
+        with METRICS.timer("mobilenet", "score"):
+            rule_idx, score, class_id = mapper.decide(logits.softmax(-1))
+            centered = logits - logits.mean(dim=-1, keepdim=True)
+            signatures = torch.nn.functional.normalize(centered.float(), dim=-1).numpy()
+    keys = [mapper.keys[r] for r in rule_idx.tolist()]
+    direct = [mapper.class_names[c] in DIRECT_CLASSES.get(k, ()) for k, c in zip(keys, class_id.tolist())]
+    return keys, score.tolist(), direct, signatures
+
+
+# ==================================================
+# 2. 阈值：读写 / 校准
+# ==================================================
+def load_calibration(path=CALIBRATION_PATH):
+    """
+    → {类别: 阈值}；没有校准文件 (或是旧版分数尺度上校准的) 时返回 None (级联全部升级)
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            calibration = json.load(f)
+        if calibration.get("version") != CALIBRATION_VERSION:
+            print(f"warning: {path} was calibrated for older MobileNet scores, re-run cascade.py", file=sys.stderr)
+            return None
+        return calibration["thresholds"]
+    except (OSError, ValueError, KeyError, AttributeError):
+        return None
+
+
+def save_calibration(thresholds, path=CALIBRATION_PATH, info=None):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": CALIBRATION_VERSION, "thresholds": thresholds, **(info or {})}, f, indent=2,
+                  ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def calibrate(keys, scores, reference, target=TARGET_PRECISION, min_support=MIN_SUPPORT):
+    """
+    每个类别单独找阈值：按 MobileNet 分数从高到低累计，取精度 (与参考答案一致的比例) 仍 ≥ target 的最低分数。
+    样本不足 min_support 或怎么都达不到 target 的类别不设阈值 (一律升级)；key 为 None 的图片 (不可能被采纳) 不参与
+    """
+    thresholds = {}
+    for key in sorted(set(keys) - set(ALWAYS_ESCALATE) - {None}):
+        rows = sorted(((s, ref == key) for k, s, ref in zip(keys, scores, reference) if k == key), reverse=True)
+        correct = 0
+        for n, (score, ok) in enumerate(rows, 1):
+            correct += ok
+            if n >= min_support and correct / n >= target:
+                thresholds[key] = round(score, 6)
+    return thresholds
+
+
+# ==================================================
+# 3. 级联
+# ==================================================
+class Cascade:
+    """
+    classify_images() 与 clip_engine.classify_images 返回格式相同：[(category, confidence), ...]。
+    mobilenet / clip: 无参函数，返回 load_mobilenet() / load_clip() 的结果 (可以直接传 BackgroundLoader.result)，
+    整批都被 MobileNet 接住时 CLIP 一次都不用等。
+    thresholds: {类别: 阈值}，默认读校准文件；不在表里的类别一律升级 (没有校准文件时全部升级)
+    confirm(): 用户纠正过的结果；之后 MobileNet 看来与之相像的图片都交给 CLIP，让纠错索引参与投票
+    """
+
+    def __init__(self, mobilenet, clip, thresholds=None):
+        self.mobilenet = mobilenet
+        self.clip = clip
+        if thresholds is None:
+            thresholds = load_calibration()
+        self.calibrated = thresholds is not None
+        if not self.calibrated:
+            print("warning: cascade is not calibrated, every image goes to CLIP (run: python cascade.py <samples>)",
+                  file=sys.stderr)
+        self.thresholds = dict(thresholds or {})
+        self._lock = threading.Lock()
+        self._stats = {"images": 0, "escalated": 0, "batches": 0, "mobilenet_s": 0.0, "clip_s": 0.0}
+        self._accepted = {}
+        self._confirmed = None  # [M, 1000] 被用户纠正过的图片的签名，最多 CONFIRMED_MAX 条
+
+    def accept(self, key, score, direct=True):
+        if key in ALWAYS_ESCALATE or not direct:
+            return False
+        return score >= self.thresholds.get(key, float("inf"))
+
+    def confirm(self, signature, label, result):
+        """
+        signature: classify_images(signatures=...) 给出的这张图的 MobileNet 签名；result: 当时给出的类别。
+        只记被纠正的 (label != result)：判对的不需要改道。只在进程内保存，CLIP 特征仍由纠错索引落盘
+        """
+        import numpy as np
+
+        if signature is None or label == result:
+            return
+        row = np.asarray(signature, np.float32).reshape(1, -1)
+        with self._lock:
+            confirmed = row if self._confirmed is None else np.concatenate([self._confirmed, row])
+            self._confirmed = confirmed[-CONFIRMED_MAX:]
+
+    def _corrected(self, signatures):
+        """
+        [N] bool：与某张被用户纠正过的图片足够相像 (MobileNet 签名的余弦相似度 ≥ CONFIRMED_MIN_SIM)
+        """
+        with self._lock:
+            confirmed = self._confirmed
+        if confirmed is None:
+            return [False] * len(signatures)
+        return ((signatures @ confirmed.T) >= CONFIRMED_MIN_SIM).any(axis=1).tolist()
+
+    def classify_images(self, images, record=None, corrections=None, embeddings=None, gate=None, signatures=None):
+        """
+        record: 可选 dict，写入本次两级各自的耗时 (秒，键 mobilenet / clip)
+        corrections / embeddings 只作用于升级到 CLIP 的图片；MobileNet 接住的图片在 embeddings 里占位为 None
+        gate: 可选 inference_server.AdmissionGate，每一级只在模型就绪后才占名额，等模型加载时不挡别的请求
+        signatures: 可选 list，追加每张图的 MobileNet 签名 (numpy)，用户纠正时传给 confirm()
+        """
+        from clip_engine import classify_images
+
+        if not images:
+            return []
+        gate = gate or contextlib.nullcontext()
+        # 等模型加载的时间不算进各级耗时
+        mobilenet = self.mobilenet()
+        t0 = time.perf_counter()
+        with gate, METRICS.timer("cascade", "mobilenet", record):
+            keys, scores, direct, sigs = mobilenet_scores(mobilenet, images)
+            corrected = self._corrected(sigs)
+        mobilenet_s = time.perf_counter() - t0
+        results = [(k, s) if self.accept(k, s, d) and not c else None
+                   for k, s, d, c in zip(keys, scores, direct, corrected)]
+        accepted = [r[0] for r in results if r is not None]
+        escalate = [i for i, r in enumerate(results) if r is None]
+        features = [None] * len(images)
+        clip_s = 0.0
+        if escalate:
+            clip = self.clip()
+            clip_embeddings = [] if embeddings is not None else None
+            t1 = time.perf_counter()
+            with gate, METRICS.timer("cascade", "clip", record):
+                fresh = classify_images(*clip, [images[i] for i in escalate],
+                                        corrections=corrections, embeddings=clip_embeddings)
+            clip_s = time.perf_counter() - t1
+            for i, r in zip(escalate, fresh):
+                results[i] = r
+            for i, f in zip(escalate, clip_embeddings or ()):
+                features[i] = f
+        if embeddings is not None:
+            embeddings.extend(features)
+        if signatures is not None:
+            signatures.extend(sigs)
+
+        with self._lock:
+            self._stats["images"] += len(images)
+            self._stats["escalated"] += len(escalate)
+            self._stats["batches"] += 1
+            self._stats["mobilenet_s"] += mobilenet_s
+            self._stats["clip_s"] += clip_s
+            for k in accepted:
+                self._accepted[k] = self._accepted.get(k, 0) + 1
+        return results
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            accepted = dict(self._accepted)
+        n, escalated = s["images"], s["escalated"]
+        return {
+            "images": n,
+            "escalated": escalated,
+            "escalation_rate": round(escalated / n, 4) if n else 0.0,
+            "accepted": accepted,
+            # 每级按经过它的图片数平均；总体 = 两级耗时之和 / 全部图片
+            "mobilenet_ms_per_image": round(1000 * s["mobilenet_s"] / n, 2) if n else 0.0,
+            "clip_ms_per_image": round(1000 * s["clip_s"] / escalated, 2) if escalated else 0.0,
+            "ms_per_image": round(1000 * (s["mobilenet_s"] + s["clip_s"]) / n, 2) if n else 0.0,
+            "calibrated": self.calibrated,
+            "thresholds": self.thresholds,
+            "confirmed": 0 if self._confirmed is None else len(self._confirmed),
+        }
+
+
+# ==================================================
+# 4. 入口：校准 + 报告
+# ==================================================
+def _accuracy(preds, labels):
+    return round(sum(p == y for p, y in zip(preds, labels)) / len(labels), 4)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Calibrate the MobileNet -> CLIP cascade and report its escalation rate")
+    ap.add_argument("source", help="labeled sample dir (label/xxx.jpg) or CSV manifest (path,label)")
+    ap.add_argument("--reference", choices=["labels", "clip"], default="labels",
+                    help="what accepted MobileNet answers must agree with")
+    ap.add_argument("--target", type=float, default=TARGET_PRECISION, help="per-category precision to keep")
+    ap.add_argument("--min-support", type=int, default=MIN_SUPPORT)
+    ap.add_argument("--out", default=CALIBRATION_PATH, help="calibration file (default: %(default)s)")
+    ap.add_argument("--batch-size", type=int, default=16)
+    ap.add_argument("--limit", type=int, default=None)
+    ap.add_argument("--json", default=None, help="write the report as JSON")
+    args = ap.parse_args(argv)
+
+    from PIL import Image
+
+    from categories import CATEGORIES
+    from clip_engine import CLIP_MODEL_ID, classify_images, load_clip
+    from compare_quantized import load_samples
+    from mobilenet_engine import load_mobilenet
+    from quantization import QUANTIZE
+
+    samples = load_samples(args.source, args.limit)
+    if not samples:
+        sys.exit(f"no labeled images found in {args.source}")
+    mobilenet = load_mobilenet(quantize=QUANTIZE)
+    clip = load_clip(CATEGORIES, CLIP_MODEL_ID, quantize=QUANTIZE)
+    batches = [[Image.open(p).convert("RGB") for p, _ in samples[i:i + args.batch_size]]
+               for i in range(0, len(samples), args.batch_size)]
+    labels = [y for _, y in samples]
+
+    # 两个模型各跑一遍全部样本 (预热一次，排除首次调用的初始化开销)
+    mobilenet_scores(mobilenet, batches[0])
+    classify_images(*clip, batches[0])
+    keys, scores, eligible, clip_preds = [], [], [], []
+    tier_s = {"mobilenet": 0.0, "clip": 0.0}
+    for images in batches:
+        t = time.perf_counter()
+        k, s, d, _ = mobilenet_scores(mobilenet, images)
+        tier_s["mobilenet"] += time.perf_counter() - t
+        t = time.perf_counter()
+        clip_preds.extend(cat for cat, _ in classify_images(*clip, images))
+        tier_s["clip"] += time.perf_counter() - t
+        keys.extend(k)
+        scores.extend(s)
+        # 不在 DIRECT_CLASSES 里的图片反正会升级，不拿来定阈值
+        eligible.extend(key if ok else None for key, ok in zip(k, d))
+
+    reference = labels if args.reference == "labels" else clip_preds
+    thresholds = calibrate(eligible, scores, reference, args.target, args.min_support)
+    save_calibration(thresholds, args.out, {
+        "reference": args.reference, "target": args.target, "samples": len(samples),
+    })
+
+    # 用校准好的阈值真正跑一遍级联：升级率与各级耗时都是实测值
+    cascade = Cascade(lambda: mobilenet, lambda: clip, thresholds)
+    cascade_preds = [cat for images in batches for cat, _ in cascade.classify_images(images)]
+    stats = cascade.stats()
+    n = len(samples)
+    report = {
+        "samples": n,
+        "reference": args.reference,
+        "target": args.target,
+        "thresholds": thresholds,
+        "accuracy": {"mobilenet": _accuracy(keys, labels), "clip": _accuracy(clip_preds, labels),
+                     "cascade": _accuracy(cascade_preds, labels)},
+        "clip_agreement": _accuracy(cascade_preds, clip_preds),
+        "ms_per_image": {"mobilenet": round(1000 * tier_s["mobilenet"] / n, 2),
+                         "clip": round(1000 * tier_s["clip"] / n, 2), "cascade": stats["ms_per_image"]},
+        "cascade": stats,
+    }
+
+    print(f"{'category':<10}{'threshold':>10}{'accepted':>10}")
+    for key in sorted(set(keys)):
+        t = thresholds.get(key)
+        print(f"{key:<10}{'-' if t is None else f'{t:.4f}':>10}{stats['accepted'].get(key, 0):>10}")
+    print(f"escalation rate {stats['escalation_rate'] * 100:.1f}%  ({stats['escalated']}/{n} images went to CLIP)")
+    print(f"{'':<10}{'ms/img':>10}{'acc':>8}")
+    for tier in ("mobilenet", "clip", "cascade"):
+        print(f"{tier:<10}{report['ms_per_image'][tier]:>10}{report['accuracy'][tier]:>8}")
+    print(f"cascade agrees with CLIP on {report['clip_agreement'] * 100:.1f}%   calibration saved to {args.out}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# ==================================================
+# 分类逻辑 (韩国标准)  ——【已增强：按韩国四大类思路 + 特殊垃圾 + 多prompt】
+# 独立成模块：Streamlit 页面和命令行批处理共用同一份类别定义
+# ==================================================
+CATEGORIES = {
+    # ♻️ 可回收 - 塑料容器/瓶
+    "plastic": {
+        "name": {"zh": "塑料(容器/瓶)", "en": "Plastic", "kr": "플라스틱 (용기/페트)"},
+        "icon": "🥤", "color": "#10b981", "points": 10,
+        "prompts": [
+            "clean plastic bottle with label removed",
+            "washed PET bottle empty",
+            "clean hard plastic container rinsed",
+            "shampoo bottle empty and clean",
+            "transparent plastic bottle clean"
+        ],
+        "tips": {
+            "zh": "先清洗→去标签/贴纸→去除异材质盖（脏污/油污洗不掉→一般垃圾）。",
+            "en": "Rinse, remove labels/caps (if dirty/greasy -> General Trash).",
+            "kr": "헹군 뒤 라벨·스티커 제거, 다른 재질 뚜껑 분리 (오염되면 일반쓰레기)."
+        }
+    },
+
+    # ♻️ 可回收 - 비닐(薄膜/包装) 仅限干净
+    "vinyl": {
+        "name": {"zh": "塑料薄膜/包装", "en": "Vinyl/Film", "kr": "비닐류 (봉투/포장재)"},
+        "icon": "🍬", "color": "#a855f7", "points": 5,
+        "prompts": [
+            "clean plastic film bag dry no oil",
+            "clean snack bag wrapper washed and dried",
+            "clean ramen packaging film",
+            "clean plastic shopping bag",
+            "plastic film packaging clean"
+        ],
+        "tips": {
+            "zh": "必须干净无油无残渣；有油渍/食物残留→一般垃圾。",
+            "en": "Only if clean/dry; greasy/food residue -> General Trash.",
+            "kr": "이물질·기름기 있으면 일반쓰레기입니다."
+        }
+    },
+
+    # ♻️ 可回收 - 스티로폼(白色干净)
+    "styrofoam": {
+        "name": {"zh": "泡沫塑料(白色干净)", "en": "Styrofoam", "kr": "스티로폼"},
+        "icon": "❄️", "color": "#94a3b8", "points": 7,
+        "prompts": [
+            "clean white styrofoam box without tape",
+            "white foam packaging clean",
+            "clean styrofoam tray rinsed",
+            "clean white foam container"
+        ],
+        "tips": {
+            "zh": "仅限白色且干净的；去胶带/贴纸；脏污→一般垃圾。",
+            "en": "White & clean only; remove tape/labels; dirty -> General Trash.",
+            "kr": "흰색·깨끗한 것만 가능, 테이프 제거 (오염되면 일반쓰레기)."
+        }
+    },
+
+    # ♻️ 可回收 - 종이류
+    "paper": {
+        "name": {"zh": "纸张/纸箱", "en": "Paper/Box", "kr": "종이류/박스"},
+        "icon": "📦", "color": "#d97706", "points": 8,
+        "prompts": [
+            "flattened cardboard box clean",
+            "stack of newspapers clean",
+            "paper package without plastic coating",
+            "paper carton box flattened",
+            "clean paper document stack"
+        ],
+        "tips": {
+            "zh": "压平投放；去胶带/订书钉；油污纸/涂层纸→一般垃圾。",
+            "en": "Flatten, remove tape/staples; greasy/coated paper -> General Trash.",
+            "kr": "펼쳐서 배출, 테이프·철심 제거 (코팅/오염 종이는 일반쓰레기)."
+        }
+    },
+
+    # ♻️ 可回收 - 금属(罐/铁铝/电线/厨具)
+    "can": {
+        "name": {"zh": "金属(罐/铁铝)", "en": "Metal", "kr": "캔류/고철"},
+        "icon": "🥫", "color": "#3b82f6", "points": 15,
+        "prompts": [
+            "empty aluminum soda can rinsed",
+            "clean metal food can",
+            "tuna can washed",
+            "metal kitchen utensil",
+            "metal wire scrap"
+        ],
+        "tips": {
+            "zh": "清洗后再投放；铝罐/金属/电线/厨具→金属回收。",
+            "en": "Rinse first; cans/wires/metal utensils -> Metal recycling.",
+            "kr": "세척 후 배출 (캔·전선·주방기구 등 금속류로 배출)."
+        }
+    },
+
+    # ♻️ 可回收 - 유리병（注意排除：镜子/碎玻璃/陶瓷/玻璃器皿）
+    "glass": {
+        "name": {"zh": "玻璃瓶", "en": "Glass Bottle", "kr": "유리병"},
+        "icon": "🍾", "color": "#0ea5e9", "points": 12,
+        "prompts": [
+            "clean glass bottle empty",
+            "washed soju bottle",
+            "beer bottle clean empty",
+            "glass bottle with no cigarette butts inside"
+        ],
+        "tips": {
+            "zh": "清洗干净且瓶内无异物；镜子/碎玻璃/陶瓷/耐热玻璃器皿→一般垃圾或指定收集点。",
+            "en": "Rinse and remove foreign objects; mirrors/broken glass/ceramics -> General/Special collection.",
+            "kr": "세척 후 이물질 제거. 거울·깨진 유리·도자기·유리식기는 일반/지정 수거."
+        }
+    },
+
+    # 🍎 食物垃圾
+    "food": {
+        "name": {"zh": "食物垃圾", "en": "Food Waste", "kr": "음식물 쓰레기"},
+        "icon": "🍎", "color": "#facc15", "points": 2,
+        "prompts": [
+            "food leftovers in bowl",
+            "fruit peels",
+            "vegetable scraps",
+            "kitchen food waste"
+        ],
+        "tips": {
+            "zh": "沥干水分；骨头/贝壳/大块硬物→一般垃圾。",
+            "en": "Drain water; bones/shells/hard items -> General Trash.",
+            "kr": "물기 제거. 뼈·조개껍데기 등은 일반쓰레기."
+        }
+    },
+
+    # 🔋 特殊垃圾（电池/灯管/药品/电子产品等）
+    "special": {
+        "name": {"zh": "特殊垃圾(电池/灯管/药品/电子)", "en": "Special Waste", "kr": "특수쓰레기"},
+        "icon": "🔋", "color": "#ef4444", "points": 0,
+        "prompts": [
+            "used battery",
+            "fluorescent lamp tube",
+            "medicine pills blister pack",
+            "old smartphone electronics",
+            "small electronic device"
+        ],
+        "tips": {
+            "zh": "电子产品/废电池/荧光灯/药品→提交到特殊垃圾收集点。",
+            "en": "Electronics/batteries/lamps/medicines -> special collection points.",
+            "kr": "전자제품·폐배터리·형광등·의약품은 지정 수거함/수거점."
+        }
+    },
+
+    # 🗑️ 一般垃圾（脏污/混合/一次性用品/破碎物/镜子/陶瓷/碎玻璃）
+    "trash": {
+        "name": {"zh": "一般垃圾", "en": "General Trash", "kr": "일반쓰레기 (종량제)"},
+        "icon": "🗑️", "color": "#475569", "points": 1,
+        "prompts": [
+            "dirty tissue",
+            "diaper disposable waste",
+            "greasy food wrapper",
+            "dirty plastic packaging with food residue",
+            "mixed garbage waste",
+            "broken ceramic plate",
+            "mirror glass",
+            "broken glass pieces"
+        ],
+        "tips": {
+            "zh": "使用计量垃圾袋；脏污/混合/一次性用品/陶瓷/镜子/碎玻璃→一般垃圾或指定收集区。",
+            "en": "Use official trash bags; dirty/mixed/disposables/ceramics/mirrors -> General/Special.",
+            "kr": "종량제 봉투 사용. 오염·혼합·일회용·도자기·거울·깨진 유리 등은 일반/지정수거."
+        }
+    },
+}
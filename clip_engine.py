@@ -0,0 +1,282 @@
+import hashlib
+import os
+
+import torch
+
+from metrics import METRICS
+
+# ==================================================
+# CLIP 推理引擎 (文本特征缓存)
+# ==================================================
+CLIP_MODEL_ID = os.environ.get("ECOSCAN_CLIP_MODEL", "openai/clip-vit-base-patch32")
+
+# 缓存目录：可用环境变量覆盖 (例如挂载到持久卷)
+CACHE_DIR = os.environ.get(
+    "ECOSCAN_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+)
+# 线性头产物目录 (python linear_probe.py 训练)；不设置 = prompt 集成
+PROBE_DIR = os.environ.get("ECOSCAN_PROBE_DIR", "")
+
+
+def build_prompts(categories):
+    """
+    把 CATEGORIES 展开成 prompt 列表，以及每条 prompt 对应的类别 key
+    """
+    prompts = []
+    prompt_to_cat = []
+    for cat_key, info in categories.items():
+        for p in info["prompts"]:
+            prompts.append(f"a photo of {p}")
+            prompt_to_cat.append(cat_key)
+    return prompts, prompt_to_cat
+
+
+def prompt_set_hash(model_id, prompts):
+    h = hashlib.sha256()
+    h.update(model_id.encode("utf-8"))
+    for p in prompts:
+        h.update(b"\0")
+        h.update(p.encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def text_cache_path(model_id, prompts, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"clip_text_{prompt_set_hash(model_id, prompts)}.pt")
+
+
+def _as_features(out):
+    # transformers>=5 的 get_*_features 返回 ModelOutput，旧版直接返回 Tensor
+    return out if isinstance(out, torch.Tensor) else out.pooler_output
+
+
+def encode_images(model, pixel_values):
+    """
+    只跑视觉塔，返回 L2 归一化后的 [N, dim] 图像特征
+    """
+    with torch.no_grad():
+        feats = _as_features(model.get_image_features(pixel_values=pixel_values))
+    return feats / feats.norm(dim=-1, keepdim=True)
+
+
+def compute_text_features(processor, model, prompts):
+    """
+    跑一次文本塔，返回 L2 归一化后的 [num_prompts, dim] 特征矩阵
+    """
+    inputs = processor(text=prompts, return_tensors="pt", padding=True)
+    with torch.no_grad():
+        feats = _as_features(model.get_text_features(**inputs))
+    return feats / feats.norm(dim=-1, keepdim=True)
+
+
+def load_text_features(processor, model, model_id, prompts, cache_dir=CACHE_DIR):
+    """
+    优先读磁盘缓存 (key = 模型 id + prompt 集合哈希)，没有再现算并落盘。
+    prompt 不变的情况下，文本塔整个生命周期只跑一次。
+    """
+    path = text_cache_path(model_id, prompts, cache_dir)
+    try:
+        cached = torch.load(path, map_location="cpu", weights_only=True)
+        if cached.get("model_id") == model_id and cached.get("prompts") == list(prompts):
+            return cached["features"]
+    except (OSError, RuntimeError, EOFError, AttributeError, KeyError):
+        pass
+
+    with METRICS.timer("clip", "text_encode"):
+        feats = compute_text_features(processor, model, prompts)
+
+    # 原子写入：先写临时文件再 rename，避免多进程同时启动时读到半个文件
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        torch.save({"model_id": model_id, "prompts": list(prompts), "features": feats}, tmp)
+        os.replace(tmp, path)
+    except OSError:
+        # 只读文件系统等情况：缓存失败不影响使用
+        pass
+    return feats
+
+
+# ==================================================
+# 打分引擎：一次 matmul + scatter max，天然支持 batch
+# ==================================================
+# 🇰🇷 韩国兜底阈值：不确定 = 一般垃圾(종량제)
+MIN_CONFIDENCE = 0.30
+MIN_MARGIN = 0.07
+MARGIN_EXEMPT = ("food", "special")
+FALLBACK_CATEGORY = "trash"
+
+
+class PromptScorer:
+    """
+    prompt 特征矩阵 + prompt→类别索引，都在加载时准备好。
+    score() 输入 [N, dim] 图像特征，输出 [N, num_categories] 的类别概率。
+    导出的 TorchScript/ONNX 图已经把 prompt matmul 融进去了，此时 text_features 可以为 None，
+    只用 probs() 从 prompt logits 做类别聚合。
+    """
+
+    def __init__(self, text_features, prompt_to_cat, logit_scale):
+        self.cat_keys = list(dict.fromkeys(prompt_to_cat))
+        self.text_features = text_features
+        self.category_index = torch.tensor(
+            [self.cat_keys.index(c) for c in prompt_to_cat], dtype=torch.long
+        )
+        self.logit_scale = None if logit_scale is None else float(logit_scale)
+
+    def prompt_logits(self, image_features):
+        return self.logit_scale * image_features @ self.text_features.T  # [N, num_prompts]
+
+    def reduce(self, logits):
+        # 每个类别取 max logit（比随机/单prompt稳很多）
+        index = self.category_index.expand_as(logits)
+        out = logits.new_full((logits.shape[0], len(self.cat_keys)), float("-inf"))
+        return out.scatter_reduce(1, index, logits, reduce="amax", include_self=True)
+
+    def category_logits(self, image_features):
+        return self.reduce(self.prompt_logits(image_features))
+
+    def probs(self, prompt_logits):
+        with torch.no_grad():
+            return torch.softmax(self.reduce(prompt_logits), dim=-1)
+
+    def score(self, image_features):
+        with torch.no_grad():
+            return torch.softmax(self.category_logits(image_features), dim=-1)
+
+    def decide(self, cat_probs):
+        """
+        [N, num_categories] 概率 → [(category, confidence), ...]
+        """
+        top2 = torch.topk(cat_probs, k=2, dim=-1)
+        conf = top2.values[:, 0]
+        margin = top2.values[:, 0] - top2.values[:, 1]
+        idx = top2.indices[:, 0]
+
+        results = []
+        for c, m, i in zip(conf.tolist(), margin.tolist(), idx.tolist()):
+            category = self.cat_keys[i]
+            if c < MIN_CONFIDENCE:
+                category = FALLBACK_CATEGORY
+            # 若第一名与第二名差距过小（易混淆），除 food/special 外也倾向一般垃圾
+            elif category not in MARGIN_EXEMPT and m < MIN_MARGIN:
+                category = FALLBACK_CATEGORY
+            results.append((category, c))
+        return results
+
+    def predict(self, image_features, prompt_logits):
+        return self.probs(prompt_logits)
+
+
+class LinearProbeScorer(PromptScorer):
+    """
+    训练好的线性头 (见 linear_probe.py) 代替 prompt 矩阵：每个类别一行权重 + 偏置，logits = W·f + b。
+    eager 后端调的就是本类的 prompt_logits()，predict() 直接用它的结果；
+    导出图里融合的是 prompt logits，用不上 (graph_logits=True，由 load_clip 设置)：从图像特征重新算一次。
+    """
+
+    def __init__(self, weight, bias, cat_keys):
+        super().__init__(weight, cat_keys, 1.0)
+        self.bias = bias
+        self.graph_logits = False
+
+    def prompt_logits(self, image_features):
+        return image_features @ self.text_features.T + self.bias  # [N, num_categories]
+
+    def reduce(self, logits):
+        return logits
+
+    def predict(self, image_features, prompt_logits):
+        with torch.no_grad():
+            if self.graph_logits:
+                prompt_logits = self.prompt_logits(image_features.float())
+            return torch.softmax(prompt_logits.float(), dim=-1)
+
+
+# ==================================================
+# 批量分类：预处理 + 一次 batched forward
+# ==================================================
+def classify_pixels(backend, scorer, pixel_values, record=None, corrections=None, embeddings=None):
+    """
+    已预处理好的 [N, 3, H, W] → [(category, confidence), ...]
+    backend 见 backends.py：输入像素，输出 (图像特征, prompt logits)
+    record: 可选 dict，写入本次各阶段耗时 (秒)
+    corrections: 可选 correction_index.CorrectionIndex，用户确认过的近邻和 prompt 分数一起投票
+    embeddings: 可选 list，追加每张图的 L2 归一化图像特征 (numpy)，供之后写入纠错索引
+    """
+    with METRICS.timer("clip", "vision", record):
+        image_features, prompt_logits = backend(pixel_values)
+    if corrections is not None or embeddings is not None:
+        features = image_features.detach().float().numpy()
+        if embeddings is not None:
+            embeddings.extend(features)
+    with METRICS.timer("clip", "score", record):
+        probs = scorer.predict(image_features, prompt_logits)
+        if corrections is not None:
+            # 近邻投票 (汉明粗筛 + 余弦重排) 计入 score 阶段
+            probs = corrections.blend(features, probs, scorer.cat_keys)
+        return scorer.decide(probs)
+
+
+def classify_images(preprocess, backend, scorer, images, record=None, corrections=None, embeddings=None):
+    """
+    list[PIL.Image] → [(category, confidence), ...]，整批只跑一次视觉塔
+    preprocess 见 preprocess.FusedPreprocessor：一次缩放直接得到输入张量
+    """
+    if not images:
+        return []
+    with METRICS.timer("clip", "preprocess", record):
+        pixel_values = preprocess(images)
+    return classify_pixels(backend, scorer, pixel_values, record, corrections, embeddings)
+
+
+def load_clip(categories, model_id=CLIP_MODEL_ID, quantize=False, backend=None, probe=None):
+    """
+    加载 CLIP + 预计算 prompt 特征，返回 (preprocess, backend, scorer)。
+    probe: 线性头所在的产物目录，默认读 ECOSCAN_PROBE_DIR；设置后用训练好的头代替 prompt 集成，
+      不再跑文本塔 ("" = 强制用 prompt)。
+    backend: "eager" / "torchscript" / "onnx"，默认读 ECOSCAN_BACKEND。
+      导出版本只加载视觉图，不实例化 CLIPModel，启动更快 (需先跑 export_models.py)。
+    设置了 ECOSCAN_ARTIFACT_DIR 时 eager 权重只从本地产物目录加载 (见 artifacts.py)。
+    quantize=True 时 eager 视觉塔走 int8 动态量化 (文本特征仍用 fp32 计算)。
+    失败直接抛异常，由调用方决定怎么兜底。
+    """
+    import backends
+    from preprocess import FusedPreprocessor
+
+    backend = backend or backends.BACKEND
+    probe = PROBE_DIR if probe is None else probe
+    prompts, prompt_to_cat = build_prompts(categories)
+    probe_scorer = None
+    if probe:
+        from linear_probe import load_probe
+        probe_scorer = load_probe(probe, model_id, categories)
+    if backend != "eager":
+        # 用线性头时只取导出图的图像特征，prompt 集合变了也不必重新导出
+        prompt_hash = None if probe_scorer else prompt_set_hash(model_id, prompts)
+        image_processor, runner = backends.load_exported_clip(backend, model_id, prompt_hash)
+        if probe_scorer is not None:
+            probe_scorer.graph_logits = True
+        scorer = probe_scorer or PromptScorer(None, prompt_to_cat, None)
+        return FusedPreprocessor.from_image_processor(image_processor), runner, scorer
+
+    import artifacts
+    if artifacts.ARTIFACT_DIR:
+        # 本地打包产物：严格离线、校验完整性、权重内存映射 (多进程共享页缓存)
+        processor, model = artifacts.load_clip_artifact(model_id)
+    else:
+        from transformers import CLIPModel, CLIPProcessor
+
+        processor = CLIPProcessor.from_pretrained(model_id)
+        model = CLIPModel.from_pretrained(model_id)
+        model.eval()
+    if probe_scorer is not None:
+        scorer = probe_scorer
+    else:
+        # prompt 固定不变：文本特征只算一次并缓存到磁盘
+        text_features = load_text_features(processor, model, model_id, prompts)
+        scorer = PromptScorer(text_features, prompt_to_cat, model.logit_scale.exp().item())
+    if quantize:
+        from quantization import quantize_dynamic_int8
+        model = quantize_dynamic_int8(model)
+    preprocess = FusedPreprocessor.from_image_processor(processor.image_processor)
+    return preprocess, backends.ClipEagerBackend(model, scorer), scorer
@@ -0,0 +1,169 @@
+"""
+fp32 vs int8 动态量化对比：在带标签的小样本集上跑两遍，报告延迟 / checkpoint 大小 / 准确率 / top-1 一致率
+
+    python compare_quantized.py samples/ --model clip
+    python compare_quantized.py samples.csv --model mobilenet --json report.json
+
+样本集：目录下按类别 key 分子文件夹 (samples/plastic/*.jpg ...)，
+或 CSV 清单 (path,label)。label 使用 categories.CATEGORIES 的 key。
+
+ckpt MB 是 state_dict 序列化后的大小 (磁盘 / 下载体积)，不是运行时内存：
+两种精度在同一进程里跑，RSS 分不开；要看内存占用请分别单独起进程测。
+"""
+import argparse
+import copy
+import csv
+import json
+import os
+import statistics
+import sys
+import time
+
+import torch
+from PIL import Image
+
+from batch_classify import IMAGE_EXTS
+from quantization import model_size_bytes, quantize_dynamic_int8
+
+
+def load_samples(source, limit=None):
+    samples = []
+    if os.path.isdir(source):
+        for label in sorted(os.listdir(source)):
+            d = os.path.join(source, label)
+            if not os.path.isdir(d):
+                continue
+            for name in sorted(os.listdir(d)):
+                if name.lower().endswith(IMAGE_EXTS):
+                    samples.append((os.path.join(d, name), label))
+    else:
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source, newline="", encoding="utf-8") as f:
+            for row in csv.reader(f):
+                if len(row) < 2 or row[0] == "path":
+                    continue
+                p = row[0] if os.path.isabs(row[0]) else os.path.join(base, row[0])
+                samples.append((p, row[1].strip()))
+    return samples[:limit] if limit else samples
+
+
+def build_variant_runner(model_kind, model_id):
+    """
+    返回 (fp32_model, to_pixels(images) -> Tensor, predict(model, pixels) -> list[key])
+    """
+    if model_kind == "clip":
+        from categories import CATEGORIES
+        from backends import ClipEagerBackend
+        from clip_engine import load_clip, classify_pixels
+
+        # 量化只针对 eager 模型，与 ECOSCAN_BACKEND 无关
+        to_pixels, eager, scorer = load_clip(CATEGORIES, model_id, backend="eager")
+        model = eager.model
+
+        def predict(m, pixels):
+            return [cat for cat, _ in classify_pixels(ClipEagerBackend(m, scorer), scorer, pixels)]
+    else:
+        from mobilenet_engine import load_mobilenet
+
+        model, preprocess, mapper = load_mobilenet(backend="eager")
+
+        def to_pixels(images):
+            return torch.stack([preprocess(im) for im in images])
+
+        def predict(m, pixels):
+            with torch.no_grad():
+                rule_idx, _, _ = mapper.decide(m(pixels).softmax(-1))
+            return [mapper.keys[r] for r in rule_idx.tolist()]
+
+    return model, to_pixels, predict
+
+
+def run_variant(model, predict, batches):
+    # 预热一次，排除首次调用的初始化开销
+    predict(model, batches[0])
+    per_image_ms = []
+    preds = []
+    t0 = time.perf_counter()
+    for pixels in batches:
+        t = time.perf_counter()
+        preds.extend(predict(model, pixels))
+        per_image_ms.append((time.perf_counter() - t) * 1000 / len(pixels))
+    total = time.perf_counter() - t0
+    return preds, per_image_ms, total
+
+
+def summarize(name, model, preds, labels, per_image_ms, total):
+    per_image_ms = sorted(per_image_ms)
+    p95 = per_image_ms[min(len(per_image_ms) - 1, int(len(per_image_ms) * 0.95))]
+    return {
+        "variant": name,
+        "checkpoint_mb": round(model_size_bytes(model) / 2 ** 20, 2),
+        "ms_per_image_mean": round(statistics.fmean(per_image_ms), 3),
+        "ms_per_image_p50": round(statistics.median(per_image_ms), 3),
+        "ms_per_image_p95": round(p95, 3),
+        "images_per_s": round(len(preds) / total, 2),
+        "accuracy": round(sum(p == y for p, y in zip(preds, labels)) / len(labels), 4),
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Compare fp32 and int8 dynamic-quantized inference")
+    ap.add_argument("source", help="labeled sample dir (label/xxx.jpg) or CSV manifest (path,label)")
+    ap.add_argument("--model", choices=["clip", "mobilenet"], default="clip")
+    ap.add_argument("--model-id", default=None)
+    ap.add_argument("--batch-size", type=int, default=8)
+    ap.add_argument("--limit", type=int, default=None)
+    ap.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    ap.add_argument("--json", default=None, help="write the report as JSON")
+    args = ap.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    samples = load_samples(args.source, args.limit)
+    if not samples:
+        sys.exit(f"no labeled images found in {args.source}")
+
+    from clip_engine import CLIP_MODEL_ID
+    fp32_model, to_pixels, predict = build_variant_runner(args.model, args.model_id or CLIP_MODEL_ID)
+    int8_model = quantize_dynamic_int8(copy.deepcopy(fp32_model))
+
+    # 预处理只做一次，两种精度吃同一份输入
+    labels = [y for _, y in samples]
+    batches = []
+    for i in range(0, len(samples), args.batch_size):
+        images = [Image.open(p).convert("RGB") for p, _ in samples[i:i + args.batch_size]]
+        batches.append(to_pixels(images))
+
+    rows = []
+    results = {}
+    for name, m in (("fp32", fp32_model), ("int8", int8_model)):
+        preds, per_image_ms, total = run_variant(m, predict, batches)
+        results[name] = preds
+        rows.append(summarize(name, m, preds, labels, per_image_ms, total))
+
+    agreement = sum(a == b for a, b in zip(results["fp32"], results["int8"])) / len(labels)
+    report = {
+        "model": args.model,
+        "samples": len(samples),
+        "batch_size": args.batch_size,
+        "threads": torch.get_num_threads(),
+        "variants": rows,
+        "speedup": round(rows[1]["images_per_s"] / rows[0]["images_per_s"], 2),
+        "top1_agreement": round(agreement, 4),
+    }
+
+    print(f"{'variant':<8}{'ckpt MB':>10}{'ms/img':>10}{'p50':>10}{'p95':>10}{'img/s':>10}{'acc':>8}")
+    for r in rows:
+        print(f"{r['variant']:<8}{r['checkpoint_mb']:>10}{r['ms_per_image_mean']:>10}{r['ms_per_image_p50']:>10}"
+              f"{r['ms_per_image_p95']:>10}{r['images_per_s']:>10}{r['accuracy']:>8}")
+    print(f"speedup x{report['speedup']}   top-1 agreement {report['top1_agreement'] * 100:.1f}%")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有多进程部署 (serve.py 只支持 POSIX)，进程内锁就够了
+    fcntl = None
+
+# ==================================================
+# 用户确认过的标签 + CLIP 图像特征 → 磁盘上的紧凑向量索引，分类时和 prompt 分数一起投票
+# 存储 (每个模型一个目录，只追加)：
+#   vectors.f16  [n, dim] float16，L2 归一化，np.memmap 只读映射
+#   codes.u64    [n] 64 bit SimHash (随机超平面符号位)
+#   labels.u8    [n] 类别下标 (对应 meta.json 里的 labels)
+# 检索：先对 SimHash 做汉明距离粗筛 (与 result_cache 的感知哈希同一思路)，
+#      只对最近的 CANDIDATES 条做精确余弦重排，10 万条以上也在 1ms 以内
+# ==================================================
+# 与 clip_engine.CACHE_DIR 相同 (这里不导入 clip_engine，避免带上 torch)
+_CACHE_DIR = os.environ.get("ECOSCAN_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+# 与 clip_engine.CLIP_MODEL_ID 相同
+CLIP_MODEL_ID = os.environ.get("ECOSCAN_CLIP_MODEL", "openai/clip-vit-base-patch32")
+CORRECTIONS_DIR = os.environ.get("ECOSCAN_CORRECTIONS_DIR", os.path.join(_CACHE_DIR, "corrections"))
+# 参与投票的近邻数 / 最低余弦相似度 / 投票权重 (0 = 只记录不投票)
+KNN_K = int(os.environ.get("ECOSCAN_KNN_K", "8"))
+KNN_MIN_SIM = float(os.environ.get("ECOSCAN_KNN_MIN_SIM", "0.85"))
+KNN_WEIGHT = float(os.environ.get("ECOSCAN_KNN_WEIGHT", "0.5"))
+
+BITS = 64
+CANDIDATES = 256
+SAMPLE = 16
+SEED = 20240601
+
+
+# numpy < 2.0 没有 bitwise_count：按字节查 256 项的表
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], np.uint8)
+
+
+def popcount64(codes):
+    """
+    [n] uint64 → [n] 每个数里 1 的个数 (uint8)
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(codes)
+    return _POPCOUNT8[np.ascontiguousarray(codes, np.uint64).view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+
+def index_dir(model_id=CLIP_MODEL_ID, root=CORRECTIONS_DIR):
+    # 不同模型的特征空间不通用：按模型 id 分目录
+    return os.path.join(root, hashlib.sha256(model_id.encode("utf-8")).hexdigest()[:12])
+
+
+class CorrectionIndex:
+    """
+    add() 追加一条 (特征, 标签)，立即落盘；search() / vote() 只读 memmap。
+    多个 worker 进程共用一个目录：追加时加文件锁，读取前按文件大小发现别的进程新写入的行。
+    dim 为 None 时取已有索引的维度，空索引在第一次 add() 时按特征长度确定。
+    """
+
+    def __init__(self, path=None, model_id=CLIP_MODEL_ID, dim=None):
+        self.path = path or index_dir(model_id)
+        self.model_id = model_id
+        self.dim = None
+        os.makedirs(self.path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._vectors = self._codes = self._labels = None
+        self._n = 0
+        self._stats = {"added": 0, "searches": 0, "votes": 0}
+        self._weights = (1 << np.arange(BITS - 1, -1, -1, dtype=np.uint64)).astype(np.uint64)
+        self.planes = None
+        if dim is not None:
+            self._set_dim(dim)
+        self.meta = self._load_meta() if self.dim is not None or os.path.exists(self._file("meta.json")) else None
+
+    # ---------- 文件 ----------
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _load_meta(self):
+        meta_path = self._file("meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if self.dim is None:
+                self._set_dim(meta.get("dim"))
+            if meta.get("model_id") != self.model_id or meta.get("dim") != self.dim:
+                raise ValueError(f"{self.path} holds embeddings of {meta.get('model_id')!r} "
+                                 f"(dim {meta.get('dim')}), not {self.model_id!r} (dim {self.dim})")
+            return meta
+        meta = {"model_id": self.model_id, "dim": self.dim, "bits": BITS, "seed": SEED, "labels": []}
+        self._write_meta(meta)
+        return meta
+
+    def _set_dim(self, dim):
+        self.dim = int(dim)
+        # 投影矩阵由固定种子生成：所有进程、重启前后算出的 SimHash 一致
+        self.planes = np.random.default_rng(SEED).standard_normal((self.dim, BITS)).astype(np.float32)
+
+    def _write_meta(self, meta):
+        tmp = self._file(f"meta.json.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp, self._file("meta.json"))
+
+    def _count_on_disk(self):
+        if self.meta is None and os.path.exists(self._file("meta.json")):
+            # 另一个进程先建好了索引
+            self.meta = self._load_meta()
+        if self.meta is None:
+            return 0
+        sizes = []
+        for name, row in (("vectors.f16", 2 * self.dim), ("codes.u64", 8), ("labels.u8", 1)):
+            try:
+                sizes.append(os.path.getsize(self._file(name)) // row)
+            except OSError:
+                return 0
+        # 三个文件按 向量 → 哈希 → 标签 的顺序写：取最短的，写了一半的行不可见
+        return min(sizes)
+
+    def _refresh(self):
+        n = self._count_on_disk()
+        if n == self._n and self._vectors is not None:
+            return
+        if n == 0:
+            self._vectors = np.zeros((0, self.dim or 0), np.float16)
+            self._codes = np.zeros(0, np.uint64)
+            self._labels = np.zeros(0, np.uint8)
+        else:
+            # np.asarray：普通 ndarray 视图 (仍由 mmap 支撑)，省掉 memmap 子类每次索引的开销
+            self._vectors = np.asarray(np.memmap(self._file("vectors.f16"), np.float16, "r", shape=(n, self.dim)))
+            self._codes = np.asarray(np.memmap(self._file("codes.u64"), np.uint64, "r", shape=(n,)))
+            self._labels = np.asarray(np.memmap(self._file("labels.u8"), np.uint8, "r", shape=(n,)))
+            if len(self.meta["labels"]) <= int(self._labels.max()):
+                # 其他进程加入了新的标签名
+                self.meta = self._load_meta()
+        self._n = n
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return self._n
+
+    # ---------- 写 ----------
+    def simhash(self, vectors):
+        bits = (np.asarray(vectors, np.float32) @ self.planes) > 0
+        return (bits.astype(np.uint64) * self._weights).sum(axis=1, dtype=np.uint64)
+
+    def add(self, vector, label):
+        vector = np.asarray(vector, np.float32).reshape(1, -1)
+        if self.dim is None:
+            self._set_dim(vector.shape[1])
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        code = self.simhash(vector)
+        # meta.json 会被整体替换 (换 inode)，文件锁加在单独的 .lock 上
+        with self._lock, open(self._file(".lock"), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.meta = self._load_meta()
+            if label not in self.meta["labels"]:
+                self.meta["labels"].append(label)
+                self._write_meta(self.meta)
+            for name, data in (("vectors.f16", vector.astype(np.float16)), ("codes.u64", code),
+                               ("labels.u8", np.array([self.meta["labels"].index(label)], np.uint8))):
+                with open(self._file(name), "ab") as f:
+                    f.write(data.tobytes())
+            self._stats["added"] += 1
+
+    # ---------- 读 ----------
+    def search(self, query, k=KNN_K):
+        """
+        query: [dim] 图像特征 → [(label, cosine), ...] 按相似度降序，最多 k 条
+        """
+        with self._lock:
+            self._refresh()
+            vectors, codes, labels = self._vectors, self._codes, self._labels
+            names = self.meta["labels"] if self.meta else []
+        self._stats["searches"] += 1
+        n = len(codes)
+        if n == 0:
+            return []
+        query = np.asarray(query, np.float32).reshape(self.dim)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        if n <= CANDIDATES:
+            candidates = np.arange(n)
+        else:
+            # 汉明距离粗筛：用 1/SAMPLE 的抽样直方图估计能凑够 CANDIDATES 条的半径 (全量 bincount 比 XOR 还慢)，
+            # 不够再逐步放宽；大量重复画面挤在同一距离上时只保留最近的 CANDIDATES 条
+            dist = popcount64(codes ^ self.simhash(query[None])[0])
+            sample = np.cumsum(np.bincount(dist[::SAMPLE], minlength=BITS + 1)) * SAMPLE
+            radius = int(np.searchsorted(sample, CANDIDATES))
+            candidates = np.flatnonzero(dist <= radius)
+            while len(candidates) < min(CANDIDATES, n) // 2 and radius < BITS:
+                radius += 1
+                candidates = np.flatnonzero(dist <= radius)
+            if len(candidates) > 4 * CANDIDATES:
+                candidates = candidates[np.argsort(dist[candidates], kind="stable")[:CANDIDATES]]
+        # float16 → float32 转换 torch 比 numpy 快几倍 (向量化指令)；调用方此时已经加载了 torch
+        import torch
+        sims = (torch.from_numpy(np.ascontiguousarray(vectors[candidates])).float() @ torch.from_numpy(query)).numpy()
+        top = np.argsort(-sims)[:k]
+        return [(names[label], float(sim)) for label, sim in zip(labels[candidates[top]].tolist(), sims[top].tolist())]
+
+    def vote(self, features, cat_keys, k=KNN_K, min_sim=KNN_MIN_SIM):
+        """
+        [N, dim] 特征 → ([N, len(cat_keys)] 近邻投票分布, [N] 置信度)。
+        只统计相似度 ≥ min_sim 的近邻，按相似度加权；置信度 = 最相似那条的相似度 (没有近邻为 0)
+        """
+        features = np.asarray(features, np.float32)
+        votes = np.zeros((len(features), len(cat_keys)), np.float32)
+        strength = np.zeros(len(features), np.float32)
+        for i, f in enumerate(features):
+            for label, sim in self.search(f, k):
+                if sim < min_sim:
+                    break
+                if label in cat_keys:
+                    votes[i, cat_keys.index(label)] += sim
+                    strength[i] = max(strength[i], sim)
+        total = votes.sum(axis=1, keepdims=True)
+        np.divide(votes, total, out=votes, where=total > 0)
+        if strength.any():
+            self._stats["votes"] += int((strength > 0).sum())
+        return votes, strength
+
+    def blend(self, features, probs, cat_keys, weight=KNN_WEIGHT):
+        """
+        prompt 概率 [N, C] (torch) 与近邻投票混合：p = (1 - w·s)·p + w·s·votes，s 为近邻置信度
+        """
+        if weight <= 0 or not len(self):
+            return probs
+        import torch
+
+        votes, strength = self.vote(features, cat_keys)
+        if not strength.any():
+            return probs
+        w = torch.from_numpy(weight * strength).unsqueeze(1)
+        return (1 - w) * probs + w * torch.from_numpy(votes)
+
+    def stats(self):
+        s = dict(self._stats)
+        s["size"] = len(self)
+        s["labels"] = list(self.meta["labels"]) if self.meta else []
+        s["path"] = self.path
+        return s
@@ -0,0 +1,53 @@
+"""
+把视觉塔 (含缓存好的 prompt 矩阵) 和 MobileNetV3 导出成 TorchScript / ONNX
+
+    python export_models.py                       # 两个模型，两种格式
+    python export_models.py --model clip --format onnx
+
+导出后设置 ECOSCAN_BACKEND=torchscript 或 ECOSCAN_BACKEND=onnx 即可切换运行时。
+CATEGORIES 里的 prompt 改动后需要重新导出 CLIP。
+
+    python export_models.py --format safetensors  # 离线产物目录 (eager 权重 + 配置 + 校验清单)
+
+部署时设置 ECOSCAN_ARTIFACT_DIR 指向该目录，运行时不再访问网络 (见 artifacts.py)。
+"""
+import argparse
+
+from backends import EXPORT_DIR, export_clip, export_mobilenet
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Export inference graphs for the torchscript/onnx backends")
+    ap.add_argument("--model", choices=["clip", "mobilenet", "all"], default="all")
+    ap.add_argument("--format", choices=["torchscript", "onnx", "safetensors", "all"], default="all",
+                    help="all = torchscript + onnx; safetensors builds the offline artifact bundle")
+    ap.add_argument("--model-id", default=None, help="CLIP model id or local path")
+    ap.add_argument("--out", default=None,
+                    help="output directory (default: ECOSCAN_EXPORT_DIR, or ECOSCAN_ARTIFACT_DIR for safetensors)")
+    args = ap.parse_args(argv)
+
+    if args.format == "safetensors":
+        from artifacts import DEFAULT_BUNDLE_DIR, bundle_clip, bundle_mobilenet
+
+        out = args.out or DEFAULT_BUNDLE_DIR
+        if args.model in ("clip", "all"):
+            from clip_engine import CLIP_MODEL_ID
+            print(bundle_clip(args.model_id or CLIP_MODEL_ID, out))
+        if args.model in ("mobilenet", "all"):
+            print(bundle_mobilenet(out))
+        return
+
+    formats = ("torchscript", "onnx") if args.format == "all" else (args.format,)
+    written = []
+    if args.model in ("clip", "all"):
+        from categories import CATEGORIES
+        from clip_engine import CLIP_MODEL_ID
+        written += export_clip(CATEGORIES, args.model_id or CLIP_MODEL_ID, args.out or EXPORT_DIR, formats)
+    if args.model in ("mobilenet", "all"):
+        written += export_mobilenet(args.out or EXPORT_DIR, formats)
+    for path in written:
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+# ==================================================
+# 扫描记录持久化：SQLite (WAL)，写入批量化、放在后台线程，不占用请求路径
+# 首页 / 统计 / 个人页的数字都来自 SQL (user_id + 时间索引；总分、类别计数随写入增量维护)
+# ==================================================
+# 与 clip_engine.CACHE_DIR 相同 (这里不导入 clip_engine，避免带上 torch)
+_CACHE_DIR = os.environ.get("ECOSCAN_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+DB_PATH = os.environ.get("ECOSCAN_DB_PATH", os.path.join(_CACHE_DIR, "ecoscan.db"))
+# 写线程攒批的最长等待 (秒)
+FLUSH_INTERVAL = float(os.environ.get("ECOSCAN_DB_FLUSH_INTERVAL", "0.05"))
+# 提交失败 (如 database is locked) 时的退避重试间隔 (秒)；重试完仍失败的批次留到下一轮，不丢弃
+RETRY_BACKOFF = (0.05, 0.2, 1.0)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id       INTEGER PRIMARY KEY,
+    user_id  TEXT    NOT NULL,
+    ts       REAL    NOT NULL,
+    cat      TEXT    NOT NULL,
+    conf     REAL    NOT NULL,
+    pts      INTEGER NOT NULL,
+    item_key TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_scans_user_ts ON scans (user_id, ts DESC);
+CREATE INDEX IF NOT EXISTS idx_scans_ts ON scans (ts);
+CREATE TABLE IF NOT EXISTS users (
+    user_id      TEXT    PRIMARY KEY,
+    username     TEXT,
+    total_points INTEGER NOT NULL DEFAULT 0,
+    scans        INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS user_category_counts (
+    user_id TEXT    NOT NULL,
+    cat     TEXT    NOT NULL,
+    n       INTEGER NOT NULL,
+    PRIMARY KEY (user_id, cat)
+) WITHOUT ROWID;
+"""
+
+# 旧库升级：计数表是后加的，按已有记录回填一次
+BACKFILL_COUNTS = """
+INSERT OR IGNORE INTO user_category_counts (user_id, cat, n)
+SELECT user_id, cat, COUNT(*) FROM scans GROUP BY user_id, cat
+"""
+
+_STOP = object()
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+    # WAL：读写互不阻塞；多个 worker 进程共用一个文件时写入由 busy timeout 排队
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class HistoryStore:
+    """
+    record() / set_username() 只入队立即返回；读接口会先等已入队的写入落库，保证读到自己刚写的数据。
+    """
+
+    def __init__(self, path=DB_PATH, flush_interval=FLUSH_INTERVAL, max_batch=512):
+        self.path = path
+        self.flush_interval = float(flush_interval)
+        self.max_batch = int(max_batch)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = _connect(path)
+        try:
+            with conn:
+                conn.executescript(SCHEMA)
+                if conn.execute("SELECT 1 FROM user_category_counts LIMIT 1").fetchone() is None:
+                    conn.execute(BACKFILL_COUNTS)
+        finally:
+            conn.close()
+        self._queue = queue.Queue()
+        self._local = threading.local()
+        self._cond = threading.Condition()
+        self._enqueued = 0
+        self._committed = 0
+        self._stats = {"batches": 0, "rows": 0, "errors": 0, "retries": 0}
+        self._failing = None  # 最近一次提交失败的原因；成功提交后清空
+        self._thread = threading.Thread(target=self._writer, name="history-writer", daemon=True)
+        self._thread.start()
+
+    # ---------- 写 ----------
+    def _put(self, op):
+        with self._cond:
+            self._enqueued += 1
+        self._queue.put(op)
+
+    def record(self, user_id, cat, conf, pts, item_key=None, ts=None):
+        self._put(("scan", (user_id, time.time() if ts is None else ts, cat, float(conf), int(pts), item_key)))
+
+    def set_username(self, user_id, username):
+        self._put(("username", (user_id, username)))
+
+    def sync(self, timeout=2.0):
+        """
+        等到调用时已入队的写入全部提交 (写队列为空时立即返回)。
+        返回 False：超时，或数据库正在持续报错 (见 stats()["failing"]，写入仍在写线程里等待重试)
+        """
+        with self._cond:
+            target = self._enqueued
+            self._cond.wait_for(lambda: self._committed >= target or self._failing is not None, timeout)
+            return self._committed >= target
+
+    def _writer(self):
+        conn = _connect(self.path)
+        failed = []  # 重试后仍提交失败的写入：和之后的新写入一起再试
+        stop = False
+        while not stop:
+            try:
+                first = self._queue.get(timeout=RETRY_BACKOFF[-1] if failed else None)
+            except queue.Empty:
+                first = None
+            ops, failed = failed, []
+            if first is _STOP:
+                stop = True
+            elif first is not None:
+                ops.append(first)
+            deadline = time.monotonic() + self.flush_interval
+            while not stop and len(ops) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    op = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if op is _STOP:
+                    stop = True
+                    break
+                ops.append(op)
+            if ops and not self._commit(conn, ops):
+                failed = ops
+        conn.close()
+
+    def _commit(self, conn, ops):
+        scans = [row for kind, row in ops if kind == "scan"]
+        names = [row for kind, row in ops if kind == "username"]
+        per_user = {}
+        per_cat = {}
+        for user_id, _, cat, _, pts, _ in scans:
+            total, count = per_user.get(user_id, (0, 0))
+            per_user[user_id] = (total + pts, count + 1)
+            per_cat[(user_id, cat)] = per_cat.get((user_id, cat), 0) + 1
+        for backoff in (*RETRY_BACKOFF, None):
+            try:
+                self._apply(conn, scans, names, per_user, per_cat)
+                break
+            except sqlite3.Error as e:
+                if backoff is None:
+                    # 重试用完：整批留给写线程下一轮，读接口的 sync() 立即返回 False
+                    self._stats["errors"] += 1
+                    with self._cond:
+                        self._failing = f"{type(e).__name__}: {e}"
+                        self._cond.notify_all()
+                    return False
+                self._stats["retries"] += 1
+                time.sleep(backoff)
+        self._stats["batches"] += 1
+        self._stats["rows"] += len(ops)
+        with self._cond:
+            self._failing = None
+            self._committed += len(ops)
+            self._cond.notify_all()
+        return True
+
+    @staticmethod
+    def _apply(conn, scans, names, per_user, per_cat):
+        # 一个事务：失败时整体回滚，重试不会重复计分
+        with conn:
+            conn.executemany(
+                "INSERT INTO scans (user_id, ts, cat, conf, pts, item_key) VALUES (?, ?, ?, ?, ?, ?)", scans)
+            conn.executemany(
+                "INSERT INTO users (user_id, total_points, scans) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET total_points = total_points + excluded.total_points, "
+                "scans = scans + excluded.scans",
+                [(u, total, count) for u, (total, count) in per_user.items()])
+            # 类别计数随写入增量更新，统计页读取与历史长度无关
+            conn.executemany(
+                "INSERT INTO user_category_counts (user_id, cat, n) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id, cat) DO UPDATE SET n = n + excluded.n",
+                [(u, cat, n) for (u, cat), n in per_cat.items()])
+            conn.executemany(
+                "INSERT INTO users (user_id, username) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET username = excluded.username", names)
+
+    # ---------- 读 ----------
+    def _reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = _connect(self.path)
+        return conn
+
+    def _query(self, sql, args=()):
+        self.sync()
+        return self._reader().execute(sql, args).fetchall()
+
+    def totals(self, user_id):
+        """
+        返回 (扫描次数, 总积分)，users 表主键查询
+        """
+        rows = self._query("SELECT scans, total_points FROM users WHERE user_id = ?", (user_id,))
+        return rows[0] if rows else (0, 0)
+
+    def category_counts(self, user_id):
+        """
+        {cat: 次数}，读增量维护的计数表 (最多 类别数 行)，不扫描 scans
+        """
+        rows = self._query("SELECT cat, n FROM user_category_counts WHERE user_id = ? ORDER BY cat", (user_id,))
+        return dict(rows)
+
+    def recent(self, user_id, limit=10):
+        rows = self._query(
+            "SELECT ts, cat, conf, pts FROM scans WHERE user_id = ? ORDER BY ts DESC LIMIT ?", (user_id, limit))
+        return [{"cat": cat, "conf": conf, "pts": pts, "date": datetime.fromtimestamp(ts).strftime("%m-%d %H:%M")}
+                for ts, cat, conf, pts in rows]
+
+    def username(self, user_id):
+        rows = self._query("SELECT username FROM users WHERE user_id = ?", (user_id,))
+        return rows[0][0] if rows else None
+
+    def stats(self):
+        s = dict(self._stats)
+        s["pending"] = self._queue.qsize()
+        s["failing"] = self._failing
+        return s
+
+    def close(self, timeout=5.0):
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
@@ -0,0 +1,210 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# ==================================================
+# 进程内推理服务：所有 Streamlit session 共用一个推理线程
+# 并发请求排队后合并成 micro-batch，一次 forward 处理完再把结果分发回去
+# ==================================================
+MAX_BATCH_SIZE = int(os.environ.get("ECOSCAN_MAX_BATCH_SIZE", "16"))
+MAX_WAIT_MS = float(os.environ.get("ECOSCAN_MAX_WAIT_MS", "10"))
+
+# torch 线程池：0 = 保持 torch 默认值 (物理核数)
+INTRA_OP_THREADS = int(os.environ.get("ECOSCAN_INTRA_OP_THREADS", "0"))
+INTER_OP_THREADS = int(os.environ.get("ECOSCAN_INTER_OP_THREADS", "0"))
+# 同时进行的模型调用上限；排队超过 ADMISSION_TIMEOUT 秒直接报"忙"，页面不会一直挂着
+MAX_CONCURRENT = int(os.environ.get("ECOSCAN_MAX_CONCURRENT", "1"))
+ADMISSION_TIMEOUT = float(os.environ.get("ECOSCAN_ADMISSION_TIMEOUT", "30"))
+
+_STOP = object()
+
+
+class MicroBatcher:
+    """
+    batch_fn: list[item] -> list[result]，长度一一对应。
+    第一个请求到达后最多再等 max_wait_ms 凑批，凑满 max_batch_size 立即发车，
+    所以单个请求的额外排队延迟有上限。
+    """
+
+    def __init__(self, batch_fn, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS,
+                 name="inference-server"):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "batches": 0, "items": 0, "max_batch": 0}
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    # ---------- 调用方接口 ----------
+    def submit(self, item):
+        fut = Future()
+        with self._lock:
+            self._stats["requests"] += 1
+        self._queue.put((item, fut))
+        return fut
+
+    def map(self, items, timeout=None):
+        """
+        timeout 是整批的总等待时间；超时 (或调用方异常) 时把还没开始的请求撤掉，不白跑
+        """
+        futures = [self.submit(x) for x in items]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            return [f.result(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+                    for f in futures]
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            raise
+
+    def __call__(self, item, timeout=None):
+        return self.submit(item).result(timeout=timeout)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+        s["mean_batch"] = s["items"] / s["batches"] if s["batches"] else 0.0
+        s["queue_depth"] = self.queue_depth()
+        return s
+
+    def close(self, timeout=None):
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    # ---------- 后台线程 ----------
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # 队列里已有的请求不等待直接取走
+                nxt = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if nxt is _STOP:
+                return batch, True
+            batch.append(nxt)
+        return batch, False
+
+    def _loop(self):
+        stop = False
+        while not stop:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch, stop = self._collect(first)
+
+            # 调用方已经 cancel 的请求直接丢掉
+            live = [(x, f) for x, f in batch if f.set_running_or_notify_cancel()]
+            if not live:
+                continue
+
+            try:
+                results = self.batch_fn([x for x, _ in live])
+            except BaseException as e:
+                for _, f in live:
+                    f.set_exception(e)
+                continue
+
+            with self._lock:
+                self._stats["batches"] += 1
+                self._stats["items"] += len(live)
+                self._stats["max_batch"] = max(self._stats["max_batch"], len(live))
+            for (_, f), r in zip(live, results):
+                f.set_result(r)
+
+
+# ==================================================
+# 线程池配置 + 全局准入控制
+# 多个 session 同时推理时，每次调用都开满 intra-op 线程池会把 CPU 超卖，大家一起变慢；
+# 限制同时在跑的模型调用数，其余排队 (超时返回 Busy)
+# ==================================================
+def configure_threads(intra_op=INTRA_OP_THREADS, inter_op=INTER_OP_THREADS):
+    """
+    在第一次 torch 并行计算之前调用 (inter-op 线程池启动后不能再改)，返回生效的 (intra, inter)
+    """
+    import torch
+
+    if intra_op > 0:
+        torch.set_num_threads(intra_op)
+    if inter_op > 0:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError:
+            # 线程池已经启动过：保持原值
+            pass
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+class Busy(RuntimeError):
+    pass
+
+
+class AdmissionGate:
+    """
+    计数信号量 + 排队统计。with gate: ... 包住模型调用；等待超过 timeout 抛 Busy。
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT, timeout=ADMISSION_TIMEOUT):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.timeout = float(timeout)
+        self._sem = threading.BoundedSemaphore(self.max_concurrent)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._active = 0
+        self._stats = {"admitted": 0, "rejected": 0, "max_waiting": 0, "wait_s": 0.0}
+
+    def acquire(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        t0 = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+            self._stats["max_waiting"] = max(self._stats["max_waiting"], self._waiting)
+        ok = self._sem.acquire(timeout=timeout)
+        with self._lock:
+            self._waiting -= 1
+            if not ok:
+                self._stats["rejected"] += 1
+                raise Busy(f"inference queue full: waited {timeout:g}s")
+            self._active += 1
+            self._stats["admitted"] += 1
+            self._stats["wait_s"] += time.monotonic() - t0
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+        self._sem.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def waiting(self):
+        return self._waiting
+
+    def active(self):
+        return self._active
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s["waiting"] = self._waiting
+            s["active"] = self._active
+        s["mean_wait_ms"] = 1000 * s.pop("wait_s") / s["admitted"] if s["admitted"] else 0.0
+        s["max_concurrent"] = self.max_concurrent
+        return s
+
+
+# 进程内唯一
+GATE = AdmissionGate()
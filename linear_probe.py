@@ -0,0 +1,275 @@
+"""
+线性探针：在缓存好的 CLIP 图像特征上给每个类别训练一个 logistic 头，代替 prompt 集成打分
+
+    python linear_probe.py data/labeled/                          # 编码新图片 + 训练 + 写入产物目录
+    python linear_probe.py data/labeled/ --relabel cups=trash     # 改类别体系后重训：不再跑视觉塔
+    ECOSCAN_PROBE_DIR=.cache/artifacts streamlit run app.py
+
+- 目录结构：<root>/<标签>/**/*.jpg，子目录名即标签，必须是 categories.CATEGORIES 的 key (或经 --relabel 映射)
+- 图像特征按 文件内容哈希 缓存：移动 / 改标签 / 改类别 / 重新训练都直接读缓存，只有没见过的图片才编码
+- 头部 = [类别数, dim] 权重 + [类别数] 偏置，safetensors 存在 <产物目录>/probe/，和 artifacts.py 一样写清单、带校验
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+import torch
+
+from artifacts import DEFAULT_BUNDLE_DIR, WEIGHTS, ArtifactError, file_table, mmap_tensors, read_manifest, \
+    verify_component, write_manifest
+from clip_engine import CACHE_DIR, CLIP_MODEL_ID, LinearProbeScorer
+
+COMPONENT = "probe"
+
+
+# ==================================================
+# 1. 数据集：子目录名 = 标签
+# ==================================================
+def iter_labeled(root, relabel=None):
+    """
+    产出 (path, label)；relabel: {目录名: 类别 key}，用于合并 / 改名类别而不用挪文件
+    """
+    from batch_classify import iter_directory
+
+    relabel = relabel or {}
+    for entry in sorted(os.scandir(root), key=lambda e: e.name):
+        if entry.is_dir():
+            label = relabel.get(entry.name, entry.name)
+            for path in iter_directory(entry.path):
+                yield path, label
+
+
+def file_digest(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# ==================================================
+# 2. 特征缓存：内容哈希 → L2 归一化图像特征 (float16)
+# ==================================================
+def load_preprocess(model_id):
+    """
+    只读预处理配置 (不加载模型)，来源与 load_clip 一致：导出目录 / 产物目录 / model hub
+    """
+    import artifacts
+    import backends
+    from preprocess import FusedPreprocessor
+    from transformers import CLIPImageProcessor
+
+    if backends.BACKEND != "eager":
+        source = os.path.join(backends.EXPORT_DIR, "clip_processor")
+    elif artifacts.ARTIFACT_DIR:
+        source = os.path.join(artifacts.ARTIFACT_DIR, "clip")
+    else:
+        source = model_id
+    return FusedPreprocessor.from_image_processor(CLIPImageProcessor.from_pretrained(source))
+
+
+def feature_cache_path(model_id, preprocess, cache_dir=CACHE_DIR):
+    # 预处理参数 (尺寸 / 对比度 / 归一化) 也会改变特征，一起进 key
+    h = hashlib.sha256(model_id.encode("utf-8"))
+    h.update(repr((preprocess.size, preprocess.contrast, preprocess.scale.ravel().tolist(),
+                   preprocess.bias.ravel().tolist())).encode())
+    return os.path.join(cache_dir, f"probe_features_{h.hexdigest()[:16]}.pt")
+
+
+def load_feature_cache(path, model_id):
+    try:
+        cached = torch.load(path, map_location="cpu", weights_only=True)
+        if cached.get("model_id") == model_id:
+            return dict(zip(cached["keys"], cached["features"]))
+    except (OSError, RuntimeError, EOFError, AttributeError, KeyError):
+        pass
+    return {}
+
+
+def save_feature_cache(path, model_id, features):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    keys = list(features)
+    torch.save({"model_id": model_id, "keys": keys,
+                "features": torch.stack([features[k] for k in keys]) if keys else torch.zeros(0)}, tmp)
+    os.replace(tmp, path)
+
+
+def encode_missing(paths, digests, features, loaded, batch_size=32):
+    """
+    只编码缓存里没有的图片 (同一内容只算一次)，结果写回 features；返回新编码的张数
+    """
+    from preprocess import decode_image
+
+    preprocess, backend, _ = loaded
+    todo = list({d: p for p, d in zip(paths, digests) if d not in features}.items())
+    t0 = time.time()
+    for start in range(0, len(todo), batch_size):
+        chunk = todo[start:start + batch_size]
+        images = [decode_image(p, preprocess.size) for _, p in chunk]
+        image_features, _ = backend(preprocess(images))
+        for (d, _), f in zip(chunk, image_features.detach().float()):
+            features[d] = f.half()
+        done = start + len(chunk)
+        print(f"\rencoded {done}/{len(todo)}  {done / max(time.time() - t0, 1e-9):.1f} img/s",
+              end="", file=sys.stderr, flush=True)
+    if todo:
+        print(file=sys.stderr)
+    return len(todo)
+
+
+# ==================================================
+# 3. 训练：多类 logistic 回归 (全批量 L-BFGS，类别按频率反向加权)
+# ==================================================
+def fit_head(x, y, num_classes, l2=1e-3, max_iter=300):
+    """
+    x: [N, dim] 特征，y: [N] 类别下标 → (weight [C, dim], bias [C])
+    """
+    counts = torch.bincount(y, minlength=num_classes).float()
+    class_weight = counts.sum() / (num_classes * counts.clamp(min=1))
+    weight = torch.zeros(num_classes, x.shape[1], requires_grad=True)
+    bias = torch.zeros(num_classes, requires_grad=True)
+    opt = torch.optim.LBFGS([weight, bias], max_iter=max_iter, line_search_fn="strong_wolfe")
+
+    def closure():
+        opt.zero_grad()
+        logits = x @ weight.T + bias
+        loss = torch.nn.functional.cross_entropy(logits, y, weight=class_weight) + l2 * weight.pow(2).sum()
+        loss.backward()
+        return loss
+
+    opt.step(closure)
+    return weight.detach(), bias.detach()
+
+
+def holdout_mask(digests, fraction):
+    # 按内容哈希切分：重跑 / 加图片时已有图片的归属不变
+    return torch.tensor([int(d[:8], 16) % 1000 < fraction * 1000 for d in digests], dtype=torch.bool)
+
+
+def accuracy(pred, y):
+    return float((pred == y).float().mean()) if len(y) else float("nan")
+
+
+def prompt_baseline(x, classes, model_id, categories):
+    """
+    同一批特征上 prompt 集成的 top-1 (读磁盘上的文本特征缓存，没有就跳过)
+    """
+    from clip_engine import PromptScorer, build_prompts, text_cache_path
+
+    prompts, prompt_to_cat = build_prompts(categories)
+    try:
+        cached = torch.load(text_cache_path(model_id, prompts), map_location="cpu", weights_only=True)
+    except (OSError, RuntimeError, EOFError):
+        return None
+    scorer = PromptScorer(cached["features"], prompt_to_cat, 1.0)
+    logits = scorer.category_logits(x)
+    return [classes.index(scorer.cat_keys[i]) if scorer.cat_keys[i] in classes else -1
+            for i in logits.argmax(dim=-1).tolist()]
+
+
+# ==================================================
+# 4. 产物：保存 / 加载
+# ==================================================
+def save_probe(weight, bias, classes, model_id, artifact_dir=DEFAULT_BUNDLE_DIR, info=None):
+    from safetensors.torch import save_file
+
+    component_dir = os.path.join(artifact_dir, COMPONENT)
+    os.makedirs(component_dir, exist_ok=True)
+    save_file({"weight": weight.contiguous(), "bias": bias.contiguous()}, os.path.join(component_dir, WEIGHTS))
+    write_manifest(artifact_dir, COMPONENT, {
+        "model_id": model_id, "classes": list(classes), "dim": int(weight.shape[1]),
+        **(info or {}), "files": file_table(component_dir),
+    })
+    return component_dir
+
+
+def load_probe(artifact_dir, model_id, categories):
+    """
+    → LinearProbeScorer。模型不一致 / 头里有当前 CATEGORIES 没有的类别时直接报错 (需要重训)
+    """
+    if COMPONENT not in read_manifest(artifact_dir):
+        raise ArtifactError(f"artifact bundle {artifact_dir} has no linear probe (train one with: "
+                            f"python linear_probe.py <labeled dir> --out {artifact_dir})")
+    entry = verify_component(artifact_dir, COMPONENT)
+    if entry.get("model_id") != model_id:
+        raise ArtifactError(f"linear probe in {artifact_dir} was trained on {entry.get('model_id')!r} features, "
+                            f"but {model_id!r} is loaded (ECOSCAN_CLIP_MODEL)")
+    unknown = [c for c in entry["classes"] if c not in categories]
+    if unknown:
+        raise ArtifactError(f"linear probe in {artifact_dir} predicts unknown categories {unknown}; "
+                            f"retrain it after changing CATEGORIES")
+    path = os.path.join(artifact_dir, COMPONENT, WEIGHTS)
+    tensors = mmap_tensors(path)
+    return LinearProbeScorer(tensors["weight"].float(), tensors["bias"].float(), entry["classes"])
+
+
+# ==================================================
+# 5. 入口
+# ==================================================
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Train a linear-probe head on cached CLIP image embeddings")
+    ap.add_argument("root", help="labeled image directory: <root>/<category>/**/*.jpg")
+    ap.add_argument("--out", default=DEFAULT_BUNDLE_DIR, help="artifact directory (default: %(default)s)")
+    ap.add_argument("--model-id", default=None, help="CLIP model id or local path")
+    ap.add_argument("--relabel", action="append", default=[], metavar="DIR=CATEGORY",
+                    help="map a sub-directory to a category key (repeatable)")
+    ap.add_argument("--holdout", type=float, default=0.2, help="fraction held out for the accuracy report")
+    ap.add_argument("--l2", type=float, default=1e-3)
+    ap.add_argument("--batch-size", type=int, default=32)
+    return ap.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    from categories import CATEGORIES
+    from clip_engine import load_clip
+
+    model_id = args.model_id or CLIP_MODEL_ID
+    relabel = dict(item.split("=", 1) for item in args.relabel)
+    samples = list(iter_labeled(args.root, relabel))
+    unknown = sorted({label for _, label in samples if label not in CATEGORIES})
+    if unknown:
+        sys.exit(f"error: labels {unknown} are not CATEGORIES keys (use --relabel DIR=CATEGORY)")
+    if not samples:
+        sys.exit(f"error: no labeled images under {args.root}")
+
+    paths = [p for p, _ in samples]
+    digests = [file_digest(p) for p in paths]
+    cache_path = feature_cache_path(model_id, load_preprocess(model_id))
+    features = load_feature_cache(cache_path, model_id)
+    if any(d not in features for d in digests):
+        # 模型只在有新图片时才加载；probe="" 避免加载旧的头
+        encoded = encode_missing(paths, digests, features, load_clip(CATEGORIES, model_id, probe=""),
+                                 args.batch_size)
+        save_feature_cache(cache_path, model_id, features)
+    else:
+        encoded = 0
+    print(f"{len(samples)} images, {encoded} newly encoded, {len(samples) - encoded} from cache ({cache_path})")
+
+    classes = [c for c in CATEGORIES if any(label == c for _, label in samples)]
+    x = torch.stack([features[d] for d in digests]).float()
+    y = torch.tensor([classes.index(label) for _, label in samples])
+
+    held = holdout_mask(digests, args.holdout)
+    if held.any() and (~held).any():
+        weight, bias = fit_head(x[~held], y[~held], len(classes), args.l2)
+        probe_acc = accuracy((x[held] @ weight.T + bias).argmax(dim=-1), y[held])
+        baseline = prompt_baseline(x[held], classes, model_id, CATEGORIES)
+        print(f"holdout {int(held.sum())} images: probe top-1 {probe_acc:.3f}"
+              + (f", prompt ensemble top-1 {accuracy(torch.tensor(baseline), y[held]):.3f}" if baseline else ""))
+    # 报告完再用全部数据拟合最终的头
+    weight, bias = fit_head(x, y, len(classes), args.l2)
+    train_acc = accuracy((x @ weight.T + bias).argmax(dim=-1), y)
+    counts = torch.bincount(y, minlength=len(classes)).tolist()
+    component_dir = save_probe(weight, bias, classes, model_id, args.out, {
+        "samples": dict(zip(classes, counts)), "l2": args.l2, "train_accuracy": round(train_acc, 4),
+    })
+    print(f"saved {len(classes)}-class head to {component_dir} (train top-1 {train_acc:.3f})")
+    print(f"use it with: ECOSCAN_PROBE_DIR={args.out}")
+
+
+if __name__ == "__main__":
+    main()
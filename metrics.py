@@ -0,0 +1,181 @@
+import http.server
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# ==================================================
+# 分阶段耗时统计：内存直方图 + Prometheus 文本格式导出
+# 阶段：decode / preprocess / text_encode / vision / score / render (按模型区分)
+# 导出：ECOSCAN_METRICS_FILE (定期写文件，配合 node_exporter textfile collector)
+#      ECOSCAN_METRICS_PORT (HTTP GET /metrics；默认只监听 127.0.0.1，ECOSCAN_METRICS_HOST 可改)
+# ==================================================
+METRICS_INTERVAL = float(os.environ.get("ECOSCAN_METRICS_INTERVAL", "15"))
+
+# 秒；覆盖从预处理的几毫秒到冷启动的几十秒
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一格是 +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.last = 0.0
+
+    def observe(self, seconds):
+        i = 0
+        while i < len(self.buckets) and seconds > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += seconds
+        self.last = seconds
+
+    def quantile(self, q):
+        """
+        与 PromQL histogram_quantile 相同：在所在桶内线性插值
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if seen + c >= rank and c:
+                lo = self.buckets[i - 1] if i > 0 else 0.0
+                hi = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lo + (hi - lo) * (rank - seen) / c
+            seen += c
+        return self.buckets[-1]
+
+
+class Registry:
+    def __init__(self):
+        self._hists = {}
+        self._lock = threading.Lock()
+
+    def observe(self, model, stage, seconds):
+        with self._lock:
+            h = self._hists.get((model, stage))
+            if h is None:
+                h = self._hists[(model, stage)] = Histogram()
+            h.observe(seconds)
+
+    @contextmanager
+    def timer(self, model, stage, record=None):
+        """
+        with METRICS.timer("clip", "vision"): ...
+        record 传一个 dict 时同时写入本次调用的耗时，便于页面展示单次明细
+        """
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            dt = time.perf_counter() - t0
+            self.observe(model, stage, dt)
+            if record is not None:
+                record[stage] = record.get(stage, 0.0) + dt
+
+    def snapshot(self):
+        with self._lock:
+            items = sorted(self._hists.items())
+            return [{
+                "model": model, "stage": stage, "count": h.count,
+                "mean_ms": round(1000 * h.sum / h.count, 2) if h.count else 0.0,
+                "p50_ms": round(1000 * h.quantile(0.50), 2),
+                "p95_ms": round(1000 * h.quantile(0.95), 2),
+                "last_ms": round(1000 * h.last, 2),
+            } for (model, stage), h in items]
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP ecoscan_stage_seconds Per-stage latency of the classification pipeline.",
+            "# TYPE ecoscan_stage_seconds histogram",
+        ]
+        with self._lock:
+            for (model, stage), h in sorted(self._hists.items()):
+                labels = f'model="{model}",stage="{stage}"'
+                cumulative = 0
+                for le, c in zip(self.bucket_labels(h), h.counts):
+                    cumulative += c
+                    lines.append(f'ecoscan_stage_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f"ecoscan_stage_seconds_sum{{{labels}}} {h.sum:.6f}")
+                lines.append(f"ecoscan_stage_seconds_count{{{labels}}} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def bucket_labels(h):
+        return [f"{b:g}" for b in h.buckets] + ["+Inf"]
+
+    def clear(self):
+        with self._lock:
+            self._hists.clear()
+
+
+# 进程内唯一
+METRICS = Registry()
+
+
+# ==================================================
+# 导出
+# ==================================================
+def write_textfile(path, registry=METRICS):
+    # 先写临时文件再 rename：采集端不会读到写了一半的文件
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(registry.prometheus_text())
+    os.replace(tmp, path)
+
+
+def _file_loop(path, interval, registry):
+    while True:
+        try:
+            write_textfile(path, registry)
+        except OSError:
+            pass
+        time.sleep(interval)
+
+
+def _http_handler(registry):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+_started = set()
+_start_lock = threading.Lock()
+
+
+def start_exporters(registry=METRICS):
+    """
+    按环境变量启动导出 (调用时读取，serve.py 可以给每个 worker 设不同的端口/文件)；重复调用无副作用
+    """
+    path = os.environ.get("ECOSCAN_METRICS_FILE")
+    port = int(os.environ.get("ECOSCAN_METRICS_PORT", "0"))
+    # 指标不带鉴权：默认只给本机抓取，需要对外暴露时显式设 ECOSCAN_METRICS_HOST=0.0.0.0
+    host = os.environ.get("ECOSCAN_METRICS_HOST", "127.0.0.1")
+    with _start_lock:
+        if path and ("file", path) not in _started:
+            threading.Thread(target=_file_loop, args=(path, METRICS_INTERVAL, registry),
+                             name="metrics-file", daemon=True).start()
+            _started.add(("file", path))
+        if port and ("port", port) not in _started:
+            server = http.server.ThreadingHTTPServer((host, port), _http_handler(registry))
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+            _started.add(("port", port))
+        started = {kind: value for kind, value in _started}
+    return started
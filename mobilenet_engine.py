@@ -0,0 +1,173 @@
+import torch
+
+from metrics import METRICS
+
+# ==================================================
+# MobileNetV3 推理引擎 + 分类映射规则
+# 独立于 Streamlit，recycle_app.py 和命令行批处理共用
+# ==================================================
+
+
+def load_mobilenet(quantize=False, backend=None):
+    """
+    加载 MobileNetV3 轻量级模型 (预训练)，返回 (model, preprocess, mapper)
+    首次运行会自动下载权重 (约 10MB)；设置 ECOSCAN_ARTIFACT_DIR 时改为只读本地产物。失败直接抛异常
+    quantize=True 时分类头 Linear 走 int8 动态量化
+    backend 为 "torchscript" / "onnx" 时加载 export_models.py 导出的图，model 换成对应后端
+    """
+    import backends
+    from torchvision.models import mobilenet_v3_small, MobileNet_V3_Small_Weights
+
+    weights = MobileNet_V3_Small_Weights.DEFAULT
+    # 获取 ImageNet 的类别标签及预处理工具；类别 → 垃圾分类的映射在这里一次性编译好
+    preprocess = weights.transforms()
+    mapper = WasteMapper(weights.meta["categories"])
+
+    backend = backend or backends.BACKEND
+    if backend != "eager":
+        return backends.load_exported_mobilenet(backend), preprocess, mapper
+
+    import artifacts
+    if artifacts.ARTIFACT_DIR:
+        # 本地打包产物：不下载，权重内存映射
+        model = artifacts.load_mobilenet_artifact()
+    else:
+        model = mobilenet_v3_small(weights=weights)
+        model.eval()
+    if quantize:
+        from quantization import quantize_dynamic_int8
+        model = quantize_dynamic_int8(model)
+    return model, preprocess, mapper
+
+
+# === 增强版关键词库 ===
+# 针对 ImageNet 的奇怪分类进行归纳
+PLASTIC_KEYWORDS = [
+    'bottle', 'jug', 'plastic', 'nipple', 'dispenser', 'lotion',  # 奶瓶、洗手液
+    'tub', 'bucket', 'crate', 'canister', 'drum', 'container',  # 容器
+    'soap', 'sunscreen', 'perfume', 'shampoo', 'wash',  # 洗护
+    'cup', 'espresso', 'ping-pong', 'syringe', 'tray',  # 生活用品
+    'keyboard', 'mouse', 'remote', 'switch', 'modem',  # 电子塑料
+    'lighter', 'rule', 'mask', 'oxygen', 'snorkel'
+]
+
+PAPER_KEYWORDS = [
+    'carton', 'paper', 'box', 'envelope', 'book', 'packet', 'mail',
+    'ticket', 'menu', 'comic', 'binder', 'cardboard', 'tissue', 'towel'
+]
+
+METAL_KEYWORDS = [
+    'can', 'beer', 'soda', 'aluminum', 'tin', 'opener', 'thimble',
+    'toaster', 'iron', 'safety_pin', 'hook', 'corkscrew', 'chain'
+]
+
+GLASS_KEYWORDS = [
+    'glass', 'wine', 'cup', 'mug', 'beaker', 'goblet', 'vase',
+    'pitcher', 'hourglass', 'lens', 'lamp', 'bulb'
+]
+
+# (类别 key, 关键词, label, points, advice, color)，按顺序匹配，先中先得
+# 类别 key 与 categories.CATEGORIES 对齐，方便和 CLIP 结果对比
+WASTE_RULES = [
+    ("plastic", PLASTIC_KEYWORDS, "塑料 (Plastic/PET)", 10,
+     "1. 倒空内容物\n2. 移除标签\n3. 压扁瓶身", "#4ade80"),  # 亮绿色 (适合黑底)
+    ("paper", PAPER_KEYWORDS, "纸类 (Paper/Cardboard)", 5,
+     "1. 折叠纸箱\n2. 保持干燥\n3. 放入纸类桶", "#facc15"),  # 亮黄色
+    ("can", METAL_KEYWORDS, "金属罐 (Metal Can)", 15,
+     "1. 踩扁\n2. 放入金属回收桶", "#60a5fa"),  # 亮蓝色
+    ("glass", GLASS_KEYWORDS, "玻璃 (Glass)", 10,
+     "1. 小心轻放\n2. 去除瓶盖\n3. 放入玻璃桶", "#c084fc"),  # 亮紫色
+]
+
+DEFAULT_RULE = ("trash", "其他垃圾 (General Waste)", 1, "直接丢弃 / Throw away", "#ef4444")  # 红色 (默认)
+
+
+def map_category(category_name):
+    """
+    规则引擎 (Mapping Logic)：ImageNet 类名 → (key, label, points, advice, color)
+    只在 WasteMapper 编译映射表时调用
+    """
+    for key, keywords, label, points, advice, color in WASTE_RULES:
+        if any(k in category_name for k in keywords):
+            return key, label, points, advice, color
+    return DEFAULT_RULE
+
+
+class WasteMapper:
+    """
+    模型加载时把规则编译成 1000 项的 ImageNet 类别 → 规则下标表 (以及对应的 one-hot 矩阵)，
+    推理时不再做字符串匹配，整批 softmax 一次矩阵乘法得到各垃圾类别的分数。
+
+    类别由 top-1 ImageNet 类决定 (与逐张查表的旧逻辑一致)；分数 = 映射到该类别的所有 ImageNet 类概率之和。
+    不按分数取 argmax："其他垃圾"下有 ~880 个类，求和后几乎总是最大，会把中等置信度的瓶子也判成一般垃圾。
+    """
+
+    def __init__(self, class_names):
+        self.class_names = [c.lower() for c in class_names]  # 英文原名
+        self.outcomes = [rule[:1] + rule[2:] for rule in WASTE_RULES] + [DEFAULT_RULE]
+        self.keys = [o[0] for o in self.outcomes]
+        self.default_index = len(WASTE_RULES)
+
+        key_to_index = {k: i for i, k in enumerate(self.keys)}
+        self.table = torch.tensor([key_to_index[map_category(n)[0]] for n in self.class_names], dtype=torch.long)
+        self.matrix = torch.nn.functional.one_hot(self.table, len(self.outcomes)).float()
+
+    def scores(self, probs):
+        """
+        [N, 1000] softmax → [N, 规则数 + 1]
+        """
+        return probs @ self.matrix
+
+    def decide(self, probs):
+        """
+        返回 (规则下标, 分数, top-1 ImageNet 类下标)，均为长度 N 的张量
+        """
+        top = probs.argmax(dim=-1)
+        best = self.table[top]
+        return best, self.scores(probs).gather(-1, best.unsqueeze(-1)).squeeze(-1), top
+
+
+def check_mapper(mapper, top_prob=0.35):
+    """
+    自检：每个可回收类别挑一个映射到它的 ImageNet 类，给 top_prob 的概率、其余概率均摊，
+    结果必须仍是该类别。返回 [(类别 key, ImageNet 类名, 实际结果), ...] (空列表 = 通过)
+    """
+    failures = []
+    n = len(mapper.class_names)
+    for r, key in enumerate(mapper.keys[:mapper.default_index]):
+        c = int((mapper.table == r).nonzero()[0])
+        probs = torch.full((1, n), (1 - top_prob) / (n - 1))
+        probs[0, c] = top_prob
+        got = mapper.keys[int(mapper.decide(probs)[0])]
+        if got != key:
+            failures.append((key, mapper.class_names[c], got))
+    return failures
+
+
+def classify_batch(model, mapper, batch, record=None):
+    """
+    已预处理好的 [N, 3, H, W] → [(label, advice, points, category_name, score, color), ...]
+    category_name 为 top-1 ImageNet 类名 (调试用)，score 为所选垃圾类别的分数
+    record: 可选 dict，写入本次各阶段耗时 (秒)
+    """
+    with torch.no_grad():
+        with METRICS.timer("mobilenet", "vision", record):
+            prediction = model(batch).softmax(-1)
+        with METRICS.timer("mobilenet", "score", record):
+            rule_idx, score, class_id = mapper.decide(prediction)
+
+    results = []
+    for r, s, c in zip(rule_idx.tolist(), score.tolist(), class_id.tolist()):
+        _, label, points, advice, color = mapper.outcomes[r]
+        results.append((label, advice, points, mapper.class_names[c], s, color))
+    return results
+
+
+if __name__ == "__main__":
+    # python mobilenet_engine.py：只用类名表检查映射规则 (不加载权重)
+    from torchvision.models import MobileNet_V3_Small_Weights
+
+    bad = check_mapper(WasteMapper(MobileNet_V3_Small_Weights.DEFAULT.meta["categories"]))
+    for key, name, got in bad:
+        print(f"FAIL {name!r}: expected {key}, got {got}")
+    raise SystemExit(1 if bad else 0)
@@ -0,0 +1,78 @@
+import threading
+import time
+
+# ==================================================
+# 后台预加载：页面先渲染，模型权重在后台线程里加载
+# 用法：在 st.cache_resource 里创建 (进程内唯一)，真正需要模型时再 result() 等待
+# ==================================================
+
+# serve.py 在 fork 之前把已加载的模型放在这里，子进程直接复用 (权重页写时复制共享)
+_SHARED = {}
+
+
+def share(key, value):
+    _SHARED[key] = value
+
+
+def shared(key):
+    return _SHARED.get(key)
+
+
+class BackgroundLoader:
+    """
+    创建即开始在守护线程里执行 load_fn()。
+    ready() 不阻塞；result() 阻塞到加载结束，加载抛出的异常在这里原样抛出。
+    shared_key 对应的模型已由父进程 share() 过时直接就绪，不再加载。
+    """
+
+    def __init__(self, load_fn, name="model-preload", shared_key=None):
+        self.name = name
+        self.started_at = time.monotonic()
+        self.elapsed = None
+        self._load_fn = load_fn
+        self._value = None
+        self._error = None
+        self._done = threading.Event()
+        self._thread = None
+        if shared_key is not None and shared_key in _SHARED:
+            self._value = _SHARED[shared_key]
+            self.elapsed = 0.0
+            self._done.set()
+            return
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self._value = self._load_fn()
+        except BaseException as e:  # noqa: BLE001 - 交给 result() 的调用方处理
+            self._error = e
+        finally:
+            self.elapsed = time.monotonic() - self.started_at
+            self._done.set()
+
+    def ready(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"{self.name} still loading after {timeout}s")
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def status(self):
+        if not self.ready():
+            return "loading"
+        return "failed" if self._error is not None else "ready"
+
+    def stats(self):
+        return {
+            "status": self.status(),
+            "source": "shared" if self._thread is None else "loaded",
+            "seconds": round(self.elapsed if self.elapsed is not None else time.monotonic() - self.started_at, 2),
+            "error": f"{type(self._error).__name__}: {self._error}" if self._error is not None else None,
+        }
@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# ==================================================
+# 按需 torch.profiler：arm(N) 之后接下来 N 次模型调用各录一份 trace
+# 输出 <PROFILE_DIR>/<label>.<时间戳>.pt.trace.json (chrome://tracing / Perfetto / TensorBoard 都能打开)
+# 以及同名 .txt 的算子耗时/内存汇总。未 arm 时 capture() 只是一次整数比较，不导入 torch.profiler
+# ==================================================
+# 与 clip_engine.CACHE_DIR 相同 (这里不导入 clip_engine，避免带上 torch)
+_CACHE_DIR = os.environ.get("ECOSCAN_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+PROFILE_DIR = os.environ.get("ECOSCAN_PROFILE_DIR", os.path.join(_CACHE_DIR, "profiles"))
+# 启动时就 arm：ECOSCAN_PROFILE_NEXT=3 → 前 3 次调用各录一份
+PROFILE_NEXT = int(os.environ.get("ECOSCAN_PROFILE_NEXT", "0"))
+
+
+class OnDemandProfiler:
+    def __init__(self, out_dir=PROFILE_DIR, armed=0, keep=20):
+        self.out_dir = out_dir
+        self.keep = keep
+        self._remaining = int(armed)
+        self._busy = False
+        self._seq = 0
+        self._lock = threading.Lock()
+        self.recent = []  # 最近写出的 trace 路径
+
+    def arm(self, n=1):
+        with self._lock:
+            self._remaining = max(0, int(n))
+
+    def remaining(self):
+        return self._remaining
+
+    def _take(self):
+        # 同一时刻只允许一个 profiler 会话 (torch 不支持并发)；正在录制时其他调用照常执行
+        with self._lock:
+            if self._remaining <= 0 or self._busy:
+                return False
+            self._remaining -= 1
+            self._busy = True
+            return True
+
+    @contextmanager
+    def capture(self, label):
+        if self._remaining <= 0 or not self._take():
+            yield
+            return
+
+        from torch.profiler import ProfilerActivity, profile
+
+        try:
+            with profile(activities=[ProfilerActivity.CPU], record_shapes=True, profile_memory=True) as prof:
+                yield
+            self._export(prof, label)
+        finally:
+            with self._lock:
+                self._busy = False
+
+    def _export(self, prof, label):
+        os.makedirs(self.out_dir, exist_ok=True)
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+        base = os.path.join(self.out_dir, f"{label}.{time.strftime('%Y%m%d-%H%M%S')}.{os.getpid()}-{seq}")
+        prof.export_chrome_trace(base + ".pt.trace.json")
+        averages = prof.key_averages()
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(averages.table(sort_by="self_cpu_time_total", row_limit=30))
+            f.write("\n\n")
+            f.write(averages.table(sort_by="self_cpu_memory_usage", row_limit=15))
+        with self._lock:
+            self.recent.insert(0, base + ".pt.trace.json")
+            del self.recent[self.keep:]
+
+    def stats(self):
+        return {"armed": self._remaining, "recording": self._busy, "out_dir": self.out_dir, "recent": self.recent[:5]}
+
+
+# 进程内唯一
+PROFILER = OnDemandProfiler(armed=PROFILE_NEXT)
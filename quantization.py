@@ -0,0 +1,36 @@
+import io
+import os
+import warnings
+
+import torch
+
+# ==================================================
+# int8 动态量化 (仅 Linear 层，CPU 推理用)
+# 默认关闭；ECOSCAN_QUANTIZE=1 打开，精度影响用 compare_quantized.py 评估
+# ==================================================
+QUANTIZE = os.environ.get("ECOSCAN_QUANTIZE", "").lower() in ("1", "true", "yes")
+
+
+def quantize_dynamic_int8(model):
+    """
+    把 nn.Linear 换成 int8 动态量化版本 (权重 int8，激活运行时量化)。
+    CLIP ViT 的计算几乎都在 Linear 里，收益明显；MobileNetV3 主要是卷积，只有分类头受影响。
+    注意激活的量化范围按整批计算，同一张图在不同 batch 里的分数会有轻微差异。
+    """
+    from torch.ao.quantization import quantize_dynamic
+
+    with warnings.catch_warnings():
+        # 新版 torch 对量化张量 API 有 deprecation 提示，不影响使用
+        warnings.simplefilter("ignore", UserWarning)
+        qmodel = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    qmodel.eval()
+    return qmodel
+
+
+def model_size_bytes(model):
+    """
+    state_dict 序列化后的字节数，fp32 / int8 对比用
+    """
+    buf = io.BytesIO()
+    torch.save(model.state_dict(), buf)
+    return buf.getbuffer().nbytes
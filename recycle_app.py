@@ -1,8 +1,11 @@
 import streamlit as st
 import time
 from PIL import Image
-import torch
-from torchvision.models import mobilenet_v3_small, MobileNet_V3_Small_Weights
+
+# torch / torchvision 延迟到后台加载线程里导入，主页不等模型
+from metrics import METRICS, start_exporters
+from preload import BackgroundLoader
+from profiling import PROFILER
 
 # --- 1. 页面基础配置 ---
 st.set_page_config(
@@ -13,114 +16,77 @@ st.set_page_config(
 )
 
 
-# --- 2. 后端核心：加载 AI 模型 (带缓存) ---
-@st.cache_resource
-def load_model():
+# --- 2. 后端核心：后台加载 AI 模型 (带缓存) ---
+def _load_model():
     """
     加载 MobileNetV3 轻量级模型 (预训练)
     首次运行会自动下载权重 (约 10MB)
     """
+    from inference_server import configure_threads
+    from mobilenet_engine import load_mobilenet
+    from quantization import QUANTIZE
+    # 线程池要在第一次 torch 计算前设置
+    configure_threads()
+    # 失败时异常留在 loader 里，识别页显示原因
+    return load_mobilenet(quantize=QUANTIZE)
+
+
+@st.cache_resource
+def get_model_loader():
+    # 进程内唯一：页面渲染的同时在后台线程加载权重 (serve.py 部署时复用父进程共享的模型)
+    return BackgroundLoader(_load_model, name="mobilenet-preload", shared_key="mobilenet")
+
+
+def load_model():
     try:
-        weights = MobileNet_V3_Small_Weights.DEFAULT
-        model = mobilenet_v3_small(weights=weights)
-        model.eval()
-
-        # 获取 ImageNet 的类别标签及预处理工具
-        preprocess = weights.transforms()
-        categories = weights.meta["categories"]
-        return model, preprocess, categories
-    except Exception as e:
+        return get_model_loader().result()
+    except Exception:
         return None, None, None
 
 
-# 初始化模型
-model, preprocess, categories = load_model()
-model_loaded = (model is not None)
+# 启动后台加载 (不阻塞)
+get_model_loader()
 
 
-# --- 3. 核心业务逻辑：分类映射引擎 (修复版) ---
-def classify_waste(image):
-    if not model_loaded:
+@st.cache_resource
+def start_metrics_exporters():
+    # 进程内只启动一次：ECOSCAN_METRICS_FILE / ECOSCAN_METRICS_PORT
+    return start_exporters()
+
+
+start_metrics_exporters()
+
+
+# --- 3. 核心业务逻辑：分类映射引擎 (规则见 mobilenet_engine.py) ---
+def classify_waste(image, record=None):
+    """
+    record: 可选 dict，写入本次各阶段耗时 (秒)
+    """
+    from inference_server import GATE, Busy
+    from mobilenet_engine import classify_batch
+
+    model, preprocess, mapper = load_model()
+    if model is None:
         return "System Error", "AI 模型加载失败，请检查网络", 0, "Error", 0.0, "#ff0000"
 
     # A. 预处理图片
     try:
         # 确保图片是 RGB 格式
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-        batch = preprocess(image).unsqueeze(0)
+        with METRICS.timer("mobilenet", "preprocess", record):
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            batch = preprocess(image).unsqueeze(0)
     except Exception as e:
         return "Error", f"图片处理失败: {e}", 0, "Error", 0.0, "#ff0000"
 
-    # B. AI 推理
-    with torch.no_grad():
-        prediction = model(batch).squeeze(0).softmax(0)
-        # 获取前3名结果，增加容错
-        top3_prob, top3_id = torch.topk(prediction, 3)
-
-        # 取第一名作为主要依据
-        class_id = top3_id[0].item()
-        score = top3_prob[0].item()
-        category_name = categories[class_id].lower()  # 英文原名
-
-    # C. 规则引擎 (Mapping Logic) - 包含扩展关键词
-    label = "其他垃圾 (General Waste)"
-    points = 1
-    advice = "直接丢弃 / Throw away"
-    color = "#ef4444"  # 红色 (默认)
-
-    # === 增强版关键词库 ===
-    # 针对 ImageNet 的奇怪分类进行归纳
-    plastic_keywords = [
-        'bottle', 'jug', 'plastic', 'nipple', 'dispenser', 'lotion',  # 奶瓶、洗手液
-        'tub', 'bucket', 'crate', 'canister', 'drum', 'container',  # 容器
-        'soap', 'sunscreen', 'perfume', 'shampoo', 'wash',  # 洗护
-        'cup', 'espresso', 'ping-pong', 'syringe', 'tray',  # 生活用品
-        'keyboard', 'mouse', 'remote', 'switch', 'modem',  # 电子塑料
-        'lighter', 'rule', 'mask', 'oxygen', 'snorkel'
-    ]
-
-    paper_keywords = [
-        'carton', 'paper', 'box', 'envelope', 'book', 'packet', 'mail',
-        'ticket', 'menu', 'comic', 'binder', 'cardboard', 'tissue', 'towel'
-    ]
-
-    metal_keywords = [
-        'can', 'beer', 'soda', 'aluminum', 'tin', 'opener', 'thimble',
-        'toaster', 'iron', 'safety_pin', 'hook', 'corkscrew', 'chain'
-    ]
-
-    glass_keywords = [
-        'glass', 'wine', 'cup', 'mug', 'beaker', 'goblet', 'vase',
-        'pitcher', 'hourglass', 'lens', 'lamp', 'bulb'
-    ]
-
-    # 匹配逻辑
-    if any(k in category_name for k in plastic_keywords):
-        label = "塑料 (Plastic/PET)"
-        points = 10
-        advice = "1. 倒空内容物\n2. 移除标签\n3. 压扁瓶身"
-        color = "#4ade80"  # 亮绿色 (适合黑底)
-
-    elif any(k in category_name for k in paper_keywords):
-        label = "纸类 (Paper/Cardboard)"
-        points = 5
-        advice = "1. 折叠纸箱\n2. 保持干燥\n3. 放入纸类桶"
-        color = "#facc15"  # 亮黄色
-
-    elif any(k in category_name for k in metal_keywords):
-        label = "金属罐 (Metal Can)"
-        points = 15
-        advice = "1. 踩扁\n2. 放入金属回收桶"
-        color = "#60a5fa"  # 亮蓝色
-
-    elif any(k in category_name for k in glass_keywords):
-        label = "玻璃 (Glass)"
-        points = 10
-        advice = "1. 小心轻放\n2. 去除瓶盖\n3. 放入玻璃桶"
-        color = "#c084fc"  # 亮紫色
-
-    return label, advice, points, category_name, score, color
+    # B. AI 推理 + C. 规则引擎 (Mapping Logic，映射表加载时已编译)
+    # 全局准入：同时只有 ECOSCAN_MAX_CONCURRENT 个推理在跑，其余排队，超时返回"忙"
+    try:
+        # PROFILER 未 arm 时不做任何事；arm 后接下来的调用各录一份 torch.profiler trace
+        with GATE, PROFILER.capture("mobilenet"):
+            return classify_batch(model, mapper, batch, record)[0]
+    except Busy:
+        return "Busy", "服务器繁忙，请稍后再试 / Server busy, please retry", 0, "Busy", 0.0, "#f59e0b"
 
 
 # --- 4. 多语言字典 ---
@@ -133,7 +99,8 @@ TRANS = {
         "result_title": "识别结果",
         "ai_raw": "AI 原始识别结果", "conf": "置信度", "points": "获得积分",
         "status_ok": "系统在线", "status_model": "模型已加载",
-        "time": "推理耗时"
+        "time": "推理耗时",
+        "queue": "⏳ 排队中：前面还有 {n} 个推理请求"
     },
     "ko": {
         "title": "SmartRecycle 스마트 재활용",
@@ -143,7 +110,8 @@ TRANS = {
         "result_title": "분석 결과",
         "ai_raw": "AI 원본 인식값", "conf": "정확도", "points": "획득 포인트",
         "status_ok": "시스템 온라인", "status_model": "모델 로드됨",
-        "time": "분석 시간"
+        "time": "분석 시간",
+        "queue": "⏳ 대기 중: 앞에 {n}건의 분석이 있습니다"
     },
     "en": {
         "title": "SmartRecycle Pro",
@@ -153,7 +121,8 @@ TRANS = {
         "result_title": "Result",
         "ai_raw": "Raw AI Prediction", "conf": "Confidence", "points": "Points",
         "status_ok": "System Online", "status_model": "Model Loaded",
-        "time": "Inference Time"
+        "time": "Inference Time",
+        "queue": "⏳ Waiting: {n} inference request(s) ahead"
     }
 }
 
@@ -175,6 +144,20 @@ with st.sidebar:
     # 导航
     page = st.radio("Navigation", [t["nav_home"], t["nav_camera"], t["nav_data"]])
 
+    st.divider()
+    # 按需性能分析：侧边栏按钮或 URL ?profile=N
+    if "profile" in st.query_params:
+        try:
+            PROFILER.arm(int(st.query_params["profile"] or 1))
+        except ValueError:
+            pass
+        del st.query_params["profile"]
+    n_profile = st.number_input("Profile next N inferences", min_value=1, max_value=20, value=1)
+    if st.button("🔬 torch.profiler"):
+        PROFILER.arm(n_profile)
+    if PROFILER.remaining():
+        st.caption(f"profiler armed: {PROFILER.remaining()} left")
+
     st.divider()
     st.markdown("User: **Engineer_Py**")
     st.markdown("Level: **Eco Warrior (Lv.3)**")
@@ -204,29 +187,40 @@ if page == t["nav_home"]:
           ⬇️ (Tensor)
     [Inference Layer] PyTorch Engine (CPU/GPU)
           ⬇️ (Logits)
-    [Mapping Layer] Keyword Matching Rules
+    [Mapping Layer] Class→Category Table (compiled from keyword rules)
     """, language="text")
 
 elif page == t["nav_camera"]:
     st.header(f"📸 {t['nav_camera']}")
 
+    # 模型还在后台加载时在这里等待
+    with st.spinner("Loading model / 模型加载中..."):
+        model_loaded = load_model()[0] is not None
+
     if not model_loaded:
-        st.error("⚠️ AI Model not loaded. Check internet connection.")
+        st.error(f"⚠️ AI Model not loaded: {get_model_loader().stats()['error']}")
     else:
         uploaded_file = st.file_uploader(t["upload"], type=['jpg', 'png', 'jpeg', 'webp'])
 
         if uploaded_file:
-            # 加载并展示图片
-            image = Image.open(uploaded_file)
+            # 加载并展示图片 (Image.open 是惰性的，load() 才真正解码)
+            with METRICS.timer("mobilenet", "decode"):
+                image = Image.open(uploaded_file)
+                image.load()
             st.image(image, caption='Source Image', width=350)
 
             # 识别按钮
             if st.button("Start Inference / 开始分析", type="primary"):
+                from inference_server import GATE
+                ahead = GATE.waiting() + GATE.active()
+                if ahead:
+                    st.caption(t["queue"].format(n=ahead))
+                timings = {}
                 with st.spinner(t["analyzing"]):
-                    start_time = time.time()
                     # === 调用核心函数 ===
-                    label, advice, points, raw_name, score, color = classify_waste(image)
-                    end_time = time.time()
+                    with METRICS.timer("mobilenet", "total", timings):
+                        label, advice, points, raw_name, score, color = classify_waste(image, timings)
+                render_t0 = time.perf_counter()
 
                 # === 结果展示 (修复字体颜色问题) ===
                 st.markdown("---")
@@ -273,7 +267,7 @@ elif page == t["nav_camera"]:
                 with col1:
                     st.metric(label=t["points"], value=f"+{points} P")
                 with col2:
-                    st.metric(label=t["time"], value=f"{end_time - start_time:.3f} s")
+                    st.metric(label=t["time"], value=f"{timings['total']:.3f} s")
 
                 # 3. 调试信息
                 st.markdown("---")
@@ -285,6 +279,14 @@ elif page == t["nav_camera"]:
                     if raw_name in ['nipple', 'dispenser']:
                         st.caption("ℹ️ System Fix: 'nipple'/'dispenser' auto-corrected to Plastic (ImageNet quirk).")
 
+                    METRICS.observe("mobilenet", "render", time.perf_counter() - render_t0)
+                    # 本次各阶段耗时 + 进程内累计直方图
+                    st.markdown("**Stages:** " + " · ".join(
+                        f"{k} `{v * 1000:.1f} ms`" for k, v in timings.items() if k != "total"))
+                    st.dataframe(METRICS.snapshot(), use_container_width=True, hide_index=True)
+                    if PROFILER.recent:
+                        st.caption(f"latest trace: `{PROFILER.recent[0]}`")
+
 elif page == t["nav_data"]:
     st.header("📊 " + t["nav_data"])
     st.info("Simulation Data / 模拟数据")
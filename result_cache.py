@@ -0,0 +1,121 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+# ==================================================
+# 识别结果缓存：LRU + TTL
+# key = 像素内容哈希；可选感知哈希 (dHash) 匹配近似重复的画面 (同一物品再拍一张)
+# ==================================================
+CACHE_SIZE = int(os.environ.get("ECOSCAN_RESULT_CACHE_SIZE", "2048"))
+CACHE_TTL = float(os.environ.get("ECOSCAN_RESULT_CACHE_TTL", "3600"))
+# 感知哈希最大汉明距离 (0~64)；不设置 = 关闭近似匹配，只认完全相同的图
+PHASH_DISTANCE = int(os.environ.get("ECOSCAN_PHASH_DISTANCE", "-1"))
+
+
+def content_hash(image):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def perceptual_hash(image):
+    """
+    dHash：缩到 9×8 灰度，比较左右相邻像素 → 64 bit 整数
+    """
+    small = image.convert("L").resize((9, 8), Image.Resampling.BILINEAR)
+    px = small.tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (px[row * 9 + col] > px[row * 9 + col + 1])
+    return bits
+
+
+class ResultCache:
+    """
+    线程安全，所有 session 共用一份。
+    get() 命中时返回 (value, key)：近似命中时 key 是原条目的 key，调用方可据此判断"是不是同一件物品"。
+    """
+
+    def __init__(self, max_entries=CACHE_SIZE, ttl=CACHE_TTL, phash_distance=PHASH_DISTANCE):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self.phash_distance = int(phash_distance)
+        self._entries = OrderedDict()  # key -> (value, phash, expires_at)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "near_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    @property
+    def use_phash(self):
+        return self.phash_distance >= 0
+
+    def keys_for(self, image):
+        return content_hash(image), (perceptual_hash(image) if self.use_phash else None)
+
+    def get(self, key, phash=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[2] > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry[0], key
+                del self._entries[key]
+                self._stats["expired"] += 1
+
+            if phash is not None and self.use_phash:
+                match = self._nearest(phash, now)
+                if match is not None:
+                    self._entries.move_to_end(match)
+                    self._stats["near_hits"] += 1
+                    return self._entries[match][0], match
+
+            self._stats["misses"] += 1
+            return None
+
+    def contains(self, key, phash=None):
+        """
+        只探测是否会命中 (提前推理前判断要不要算)：不计入命中率、不调整 LRU 顺序
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] > now:
+                return True
+            return phash is not None and self.use_phash and self._nearest(phash, now) is not None
+
+    def _nearest(self, phash, now):
+        best, best_dist = None, self.phash_distance + 1
+        for k, (_, ph, expires) in self._entries.items():
+            if ph is None or expires <= now:
+                continue
+            d = (ph ^ phash).bit_count()
+            if d < best_dist:
+                best, best_dist = k, d
+        return best
+
+    def put(self, key, value, phash=None):
+        with self._lock:
+            self._entries[key] = (value, phash, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s["size"] = len(self._entries)
+        lookups = s["hits"] + s["near_hits"] + s["misses"]
+        s["hit_rate"] = (s["hits"] + s["near_hits"]) / lookups if lookups else 0.0
+        return s
@@ -0,0 +1,194 @@
+"""
+多进程部署：父进程只加载一次模型，再 fork 出 N 个 Streamlit worker，权重写时复制共享
+
+    python serve.py --workers 4                           # app.py，端口 8501-8504
+    python serve.py --app recycle_app.py --workers 2 --base-port 9000
+    python serve.py --workers 4 -- --server.address=0.0.0.0   # "--" 之后原样传给 streamlit run
+
+每个 worker 是独立的 Streamlit 服务 (各自一个端口)，前面用 nginx 等按端口分发，
+需要 sticky session：会话状态保存在 worker 进程内存里。
+推理时不会写权重，所以多一个 worker 只多出 Streamlit 本身和激活值的内存。
+worker 异常退出会自动重启 (复用同一份已加载的模型，不重新加载)。只支持 POSIX (os.fork)。
+"""
+import argparse
+import gc
+import os
+import signal
+import sys
+import time
+import traceback
+
+import preload
+
+# 应用 → 需要预加载的模型 (与 app.py / recycle_app.py 里 BackgroundLoader 的 shared_key 一致)
+APP_MODELS = {"app.py": "clip", "recycle_app.py": "mobilenet"}
+
+
+def load_shared(kind):
+    from quantization import QUANTIZE
+
+    if kind == "clip":
+        from categories import CATEGORIES
+        from clip_engine import CLIP_MODEL_ID, load_clip
+        return load_clip(CATEGORIES, CLIP_MODEL_ID, quantize=QUANTIZE)
+    from mobilenet_engine import load_mobilenet
+    return load_mobilenet(quantize=QUANTIZE)
+
+
+def memory_mb(pid):
+    """
+    /proc/<pid>/smaps_rollup → RSS / PSS (共享页按进程数均摊) / USS (进程私有)
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[1].isdigit():
+                    fields[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        return None
+    uss = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    return {"rss": fields.get("Rss", 0) / 1024, "pss": fields.get("Pss", 0) / 1024, "uss": uss / 1024}
+
+
+def print_memory(workers):
+    rows = [("supervisor", os.getpid())] + [(f"worker :{port}", pid) for pid, port in sorted(workers.items())]
+    print(f"{'process':<16}{'pid':>8}{'RSS MB':>10}{'PSS MB':>10}{'USS MB':>10}", flush=True)
+    for name, pid in rows:
+        m = memory_mb(pid)
+        if m is not None:
+            print(f"{name:<16}{pid:>8}{m['rss']:>10.1f}{m['pss']:>10.1f}{m['uss']:>10.1f}", flush=True)
+
+
+def run_worker(app_path, port, base_port, threads, streamlit_args):
+    import torch
+    from streamlit.web import cli
+
+    # 每个 worker 只用自己那份核，避免 N 个进程各开满线程池互相抢占
+    torch.set_num_threads(threads)
+    # 指标导出按 worker 区分：端口依次递增，文件名带上 worker 端口
+    offset = port - base_port
+    if os.environ.get("ECOSCAN_METRICS_PORT"):
+        os.environ["ECOSCAN_METRICS_PORT"] = str(int(os.environ["ECOSCAN_METRICS_PORT"]) + offset)
+    if os.environ.get("ECOSCAN_METRICS_FILE"):
+        root, ext = os.path.splitext(os.environ["ECOSCAN_METRICS_FILE"])
+        os.environ["ECOSCAN_METRICS_FILE"] = f"{root}.{port}{ext}"
+    cli.main(["run", app_path, f"--server.port={port}", "--server.headless=true", *streamlit_args],
+             prog_name="streamlit")
+
+
+def spawn(app_path, port, base_port, threads, streamlit_args):
+    pid = os.fork()
+    if pid:
+        return pid
+
+    # 子进程：恢复默认信号处理，交给 Streamlit 自己安装
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    code = 1
+    try:
+        run_worker(app_path, port, base_port, threads, streamlit_args)
+        code = 0
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 0
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        os._exit(code)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Load the model once and fork N Streamlit workers that share it")
+    ap.add_argument("--app", choices=sorted(APP_MODELS), default="app.py")
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--base-port", type=int, default=8501)
+    ap.add_argument("--threads", type=int, default=None, help="torch threads per worker (default: cores / workers)")
+    ap.add_argument("--stats-interval", type=float, default=60.0, help="print per-process memory every N s (0 = off)")
+    ap.add_argument("streamlit_args", nargs="*", help="extra args for streamlit run (after --)")
+    args = ap.parse_args(argv)
+
+    if not hasattr(os, "fork"):
+        sys.exit("serve.py needs os.fork (Linux / macOS); run streamlit directly on this platform")
+
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), args.app)
+    kinds = [APP_MODELS[args.app]]
+    from cascade import CASCADE
+    if args.app == "app.py" and CASCADE:
+        # 级联模式：app.py 同时用到 MobileNet (第一级)
+        kinds.append("mobilenet")
+    from inference_server import INTRA_OP_THREADS
+    threads = args.threads or INTRA_OP_THREADS or max(1, (os.cpu_count() or 1) // args.workers)
+
+    import torch
+    # 父进程全程单线程加载 (文本塔前向、int8 量化都在这里)：libgomp 的 OpenMP 线程池在 fork 后不可用，
+    # 父进程只要跑过一次多线程并行区，子进程第一次并行计算就会死锁 (batch_classify.py 用 spawn 也是这个原因)。
+    # 单线程时 torch 的并行循环直接内联执行，不创建线程池；每个 worker 在 run_worker 里再按 threads 放开
+    torch.set_num_threads(1)
+    t0 = time.perf_counter()
+    for kind in kinds:
+        preload.share(kind, load_shared(kind))
+    print(f"loaded {' + '.join(kinds)} in {time.perf_counter() - t0:.1f}s, forking {args.workers} workers", flush=True)
+    # 已有对象移出 GC 跟踪：子进程里的 GC 不会去碰 (写) 这些页，减少写时复制
+    gc.collect()
+    gc.freeze()
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    workers = {}
+    for i in range(args.workers):
+        port = args.base_port + i
+        workers[spawn(app_path, port, args.base_port, threads, args.streamlit_args)] = port
+        print(f"worker :{port} started", flush=True)
+
+    next_stats = time.monotonic() + args.stats_interval
+    while not stopping:
+        time.sleep(0.5)
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if not pid:
+                break
+            port = workers.pop(pid, None)
+            if port is None or stopping:
+                continue
+            print(f"worker :{port} exited ({os.waitstatus_to_exitcode(status)}), restarting", flush=True)
+            time.sleep(1.0)
+            workers[spawn(app_path, port, args.base_port, threads, args.streamlit_args)] = port
+        if args.stats_interval and time.monotonic() >= next_stats:
+            print_memory(workers)
+            next_stats = time.monotonic() + args.stats_interval
+
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + 10
+    while workers and time.monotonic() < deadline:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            workers.pop(pid, None)
+        else:
+            time.sleep(0.1)
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+if __name__ == "__main__":
+    main()
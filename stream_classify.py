@@ -0,0 +1,427 @@
+"""
+实时视频流分类：摄像头 / 本地视频持续识别，分拣站 kiosk 不用每件物品按一次按钮
+
+    python stream_classify.py --source 0                        # 摄像头 0 (需要 opencv-python)
+    python stream_classify.py --source belt.mp4 --fps 4         # 本地视频，按原始帧率回放 (需要 opencv-python)
+    python stream_classify.py --source frames/ --model mobilenet   # 图片目录 / 动图逐帧当作视频 (只需 Pillow)
+
+- 采集线程只保留最新一帧：推理跟不上时旧帧直接丢弃，延迟不会越积越多
+- 运动门控：和上一次识别的帧比较缩略图差分，画面没变就不跑模型
+- 时间平滑：各类别分数做指数滑动平均，新类别连续领先几次才切换显示结果，不会逐帧跳动
+- 输出：显示结果变化时打印一行 JSON；结束时打印统计
+Streamlit 里的 kiosk 页面见 app.py (?kiosk=1，视频源由 ECOSCAN_STREAM_SOURCE 指定)
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+# kiosk 页面用的视频源：摄像头编号 / 视频文件 / 图片目录；不设置 = 不开启
+STREAM_SOURCE = os.environ.get("ECOSCAN_STREAM_SOURCE", "")
+# 目标识别帧率 (每秒最多跑几次模型)
+STREAM_FPS = float(os.environ.get("ECOSCAN_STREAM_FPS", "4"))
+# 运动门控阈值：32×32 灰度缩略图的平均绝对差 (0~255)；0 = 每帧都识别
+MOTION_THRESHOLD = float(os.environ.get("ECOSCAN_MOTION_THRESHOLD", "6"))
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+# ==================================================
+# 1. 视频源
+# ==================================================
+class CvSource:
+    """
+    OpenCV 采集：数字 = 摄像头编号，其他 = 视频文件 / RTSP 地址。
+    本地文件按原始帧率节流读取 (realtime)，行为和真实摄像头一致：推理慢了就会丢帧。
+    """
+
+    def __init__(self, spec, realtime=True):
+        try:
+            import cv2
+        except ImportError:
+            raise RuntimeError("camera / video sources need opencv-python (pip install opencv-python-headless); "
+                               "image directories and GIFs work without it") from None
+        self._cv2 = cv2
+        self.live = spec.isdigit()
+        self.cap = cv2.VideoCapture(int(spec) if self.live else spec)
+        if not self.cap.isOpened():
+            raise RuntimeError(f"cannot open video source {spec!r}")
+        if self.live:
+            # 驱动端只缓冲 1 帧，读到的总是最新画面
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.realtime = realtime and not self.live
+
+    def read(self):
+        ok, frame = self.cap.read()
+        if not ok:
+            return None
+        # BGR → RGB
+        return Image.fromarray(self._cv2.cvtColor(frame, self._cv2.COLOR_BGR2RGB))
+
+    def close(self):
+        self.cap.release()
+
+
+class ImageSequenceSource:
+    """
+    图片目录 (按文件名排序) 或动图 (GIF / WebP) 逐帧回放，fps 为回放帧率。测试和离线演示用，不依赖 OpenCV。
+    """
+
+    def __init__(self, path, fps=10.0, realtime=True):
+        self.fps = float(fps)
+        self.realtime = realtime
+        self.live = False
+        if os.path.isdir(path):
+            names = sorted(n for n in os.listdir(path) if n.lower().endswith(IMAGE_EXTS))
+            self._frames = (Image.open(os.path.join(path, n)) for n in names)
+        else:
+            self._image = Image.open(path)
+            self._frames = ImageSequence.Iterator(self._image)
+
+    def read(self):
+        frame = next(self._frames, None)
+        return None if frame is None else frame.convert("RGB")
+
+    def close(self):
+        pass
+
+
+def open_source(spec, fps=None, realtime=True):
+    if os.path.isdir(spec) or spec.lower().endswith((".gif", ".webp")):
+        return ImageSequenceSource(spec, fps or 10.0, realtime)
+    return CvSource(spec, realtime)
+
+
+class LatestFrame:
+    """
+    单槽缓冲：采集线程不断覆盖，消费者取走最新一帧；被覆盖掉没取走的帧计入 dropped
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._taken = 0
+        self.dropped = 0
+        self.captured = 0
+        self.ended = False
+
+    def put(self, frame):
+        with self._cond:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = frame
+            self._seq += 1
+            self.captured += 1
+            self._cond.notify_all()
+
+    def end(self):
+        with self._cond:
+            self.ended = True
+            self._cond.notify_all()
+
+    def take(self, timeout=None):
+        """
+        等到有新帧 (或视频源结束)；返回 None 表示暂时没有新帧 / 已结束
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._frame is not None or self.ended, timeout)
+            frame, self._frame = self._frame, None
+            return frame
+
+
+def capture_loop(source, slot, stop):
+    interval = 1.0 / source.fps if source.realtime and source.fps else 0.0
+    next_t = time.monotonic()
+    try:
+        while not stop.is_set():
+            frame = source.read()
+            if frame is None:
+                break
+            slot.put(frame)
+            if interval:
+                next_t += interval
+                time.sleep(max(0.0, next_t - time.monotonic()))
+    finally:
+        slot.end()
+        source.close()
+
+
+# ==================================================
+# 2. 运动门控 + 时间平滑
+# ==================================================
+class MotionGate:
+    """
+    缩到 size×size 灰度后和"上一次识别的帧"比较平均绝对差；低于阈值说明画面没变，不必再跑模型。
+    参照帧只在识别成功后由调用方 commit() 更新：忙 / 出错跳过的变化帧下一帧仍算"有变化"，
+    缓慢的累积变化最终也会触发。
+    """
+
+    def __init__(self, threshold=MOTION_THRESHOLD, size=32):
+        self.threshold = float(threshold)
+        self.size = size
+        self._ref = None
+        self._pending = None
+        self.last_diff = None
+
+    def thumbnail(self, image):
+        # BOX 降采样只做一次整数缩减，1080p 帧也只要 1ms 左右
+        return np.asarray(image.resize((self.size, self.size), Image.Resampling.BOX).convert("L"), dtype=np.int16)
+
+    def changed(self, image):
+        thumb = self._pending = self.thumbnail(image)
+        if self._ref is None or self.threshold <= 0:
+            self.last_diff = None
+            return True
+        self.last_diff = float(np.abs(thumb - self._ref).mean())
+        return self.last_diff >= self.threshold
+
+    def commit(self):
+        # 最近一次 changed() 的帧已识别成功：以后和它比较
+        if self._pending is not None:
+            self._ref = self._pending
+
+
+class TemporalSmoother:
+    """
+    各类别分数 = 指数滑动平均 (本帧结果记 conf，其余记 0)；
+    新的领先类别要连续 min_streak 次保持领先才替换当前结果 (迟滞)，避免在两个类别之间来回跳
+    """
+
+    def __init__(self, alpha=0.5, min_streak=2):
+        self.alpha = float(alpha)
+        self.min_streak = max(1, int(min_streak))
+        self.scores = {}
+        self.label = None
+        self._candidate = None
+        self._streak = 0
+
+    @property
+    def pending(self):
+        # 有新类别领先但还没连续领先够 min_streak 次
+        return self._streak > 0
+
+    def update(self, category, confidence):
+        for k in self.scores:
+            self.scores[k] *= 1.0 - self.alpha
+        self.scores[category] = self.scores.get(category, 0.0) + self.alpha * confidence
+        leader = max(self.scores, key=self.scores.get)
+        if self.label is None:
+            self.label = leader
+        elif leader == self.label:
+            self._candidate, self._streak = None, 0
+        else:
+            if leader == self._candidate:
+                self._streak += 1
+            else:
+                self._candidate, self._streak = leader, 1
+            if self._streak >= self.min_streak:
+                self.label, self._candidate, self._streak = leader, None, 0
+        return self.label, self.scores[self.label]
+
+
+# ==================================================
+# 3. 流式分类
+# ==================================================
+def build_classifier(model_kind, loaded=None, quantize=False):
+    """
+    返回 fn(list[PIL.Image]) -> [(category, confidence), ...]
+    loaded: 已加载好的模型 (load_clip / load_mobilenet 的返回值)，传入时不再加载
+    """
+    if model_kind == "clip":
+        from clip_engine import classify_images
+
+        if loaded is None:
+            from categories import CATEGORIES
+            from clip_engine import CLIP_MODEL_ID, load_clip
+            loaded = load_clip(CATEGORIES, CLIP_MODEL_ID, quantize=quantize)
+        preprocess, backend, scorer = loaded
+        return lambda images: classify_images(preprocess, backend, scorer, images)
+
+    import torch
+    from mobilenet_engine import classify_batch, load_mobilenet
+
+    model, preprocess, mapper = loaded or load_mobilenet(quantize=quantize)
+
+    def run(images):
+        batch = torch.stack([preprocess(im) for im in images])
+        return [(label, score) for label, _, _, _, score, _ in classify_batch(model, mapper, batch)]
+    return run
+
+
+class StreamClassifier:
+    """
+    视频源 → 最新帧 → 运动门控 → 模型 → 时间平滑。
+    run() 在当前线程里按 fps 节拍循环 (命令行)；start() 放到后台线程 (kiosk 页面轮询 state())。
+    gate: 可选 inference_server.AdmissionGate，和网页扫描共用 CPU 时一个节拍内拿不到名额就跳过这一帧
+    prepare: 可选无参函数，每次推理前、拿名额之前调用 (例如等后台加载的模型就绪)
+    """
+
+    def __init__(self, source, classify, fps=STREAM_FPS, motion=None, smoother=None, gate=None, prepare=None):
+        self.source = source
+        self.classify = classify
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.motion = motion or MotionGate()
+        self.smoother = smoother or TemporalSmoother()
+        self.gate = gate
+        self.prepare = prepare
+        self.slot = LatestFrame()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {"classified": 0, "static": 0, "busy": 0, "errors": 0, "infer_s": 0.0}
+        self._state = {"frame": None, "label": None, "confidence": 0.0, "raw": None, "ts": None}
+        self.started_at = None
+
+    def _infer(self, frame):
+        if self.prepare is not None:
+            self.prepare()
+        if self.gate is None:
+            return self.classify([frame])[0]
+        from inference_server import Busy
+        try:
+            self.gate.acquire(timeout=self.interval or None)
+        except Busy:
+            self._stats["busy"] += 1
+            return None
+        try:
+            return self.classify([frame])[0]
+        finally:
+            self.gate.release()
+
+    def step(self, frame):
+        """
+        处理一帧；识别结果 (平滑后) 有变化时返回事件 dict，否则返回 None
+        """
+        with self._lock:
+            self._state["frame"] = frame
+        # 平滑器里有待确认的新类别时不走门控：新物品放下后画面通常只变一帧，迟滞要等的第二票只能来自静止帧
+        if not self.motion.changed(frame) and not self.smoother.pending:
+            self._stats["static"] += 1
+            return None
+        t0 = time.perf_counter()
+        try:
+            raw = self._infer(frame)
+        except Exception as e:
+            self._stats["errors"] += 1
+            with self._lock:
+                self._state["error"] = f"{type(e).__name__}: {e}"
+            return None
+        if raw is None:
+            return None
+        # 识别成功才更新参照帧：忙 / 出错时这次变化留给下一帧
+        self.motion.commit()
+        self._stats["infer_s"] += time.perf_counter() - t0
+        self._stats["classified"] += 1
+        previous = self._state["label"]
+        label, score = self.smoother.update(*raw)
+        with self._lock:
+            self._state.update(label=label, confidence=score, raw=raw, ts=time.time())
+        if label != previous:
+            return {"ts": round(time.time(), 3), "label": label, "confidence": round(score, 4),
+                    "raw": raw[0], "raw_confidence": round(raw[1], 4)}
+        return None
+
+    def run(self, on_event=None, max_frames=None):
+        self.started_at = time.monotonic()
+        capture = threading.Thread(target=capture_loop, args=(self.source, self.slot, self._stop),
+                                   name="stream-capture", daemon=True)
+        capture.start()
+        processed = 0
+        next_t = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                frame = self.slot.take(timeout=1.0)
+                if frame is None:
+                    if self.slot.ended:
+                        break
+                    continue
+                event = self.step(frame)
+                if event is not None and on_event is not None:
+                    on_event(event)
+                processed += 1
+                if max_frames and processed >= max_frames:
+                    break
+                # 固定节拍：这一拍剩下的时间睡掉，期间到达的帧只保留最新的
+                if self.interval:
+                    next_t = max(next_t + self.interval, time.monotonic() - self.interval)
+                    time.sleep(max(0.0, next_t - time.monotonic()))
+        finally:
+            self._stop.set()
+            capture.join(timeout=2.0)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="stream-classifier", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def state(self):
+        with self._lock:
+            return dict(self._state)
+
+    def stats(self):
+        s = dict(self._stats)
+        infer_s = s.pop("infer_s")
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+        s.update(captured=self.slot.captured, dropped=self.slot.dropped,
+                 mean_infer_ms=round(1000 * infer_s / s["classified"], 1) if s["classified"] else 0.0,
+                 classify_fps=round(s["classified"] / elapsed, 2) if elapsed else 0.0,
+                 last_motion=self.motion.last_diff)
+        return s
+
+
+# ==================================================
+# 4. 入口
+# ==================================================
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Continuous waste classification from a camera or video")
+    ap.add_argument("--source", default=STREAM_SOURCE or "0",
+                    help="camera index, video file / URL, image directory or GIF")
+    ap.add_argument("--model", choices=["clip", "mobilenet"], default="clip")
+    ap.add_argument("--fps", type=float, default=STREAM_FPS, help="max classifications per second")
+    ap.add_argument("--source-fps", type=float, default=None, help="playback rate for image directories / GIFs")
+    ap.add_argument("--no-realtime", action="store_true",
+                    help="read video files as fast as possible instead of at their native frame rate")
+    ap.add_argument("--motion-threshold", type=float, default=MOTION_THRESHOLD, help="0 = classify every frame")
+    ap.add_argument("--alpha", type=float, default=0.5, help="EMA weight of the newest prediction")
+    ap.add_argument("--min-streak", type=int, default=2, help="consecutive wins needed to switch label")
+    ap.add_argument("--max-frames", type=int, default=None)
+    ap.add_argument("--quantize", action="store_true", help="int8 dynamic quantization (CPU)")
+    return ap.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    from inference_server import configure_threads
+    from quantization import QUANTIZE
+    configure_threads()
+    classify = build_classifier(args.model, quantize=args.quantize or QUANTIZE)
+    source = open_source(args.source, args.source_fps, realtime=not args.no_realtime)
+    stream = StreamClassifier(source, classify, fps=args.fps,
+                              motion=MotionGate(args.motion_threshold),
+                              smoother=TemporalSmoother(args.alpha, args.min_streak))
+    try:
+        stream.run(on_event=lambda e: print(json.dumps(e, ensure_ascii=False), flush=True),
+                   max_frames=args.max_frames)
+    except KeyboardInterrupt:
+        stream.stop()
+    print(json.dumps(stream.stats()), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()